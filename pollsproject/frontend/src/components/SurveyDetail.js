@@ -140,7 +140,7 @@ function SurveyDetail({ token }) {
                   value={answers[question.id]}
                   onChange={(e) => handleAnswerChange(question.id, parseInt(e.target.value), 'rating')}
                 >
-                  {[...Array(10)].map((_, i) => (
+                  {[...Array(5)].map((_, i) => (
                     <option key={i + 1} value={i + 1}>{i + 1}</option>
                   ))}
                 </Form.Select>
@@ -19,9 +19,10 @@ function SurveyEdit({ token }) {
         setTitle(response.data.title);
         setIsActive(response.data.is_active);
         const loadedQuestions = response.data.questions.map(q => ({
+          id: q.id,
           text: q.text,
           type: q.question_type,
-          choices: q.choices_display || []
+          choices: (q.choices_display || []).map(c => ({ id: c.id, text: c.text }))
         }));
         setQuestions(loadedQuestions);
       })
@@ -32,12 +33,12 @@ function SurveyEdit({ token }) {
   }, [id, token]);
 
   const addQuestion = () => {
-    setQuestions([...questions, { text: '', type: 'radio', choices: [''] }]);
+    setQuestions([...questions, { text: '', type: 'radio', choices: [{ id: null, text: '' }] }]);
   };
 
   const addChoice = (questionIndex) => {
     const updatedQuestions = [...questions];
-    updatedQuestions[questionIndex].choices.push('');
+    updatedQuestions[questionIndex].choices.push({ id: null, text: '' });
     setQuestions(updatedQuestions);
   };
 
@@ -67,7 +68,7 @@ function SurveyEdit({ token }) {
 
   const handleChoiceChange = (questionIndex, choiceIndex, value) => {
     const updatedQuestions = [...questions];
-    updatedQuestions[questionIndex].choices[choiceIndex] = value;
+    updatedQuestions[questionIndex].choices[choiceIndex].text = value;
     setQuestions(updatedQuestions);
   };
 
@@ -81,7 +82,7 @@ function SurveyEdit({ token }) {
 
     for (const q of questions) {
       if (['radio', 'checkbox', 'ranking'].includes(q.type)) {
-        const validChoices = q.choices.filter(c => c.trim() !== '');
+        const validChoices = q.choices.filter(c => c.text.trim() !== '');
         if (validChoices.length === 0) {
           setError(`Для вопроса "${q.text || 'без названия'}" типа "${q.type}" требуется хотя бы один непустой вариант ответа.`);
           return;
@@ -93,9 +94,10 @@ function SurveyEdit({ token }) {
       title,
       is_active: isActive,
       questions: questions.map(q => ({
+        id: q.id,
         text: q.text,
         question_type: q.type,
-        choices: q.type === 'text' || q.type === 'rating' || q.type === 'yesno' ? [] : q.choices.filter(c => c.trim() !== '')
+        choices: q.type === 'text' || q.type === 'rating' || q.type === 'yesno' ? [] : q.choices.filter(c => c.text.trim() !== '')
       }))
     };
     console.log("Sending survey data:", surveyData);
@@ -187,7 +189,7 @@ function SurveyEdit({ token }) {
                     <div key={cIndex} className="d-flex mb-2">
                       <Form.Control
                         type="text"
-                        value={choice}
+                        value={choice.text}
                         onChange={(e) => handleChoiceChange(qIndex, cIndex, e.target.value)}
                         className="me-2"
                         required
@@ -6,6 +6,7 @@ import axios from 'axios';
 function SurveyList({ token, setToken }) {  
   const [surveys, setSurveys] = useState([]);
   const [user, setUser] = useState(null);  
+  const [next, setNext] = useState(null);
   const [showDeleteModal, setShowDeleteModal] = useState(false);
   const [surveyToDelete, setSurveyToDelete] = useState(null);
   const navigate = useNavigate();
@@ -18,12 +19,27 @@ function SurveyList({ token, setToken }) {
         console.log("Survey list data:", response.data);
         setSurveys(response.data.surveys); 
         setUser(response.data.user);      
+        setNext(response.data.next);
       })
       .catch(err => {
         console.error("Error loading surveys:", err.response?.data);
       });
   }, [token]);
 
+  // Список постраничный (курсор в ссылке next), следующие страницы дописываются в конец
+  const loadMore = () => {
+    axios.get(next, {
+      headers: { Authorization: `Token ${token}` }
+    })
+      .then(response => {
+        setSurveys(prev => prev.concat(response.data.surveys));
+        setNext(response.data.next);
+      })
+      .catch(err => {
+        console.error("Error loading surveys:", err.response?.data);
+      });
+  };
+
   const handleDelete = () => {
     axios.delete(`http://127.0.0.1:8000/api/surveys/${surveyToDelete.id}/`, {
       headers: { Authorization: `Token ${token}` }
@@ -87,6 +103,11 @@ function SurveyList({ token, setToken }) {
           </ListGroup.Item>
         ))}
       </ListGroup>
+      {next && (
+        <Button variant="secondary" onClick={loadMore} className="mt-3 me-2 btn-custom">
+          Показать ещё
+        </Button>
+      )}
       <Button as={Link} to="/create" variant="success" className="mt-3 btn-custom">
         <i className="bi bi-plus"></i> Создать опрос
       </Button>
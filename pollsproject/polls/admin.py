@@ -1,13 +1,24 @@
 from django.contrib import admin
 from .models import Survey, Question, Choice, Answer
+from .search import admin_search
+
+
+class FullTextSearchMixin:
+    # В PostgreSQL поиск идёт по GIN-индексу search_vector вместо ILIKE '%...%'
+    def get_search_results(self, request, queryset, search_term):
+        filtered = admin_search(queryset, search_term)
+        if filtered is None:
+            return super().get_search_results(request, queryset, search_term)
+        return filtered, False
+
 
 @admin.register(Survey)
-class SurveyAdmin(admin.ModelAdmin):
+class SurveyAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ('title', 'id')  
     search_fields = ('title',)      
 
 @admin.register(Question)
-class QuestionAdmin(admin.ModelAdmin):
+class QuestionAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ('text', 'survey', 'question_type', 'id')   
     list_filter = ('question_type', 'survey')              
     search_fields = ('text',)                              
@@ -18,6 +29,7 @@ class ChoiceAdmin(admin.ModelAdmin):
     list_filter = ('question',)               
     search_fields = ('text',)                 
 @admin.register(Answer)
-class AnswerAdmin(admin.ModelAdmin):
+class AnswerAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ('question', 'choice', 'text_answer', 'id')  
-    list_filter = ('question',)                                 
\ No newline at end of file
+    list_filter = ('question',)                                 
+    search_fields = ('text_answer',)
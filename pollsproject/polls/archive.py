@@ -0,0 +1,261 @@
+import bisect
+import itertools
+import json
+import mmap
+import os
+import struct
+from array import array
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+
+from .models import Answer, RankingPosition, Survey
+
+MAGIC = b'POLLSARC1\n'
+ALIGN = 8
+RESTORE_BATCH_SIZE = 5000
+
+# Колонки с фиксированной шириной (код типа array) и колонки строк переменной длины
+FIXED = {
+    'id': 'q',
+    'user_id': 'q',
+    'question_id': 'q',
+    'choice_id': 'q',
+    'rating_answer': 'q',
+    'yesno_answer': 'b',
+    'nulls': 'B',
+}
+STRINGS = ('text_answer', 'ranking_answer')
+# Порядок полей в строках, которые отдаёт архив; совпадает с values_list в iter_rows
+FIELDS = ('id', 'user_id', 'question_id', 'choice_id', 'text_answer', 'rating_answer', 'yesno_answer', 'ranking_answer')
+# Биты колонки nulls: какие из nullable-полей строки равны NULL
+NULLABLE = ('user_id', 'choice_id', 'text_answer', 'rating_answer', 'yesno_answer', 'ranking_answer')
+
+
+def archive_root():
+    return Path(getattr(settings, 'POLLS_ARCHIVE_ROOT', settings.BASE_DIR / 'archive'))
+
+
+def archive_path(survey_id):
+    return archive_root() / f'survey-{survey_id}.pac'
+
+
+class ArchiveWriter:
+    """Собирает строки ответов в колонки и пишет их одним файлом.
+
+    Формат: MAGIC, длина заголовка (uint32), JSON-заголовок с расположением
+    колонок, затем сами колонки, выровненные по 8 байт. Строковые колонки
+    хранятся как смещения (int64, rows + 1) и общий буфер UTF-8.
+    """
+
+    def __init__(self):
+        self.columns = {name: array(code) for name, code in FIXED.items()}
+        self.strings = {name: (array('q', [0]), bytearray()) for name in STRINGS}
+        self.rows = 0
+
+    def add(self, row):
+        values = dict(zip(FIELDS, row))
+        nulls = 0
+        for bit, name in enumerate(NULLABLE):
+            if values[name] is None:
+                nulls |= 1 << bit
+        values['ranking_answer'] = None if values['ranking_answer'] is None else json.dumps(values['ranking_answer'])
+        for name in FIXED:
+            if name != 'nulls':
+                self.columns[name].append(int(values[name] or 0))
+        self.columns['nulls'].append(nulls)
+        for name in STRINGS:
+            offsets, buffer = self.strings[name]
+            buffer += (values[name] or '').encode()
+            offsets.append(len(buffer))
+        self.rows += 1
+
+    def write(self, path, survey_id):
+        blobs = dict((name, column.tobytes()) for name, column in self.columns.items())
+        for name, (offsets, buffer) in self.strings.items():
+            blobs[f'{name}.offsets'] = offsets.tobytes()
+            blobs[f'{name}.data'] = bytes(buffer)
+        layout, position = {}, 0
+        for name, blob in blobs.items():
+            layout[name] = [position, len(blob)]
+            position += -len(blob) % ALIGN + len(blob)
+        header = json.dumps({'survey': survey_id, 'rows': self.rows, 'columns': layout}).encode()
+        start = len(MAGIC) + 4 + len(header)
+        start += -start % ALIGN
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix('.tmp')
+        with open(temporary, 'wb') as output:
+            output.write(MAGIC + struct.pack('<I', len(header)) + header)
+            output.write(b'\0' * (start - output.tell()))
+            for blob in blobs.values():
+                output.write(blob + b'\0' * (-len(blob) % ALIGN))
+            output.flush()
+            os.fsync(output.fileno())
+        os.replace(temporary, path)
+        return path
+
+
+class AnswerArchive:
+    """Архив ответов опроса, отображённый в память; колонки читаются без копирования.
+
+    Строки упорядочены по (user_id, id), поэтому ответы одного пользователя
+    находятся двоичным поиском.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as source:
+            self._mmap = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path}: не архив ответов')
+        (size,) = struct.unpack_from('<I', self._mmap, len(MAGIC))
+        header = json.loads(self._mmap[len(MAGIC) + 4:len(MAGIC) + 4 + size])
+        start = len(MAGIC) + 4 + size
+        start += -start % ALIGN
+        self.survey_id = header['survey']
+        self.rows = header['rows']
+        view = memoryview(self._mmap)
+        self._views = [view]
+        self.columns = {}
+        for name, (offset, length) in header['columns'].items():
+            column = view[start + offset:start + offset + length]
+            code = FIXED.get(name, 'q' if name.endswith('.offsets') else None)
+            self.columns[name] = column.cast(code) if code else column
+            self._views.append(self.columns[name])
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _string(self, name, index):
+        offsets, data = self.columns[f'{name}.offsets'], self.columns[f'{name}.data']
+        return bytes(data[offsets[index]:offsets[index + 1]]).decode()
+
+    def row(self, index):
+        nulls = self.columns['nulls'][index]
+        values = {}
+        for name in FIELDS:
+            if name in STRINGS:
+                values[name] = self._string(name, index)
+            else:
+                values[name] = self.columns[name][index]
+        values['yesno_answer'] = bool(values['yesno_answer'])
+        values['ranking_answer'] = json.loads(values['ranking_answer']) if values['ranking_answer'] else None
+        for bit, name in enumerate(NULLABLE):
+            if nulls & (1 << bit):
+                values[name] = None
+        return tuple(values[name] for name in FIELDS)
+
+    def __iter__(self):
+        return (self.row(index) for index in range(self.rows))
+
+    def for_user(self, user_id):
+        users = self.columns['user_id']
+        start = bisect.bisect_left(users, user_id)
+        stop = bisect.bisect_right(users, user_id, lo=start)
+        # Анонимные ответы хранятся с user_id = 0 и флагом NULL
+        return [row for row in map(self.row, range(start, stop)) if row[1] == user_id]
+
+
+def open_archive(survey):
+    return AnswerArchive(archive_path(survey.pk))
+
+
+def iter_rows(survey, chunk_size=2000):
+    """Строки ответов опроса (поля FIELDS) из таблицы или из архива, упорядоченные по (user_id, id)."""
+    if survey.is_archived:
+        with open_archive(survey) as archive:
+            yield from archive
+        return
+    yield from (
+        # Анонимные ответы первыми на любой СУБД: в архиве у них user_id = 0
+        Answer.objects.for_survey(survey).order_by(F('user_id').asc(nulls_first=True), 'id')
+        .values_list(*FIELDS).iterator(chunk_size=chunk_size)
+    )
+
+
+def user_rows(survey, user):
+    if survey.is_archived:
+        with open_archive(survey) as archive:
+            return archive.for_user(user.pk)
+    return list(Answer.objects.for_survey(survey).filter(user=user).order_by('id').values_list(*FIELDS))
+
+
+def answer_objects(survey, rows, questions):
+    """Несохранённые Answer из строк FIELDS для чтения вместо таблицы; questions — {id: Question}."""
+    answers = []
+    for row in rows:
+        values = dict(zip(FIELDS, row))
+        question = questions.get(values['question_id'])
+        if question is None:
+            continue
+        answer = Answer(survey_id=survey.pk, **values)
+        answer.question = question
+        if answer.choice_id is not None:
+            if not hasattr(question, '_choice_map'):
+                question._choice_map = {choice.id: choice for choice in question.choices.all()}
+            answer.choice = question._choice_map.get(answer.choice_id)
+        answers.append(answer)
+    return answers
+
+
+def archive_survey(survey):
+    """Переносит ответы закрытого опроса в файл архива и удаляет их из polls_answer."""
+    if survey.is_active:
+        raise ValueError(f'Опрос {survey.pk} активен, архивировать можно только закрытые опросы')
+    if survey.is_archived:
+        raise ValueError(f'Опрос {survey.pk} уже в архиве')
+    writer = ArchiveWriter()
+    for row in iter_rows(survey):
+        writer.add(row)
+    path = writer.write(archive_path(survey.pk), survey.pk)
+    try:
+        with transaction.atomic():
+            # Места удаляются отдельно (on_delete=DO_NOTHING): так оба DELETE выполняются без выборки id
+            RankingPosition.objects.filter(question_id__in=survey.questions.values('id')).delete()
+            _, deleted = Answer.objects.for_survey(survey).delete()
+            # Ответ, появившийся после чтения, не попал бы в архив
+            if deleted.get(Answer._meta.label, 0) != writer.rows:
+                raise ValueError(f'Ответы опроса {survey.pk} изменились во время архивации')
+            Survey.objects.filter(pk=survey.pk).update(is_archived=True)
+    except Exception:
+        path.unlink(missing_ok=True)
+        raise
+    survey.is_archived = True
+    return writer.rows, path
+
+
+def restore_survey(survey, batch_size=RESTORE_BATCH_SIZE):
+    """Возвращает ответы из архива в polls_answer с прежними id и удаляет файл архива."""
+    if not survey.is_archived:
+        raise ValueError(f'Опрос {survey.pk} не в архиве')
+    questions = set(survey.questions.values_list('id', flat=True))
+    choices = set(survey.questions.values_list('choices__id', flat=True))
+    restored = 0
+    with transaction.atomic():
+        with open_archive(survey) as archive:
+            # Ответы на вопросы и варианты, удалённые после архивации, не восстанавливаются
+            rows = (row for row in archive if row[2] in questions and (row[3] is None or row[3] in choices))
+            while batch := list(itertools.islice(rows, batch_size)):
+                # Как и вопросы с вариантами, удалённые после архивации пользователи уносят свои ответы
+                users = set(User.objects.filter(pk__in={row[1] for row in batch if row[1] is not None})
+                            .values_list('pk', flat=True))
+                batch = [row for row in batch if row[1] is None or row[1] in users]
+                answers = Answer.objects.bulk_create(Answer(survey=survey, **dict(zip(FIELDS, row))) for row in batch)
+                RankingPosition.objects.create_for(answers, choices)
+                restored += len(batch)
+        Survey.objects.filter(pk=survey.pk).update(is_archived=False)
+        transaction.on_commit(lambda: archive_path(survey.pk).unlink(missing_ok=True))
+    survey.is_archived = False
+    return restored
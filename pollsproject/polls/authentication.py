@@ -0,0 +1,101 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication
+
+DEFAULT_TOKEN_CACHE = {
+    'MAX_ENTRIES': 10000,
+    'TIMEOUT': 60,
+}
+
+
+class TokenCache:
+    """Ключ токена -> (пользователь, токен) с ограниченным размером и временем жизни.
+
+    Кэш живёт в памяти процесса: удаление токена в другом процессе станет
+    видно здесь не позже чем через TIMEOUT секунд.
+    """
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def discard_user(self, user_id):
+        with self._lock:
+            for key in [key for key, (_, (user, _)) in self._data.items() if user.pk == user_id]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_token_cache = None
+
+
+def get_token_cache():
+    global _token_cache
+    if _token_cache is None:
+        config = {**DEFAULT_TOKEN_CACHE, **getattr(settings, 'TOKEN_CACHE', {})}
+        _token_cache = TokenCache(config['MAX_ENTRIES'], config['TIMEOUT'])
+    return _token_cache
+
+
+@receiver(setting_changed)
+def reset_token_cache(setting, **kwargs):
+    global _token_cache
+    if setting == 'TOKEN_CACHE':
+        _token_cache = None
+
+
+def remember_token(token):
+    # Прогрев кэша при входе и регистрации
+    get_token_cache().set(token.key, (token.user, token))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, который не ходит в БД за уже проверенным токеном.
+
+    Записи удаляются при удалении токена и при любом сохранении или удалении
+    пользователя (например, деактивации), см. polls.signals.
+    """
+
+    def authenticate_credentials(self, key):
+        cache = get_token_cache()
+        cached = cache.get(key)
+        if cached is None:
+            cached = super().authenticate_credentials(key)
+            cache.set(key, cached)
+        # Копия пользователя: изменения в одном запросе не должны попасть в кэш
+        user, token = cached
+        return copy.copy(user), token
@@ -0,0 +1,196 @@
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from .models import Choice, Question, Survey
+from .signals import single_version_bump
+
+CHOICE_TYPES = ('radio', 'checkbox', 'ranking')
+QUESTION_TYPES = [value for value, _ in Question.QUESTION_TYPES]
+TEXT_LENGTH = 200
+
+
+def _clean_choice(choice):
+    # Вариант приходит строкой (формы, React) или объектом {"id": ..., "text": ...}
+    choice_id = None
+    if isinstance(choice, dict):
+        choice_id, choice = choice.get('id'), choice.get('text')
+    if choice is None:
+        choice = ''
+    if not isinstance(choice, str):
+        raise ValidationError("Текст варианта должен быть строкой")
+    if choice_id is not None and (isinstance(choice_id, bool) or not isinstance(choice_id, int)):
+        raise ValidationError("Идентификатор варианта должен быть числом")
+    return {'id': choice_id, 'text': choice.strip()}
+
+
+def _clean_question(data):
+    if not isinstance(data, dict):
+        raise ValidationError("Ожидается объект вопроса")
+    text = data.get('text') or ''
+    question_type = data.get('question_type')
+    question_id = data.get('id')
+    if question_id is not None and (isinstance(question_id, bool) or not isinstance(question_id, int)):
+        raise ValidationError("Идентификатор вопроса должен быть числом")
+    if not isinstance(text, str) or len(text) > TEXT_LENGTH:
+        raise ValidationError(f"Текст вопроса должен быть строкой не длиннее {TEXT_LENGTH} символов")
+    if question_type not in QUESTION_TYPES:
+        raise ValidationError(f"Недопустимый тип вопроса: {question_type}. Допустимые значения: {QUESTION_TYPES}")
+    choices = []
+    if question_type in CHOICE_TYPES:
+        raw = data.get('choices') or []
+        if not isinstance(raw, list):
+            raise ValidationError("Варианты ответа передаются списком")
+        choices = [choice for choice in map(_clean_choice, raw) if choice['text']]
+        if not choices:
+            raise ValidationError("Для типов 'radio', 'checkbox' или 'ranking' требуется хотя бы один вариант ответа")
+        if any(len(choice['text']) > TEXT_LENGTH for choice in choices):
+            raise ValidationError(f"Текст варианта не может быть длиннее {TEXT_LENGTH} символов")
+    return {'id': question_id, 'text': text, 'question_type': question_type, 'choices': choices}
+
+
+def first_error(detail):
+    # Первое сообщение из вложенной структуры ошибок, для шаблонов
+    while isinstance(detail, (list, dict)):
+        values = detail.values() if isinstance(detail, dict) else detail
+        detail = next((value for value in values if value), '')
+    return str(detail)
+
+
+def validate_questions(questions):
+    """Проверяет дерево вопросов целиком и возвращает его в нормализованном виде.
+
+    Ошибки собираются по всем вопросам сразу, в том же порядке, что и вопросы.
+    """
+    if not isinstance(questions, list):
+        raise ValidationError("Ожидается список вопросов")
+    cleaned, errors = [], []
+    for data in questions:
+        try:
+            cleaned.append(_clean_question(data))
+            errors.append({})
+        except ValidationError as exc:
+            errors.append(exc.detail)
+    if any(errors):
+        raise ValidationError(errors)
+    return cleaned
+
+
+def _insert(survey, questions):
+    # Два INSERT на всё дерево; bulk_create возвращает первичные ключи в порядке вопросов
+    created = Question.objects.bulk_create(
+        Question(survey=survey, text=data['text'], question_type=data['question_type']) for data in questions
+    )
+    Choice.objects.bulk_create(
+        Choice(question=question, text=choice['text'])
+        for question, data in zip(created, questions) for choice in data['choices']
+    )
+    return created
+
+
+def add_questions(survey, questions):
+    """Добавляет вопросы с вариантами к опросу одной транзакцией и возвращает созданные вопросы."""
+    questions = validate_questions(questions)
+    with transaction.atomic():
+        created = _insert(survey, questions)
+        # bulk_create не вызывает post_save, поэтому версия опроса увеличивается явно
+        Survey.bump_version(pk=survey.pk)
+    return created
+
+
+def _match(items, existing, item_key, obj_key):
+    """Сопоставляет входные элементы с существующими объектами.
+
+    Сначала по id, затем по совпадению ключей среди ещё не сопоставленных:
+    клиенты без id (формы, React) так сохраняют неизменённые вопросы и варианты.
+    Возвращает список пар (элемент, объект или None) и несопоставленные объекты.
+    """
+    free = dict(existing)
+    pairs = []
+    for item in items:
+        obj = free.pop(item['id'], None) if item['id'] is not None else None
+        if obj is None:
+            obj = next((candidate for candidate in free.values() if obj_key(candidate) == item_key(item)), None)
+            if obj is not None:
+                del free[obj.id]
+        pairs.append((item, obj))
+    return pairs, list(free.values())
+
+
+def update_questions(survey, questions):
+    """Приводит вопросы опроса к переданному дереву минимальным набором изменений.
+
+    Неизменённые вопросы и варианты, а с ними и ответы, сохраняются. Вопрос,
+    у которого сменился тип, создаётся заново: старые ответы ему не подходят.
+    Возвращает сводку изменений.
+    """
+    questions = validate_questions(questions)
+    existing = {question.id: question for question in survey.questions.prefetch_related('choices')}
+    changes = {name: {'created': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0} for name in ('questions', 'choices')}
+    pairs, removed = _match(
+        questions, existing,
+        lambda data: (data['text'], data['question_type']),
+        lambda question: (question.text, question.question_type),
+    )
+
+    new_questions, changed_questions, new_choices, changed_choices, removed_choices = [], [], [], [], []
+    for data, question in pairs:
+        if question is not None and question.question_type != data['question_type']:
+            removed.append(question)
+            question = None
+        if question is None:
+            new_questions.append(data)
+            continue
+        if question.text != data['text']:
+            question.text = data['text']
+            changed_questions.append(question)
+        else:
+            changes['questions']['unchanged'] += 1
+        choice_pairs, stale = _match(
+            data['choices'], {choice.id: choice for choice in question.choices.all()},
+            lambda choice_data: choice_data['text'], lambda choice: choice.text,
+        )
+        removed_choices.extend(stale)
+        for choice_data, choice in choice_pairs:
+            if choice is None:
+                new_choices.append(Choice(question=question, text=choice_data['text']))
+            elif choice.text != choice_data['text']:
+                choice.text = choice_data['text']
+                changed_choices.append(choice)
+            else:
+                changes['choices']['unchanged'] += 1
+
+    with transaction.atomic(), single_version_bump(survey):
+        if removed:
+            Question.objects.filter(id__in=[question.id for question in removed]).delete()
+        if removed_choices:
+            Choice.objects.filter(id__in=[choice.id for choice in removed_choices]).delete()
+        Question.objects.bulk_update(changed_questions, ['text'])
+        Choice.objects.bulk_update(changed_choices, ['text'])
+        Choice.objects.bulk_create(new_choices)
+        _insert(survey, new_questions)
+
+    changes['questions'].update(created=len(new_questions), updated=len(changed_questions), deleted=len(removed))
+    changes['choices'].update(
+        created=len(new_choices) + sum(len(data['choices']) for data in new_questions),
+        updated=len(changed_choices),
+        deleted=len(removed_choices) + sum(len(question.choices.all()) for question in removed),
+    )
+    return changes
+
+
+def create_survey(author, title, questions, is_active=True):
+    """Создаёт опрос вместе с вопросами и вариантами: либо всё дерево, либо ничего.
+
+    Возвращает опрос и список созданных вопросов в исходном порядке.
+    """
+    if not isinstance(title, str) or not title.strip():
+        raise ValidationError("Название опроса не может быть пустым")
+    if len(title) > TEXT_LENGTH:
+        raise ValidationError(f"Название опроса не может быть длиннее {TEXT_LENGTH} символов")
+    questions = validate_questions(questions)
+    if not questions:
+        raise ValidationError("Опрос должен содержать хотя бы один вопрос")
+    with transaction.atomic():
+        survey = Survey.objects.create(title=title.strip(), author=author, is_active=is_active)
+        created = _insert(survey, questions)
+    return survey, created
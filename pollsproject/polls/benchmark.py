@@ -0,0 +1,201 @@
+import itertools
+import json
+import math
+import platform
+import random
+import subprocess
+import time
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .models import Answer, Choice, Question, RankingPosition, Survey
+from .results import backfill_participation, rebuild_results
+from .submissions import build_answers, load_questions
+
+QUESTION_TYPES = ['radio', 'checkbox', 'text', 'rating', 'yesno', 'ranking']
+
+
+def make_payload(questions, rng):
+    payload = []
+    for question in questions:
+        choice_ids = [choice.id for choice in question.choices.all()]
+        item = {'question': question.id}
+        if question.question_type == 'radio':
+            item['choice'] = rng.choice(choice_ids)
+        elif question.question_type == 'checkbox':
+            item['choices'] = rng.sample(choice_ids, rng.randint(1, len(choice_ids)))
+        elif question.question_type == 'text':
+            item['text_answer'] = f'Ответ {rng.randint(1, 1000)}'
+        elif question.question_type == 'rating':
+            item['rating_answer'] = rng.randint(1, 5)
+        elif question.question_type == 'yesno':
+            item['yesno_answer'] = rng.random() < 0.5
+        elif question.question_type == 'ranking':
+            item['ranking_answer'] = rng.sample(choice_ids, len(choice_ids))
+        payload.append(item)
+    return payload
+
+
+def seed(users=50, surveys=20, questions=10, choices=4, respondents=20, seed=0, batch_size=5000):
+    """Создаёт синтетические данные и возвращает список опросов.
+
+    Ответы пишутся пакетами напрямую, а сводные таблицы и таблица участия
+    пересчитываются в конце — так заполнение большой базы идёт быстро.
+    """
+    rng = random.Random(seed)
+    prefix = f'bench-{timezone.now():%Y%m%d%H%M%S%f}'
+    User.objects.bulk_create(User(username=f'{prefix}-{i}') for i in range(users))
+    people = list(User.objects.filter(username__startswith=prefix).order_by('id'))
+    Token.objects.bulk_create(Token(user=user, key=Token.generate_key()) for user in people)
+
+    created = Survey.objects.bulk_create(
+        Survey(title=f'Опрос {i}', author=people[i % len(people)]) for i in range(surveys)
+    )
+    types = itertools.cycle(QUESTION_TYPES)
+    question_rows = Question.objects.bulk_create(
+        Question(survey=survey, text=f'Вопрос {j}', question_type=next(types))
+        for survey in created for j in range(questions)
+    )
+    Choice.objects.bulk_create(
+        Choice(question=question, text=f'Вариант {k}')
+        for question in question_rows if question.question_type in ('radio', 'checkbox', 'ranking')
+        for k in range(choices)
+    )
+
+    pending = []
+    for survey in created:
+        survey_questions = load_questions(survey)
+        for user in rng.sample(people, min(respondents, len(people))):
+            payload = make_payload(survey_questions.values(), rng)
+            pending.extend(build_answers(survey, user, payload, survey_questions))
+            if len(pending) >= batch_size:
+                RankingPosition.objects.create_for(Answer.objects.bulk_create(pending))
+                pending = []
+    RankingPosition.objects.create_for(Answer.objects.bulk_create(pending))
+    for survey in created:
+        rebuild_results(survey)
+    backfill_participation()
+    return created, people
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    index = max(0, math.ceil(q / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(timings, queries):
+    total = sum(timings)
+    return {
+        'requests': len(timings),
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+        'mean_ms': round(total / len(timings) * 1000, 3),
+        'throughput_rps': round(len(timings) / total, 1) if total else None,
+        'queries_mean': round(sum(queries) / len(queries), 2),
+        'queries_max': max(queries),
+    }
+
+
+def timed(request):
+    with CaptureQueriesContext(connection) as ctx:
+        start = time.perf_counter()
+        response = request()
+        elapsed = time.perf_counter() - start
+    if response.status_code >= 400:
+        raise RuntimeError(f'{response.wsgi_request.path}: {response.status_code} {response.content[:200]!r}')
+    return elapsed, len(ctx.captured_queries)
+
+
+def measure(requests):
+    timings, queries = zip(*(timed(request) for request in requests))
+    return summarize(timings, queries)
+
+
+def run(surveys, people, requests=100, seed=0):
+    """Прогоняет основные эндпоинты через тестовый клиент Django."""
+    rng = random.Random(seed)
+    client = Client(HTTP_HOST='localhost')
+    tokens = dict(Token.objects.filter(user__in=people).values_list('user_id', 'key'))
+    auth = {'HTTP_AUTHORIZATION': f'Token {tokens[people[0].id]}'}
+    results = {
+        'survey_list': measure(
+            lambda: client.get('/api/surveys/', **auth) for _ in range(requests)
+        ),
+        'survey_detail': measure(
+            lambda survey=rng.choice(surveys): client.get(f'/api/surveys/{survey.pk}/', **auth)
+            for _ in range(requests)
+        ),
+        'profile': measure(
+            lambda user=rng.choice(people): client.get(f'/profile/{user.username}/')
+            for _ in range(requests)
+        ),
+    }
+
+    # Каждая отправка идёт от нового пользователя: повторно отвечать на опрос нельзя
+    prefix = f'{people[0].username}-submit'
+    User.objects.bulk_create(User(username=f'{prefix}-{i}') for i in range(requests))
+    submitters = list(User.objects.filter(username__startswith=prefix).order_by('id'))
+    Token.objects.bulk_create(Token(user=user, key=Token.generate_key()) for user in submitters)
+    target = surveys[0]
+    target_questions = list(load_questions(target).values())
+    # Лимит отправок на опрос иначе сработал бы на первых же десятках запросов
+    with override_settings(SUBMISSION_THROTTLE={'USER_RATE': None, 'SURVEY_RATE': None}):
+        results['submit'] = measure(
+            lambda token=token, payload=json.dumps(make_payload(target_questions, rng)): client.post(
+                f'/api/surveys/{target.pk}/submit/', payload,
+                content_type='application/json', HTTP_AUTHORIZATION=f'Token {token}',
+            )
+            for token in Token.objects.filter(user__in=submitters).values_list('key', flat=True)
+        )
+    return results
+
+
+def scan(survey, repeats=20):
+    """Время полного чтения ответов одного опроса, как при выгрузке или пересчёте итогов."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        rows = sum(1 for _ in Answer.objects.for_survey(survey)
+                   .values_list('id', 'user_id', 'question_id', 'choice_id').iterator(chunk_size=2000))
+        timings.append(time.perf_counter() - start)
+    return {
+        'rows': rows,
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+    }
+
+
+def scan_growth(steps=4, surveys=20, questions=10, choices=4, respondents=20, rng_seed=0):
+    """Время чтения одного опроса по мере роста остальной таблицы ответов.
+
+    С секционированием (или индексом по survey) время не должно расти
+    вместе с общим объёмом polls_answer.
+    """
+    scale = {'questions': questions, 'choices': choices, 'respondents': respondents}
+    (target,), _ = seed(users=respondents, surveys=1, seed=rng_seed, **scale)
+    results = []
+    for step in range(steps + 1):
+        if step:
+            seed(users=respondents, surveys=surveys, seed=rng_seed + step, **scale)
+        results.append({'total_answers': Answer.objects.count(), **scan(target)})
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'timestamp': timezone.now().isoformat(),
+    }
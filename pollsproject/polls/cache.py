@@ -0,0 +1,121 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+DEFAULT_SURVEY_CACHE = {
+    'BACKEND': 'polls.cache.LRUCacheBackend',
+    'OPTIONS': {'max_entries': 1000},
+}
+
+
+class LRUCacheBackend:
+    """Кэш в памяти процесса с вытеснением давно не использованных записей."""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DjangoCacheBackend:
+    """Хранит записи в кэше Django из CACHES, например в FileBasedCache или DatabaseCache."""
+
+    def __init__(self, alias='default', timeout=None):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class SurveyCache:
+    """Сериализованные определения опросов, ключ — id опроса и его версия.
+
+    Версия увеличивается при любом изменении опроса, его вопросов и вариантов,
+    поэтому устаревшие записи не инвалидируются явно, а просто перестают
+    запрашиваться и со временем вытесняются.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, survey, variant):
+        return f'survey:{survey.pk}:{survey.version}:{variant}'
+
+    def get_or_build(self, survey, variant, build):
+        key = self.key(survey, variant)
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is None:
+            value = build()
+            self.backend.set(key, value)
+        return value
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        self.backend.clear()
+        self.hits = self.misses = 0
+
+
+_survey_cache = None
+
+
+def get_survey_cache():
+    global _survey_cache
+    if _survey_cache is None:
+        config = getattr(settings, 'SURVEY_CACHE', DEFAULT_SURVEY_CACHE)
+        backend = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+        _survey_cache = SurveyCache(backend)
+    return _survey_cache
+
+
+@receiver(setting_changed)
+def reset_survey_cache(setting, **kwargs):
+    global _survey_cache
+    if setting == 'SURVEY_CACHE':
+        _survey_cache = None
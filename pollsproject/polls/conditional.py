@@ -0,0 +1,54 @@
+import hashlib
+
+from django.db.models import Count, Max, Sum
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .models import Survey, SurveyParticipation
+
+
+def make_etag(*parts):
+    return '"%s"' % hashlib.md5(':'.join(map(str, parts)).encode(), usedforsecurity=False).hexdigest()
+
+
+def survey_etag(survey, *parts):
+    # version растёт при изменении опроса, его вопросов и вариантов
+    return make_etag('survey', survey.pk, survey.version, *parts)
+
+
+def list_state(queryset=None):
+    """Одним агрегирующим запросом: меняется при создании, удалении и изменении любого опроса."""
+    queryset = Survey.objects.all() if queryset is None else queryset
+    state = queryset.order_by().aggregate(count=Count('id'), last_id=Max('id'), versions=Sum('version'))
+    return make_etag('surveys', *state.values())
+
+
+def not_modified(request, etag, last_modified=None):
+    """Ответ 304 (или 412), если у клиента актуальная версия; иначе None."""
+    return get_conditional_response(
+        request, etag=etag, last_modified=last_modified and int(last_modified.timestamp()),
+    )
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+def index_etag(request):
+    return make_etag(list_state(), request.user.pk)
+
+
+def detail_etag(request, survey_id):
+    # Страница опроса зависит ещё и от ответов пользователя и от CSRF-секрета формы:
+    # после повторного входа секрет меняется, и 304 со старым токеном в форме не отдаётся
+    survey = Survey.objects.filter(pk=survey_id).only('version').first()
+    if survey is None:
+        return None
+    submitted_at = None
+    if request.user.is_authenticated:
+        submitted_at = (SurveyParticipation.objects.filter(survey_id=survey_id, user=request.user)
+                        .values_list('submitted_at', flat=True).first())
+    return survey_etag(survey, request.user.pk, submitted_at, request.META.get('CSRF_COOKIE'))
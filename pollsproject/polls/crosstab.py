@@ -0,0 +1,188 @@
+import threading
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+
+from . import archive
+from .cache import LRUCacheBackend
+from .models import Answer
+from .submissions import NO_VALUES, YES_VALUES
+
+CROSSTAB_CHUNK_SIZE = 5000
+
+
+def _bitset(indexes):
+    # Номера битов -> целое за один проход: булев массив от младшего номера упаковывается в байты
+    low = min(indexes)
+    flags = np.zeros(max(indexes) - low + 1, dtype=bool)
+    flags[np.asarray(indexes) - low] = True
+    return int.from_bytes(np.packbits(flags, bitorder='little').tobytes(), 'little') << low
+
+
+class SurveyMatrix:
+    """Матрица респондент × ответ одного опроса в виде битовых множеств.
+
+    Каждому респонденту присваивается номер бита. Для каждого значения ответа
+    хранится целое число, в котором выставлены биты выбравших его респондентов:
+    вариант для radio и checkbox, оценка для rating, да/нет для yesno и вариант
+    на первом месте для ranking. Фильтр — это пересечение множеств (&),
+    а размер выборки — число единичных битов, поэтому ответы не перечитываются.
+
+    Матрица дополняется ответами после watermark (см. AnswerQuerySet.since);
+    повторно прочитанный ответ выставляет те же биты. При изменении структуры
+    опроса (версии) матрица строится заново. Архив опроса не меняется и читается один раз.
+    """
+
+    def __init__(self, survey_id, version):
+        self.survey_id = survey_id
+        self.version = version
+        self.watermark = 0
+        self.complete = False
+        self.respondents = {}
+        self.answered = defaultdict(int)
+        self.values = defaultdict(lambda: defaultdict(int))
+        self.lock = threading.Lock()
+
+    def refresh(self, survey):
+        if survey.is_archived:
+            if self.complete:
+                return
+            # Строки архива упорядочены не по id, поэтому watermark — максимум
+            rows = ((answer_id, user_id, question_id, choice_id, rating, yesno, ranking)
+                    for answer_id, user_id, question_id, choice_id, _, rating, yesno, ranking in archive.iter_rows(survey)
+                    if user_id is not None and answer_id > self.watermark)
+        else:
+            rows = (
+                Answer.objects.for_survey(self.survey_id).since(self.watermark).filter(user__isnull=False)
+                .order_by('id')
+                .values_list('id', 'user_id', 'question_id', 'choice_id', 'rating_answer', 'yesno_answer', 'ranking_answer')
+                .iterator(chunk_size=CROSSTAB_CHUNK_SIZE)
+            )
+        # Сначала номера респондентов по множествам, затем каждое множество собирается один раз:
+        # |= по одному биту копирует растущее целое и квадратичен по числу респондентов
+        answered, values = defaultdict(list), defaultdict(list)
+        for answer_id, user_id, question_id, choice_id, rating, yesno, ranking in rows:
+            index = self.respondents.setdefault(user_id, len(self.respondents))
+            answered[question_id].append(index)
+            if choice_id is not None:
+                values[question_id, choice_id].append(index)
+            elif rating is not None:
+                values[question_id, rating].append(index)
+            elif yesno is not None:
+                values[question_id, yesno].append(index)
+            elif ranking:
+                values[question_id, ranking[0]].append(index)
+            self.watermark = max(self.watermark, answer_id)
+        for question_id, indexes in answered.items():
+            self.answered[question_id] |= _bitset(indexes)
+        for (question_id, value), indexes in values.items():
+            self.values[question_id][value] |= _bitset(indexes)
+        self.complete = survey.is_archived
+
+    def everyone(self):
+        return (1 << len(self.respondents)) - 1
+
+    def select(self, question_id, values):
+        # Респонденты, ответившие на вопрос любым из значений
+        bits = self.values.get(question_id, {})
+        mask = 0
+        for value in values:
+            mask |= bits.get(value, 0)
+        return mask
+
+    def crosstab(self, question, filters):
+        # question — вопрос из закэшированного определения опроса (SurveyDefinitionSerializer)
+        mask = self.everyone()
+        for question_id, values in filters:
+            mask &= self.select(question_id, values)
+        question_type = question['question_type']
+        bits = self.values.get(question['id'], {})
+        data = {
+            'question': question['id'],
+            'question_type': question_type,
+            'respondents': mask.bit_count(),
+            'responses': (self.answered.get(question['id'], 0) & mask).bit_count(),
+        }
+        if question_type == 'rating':
+            histogram = {value: (bits[value] & mask).bit_count() for value in sorted(bits)}
+            total = sum(histogram.values())
+            data['histogram'] = histogram
+            data['mean'] = round(sum(value * count for value, count in histogram.items()) / total, 2) if total else None
+        elif question_type == 'yesno':
+            data['yes'] = (bits.get(True, 0) & mask).bit_count()
+            data['no'] = (bits.get(False, 0) & mask).bit_count()
+        elif question_type in ('radio', 'checkbox', 'ranking'):
+            # Для ranking считается, сколько раз вариант поставлен на первое место
+            key = 'first' if question_type == 'ranking' else 'votes'
+            data['choices'] = [{'id': choice['id'], 'text': choice['text'], key: (bits.get(choice['id'], 0) & mask).bit_count()}
+                               for choice in question['choices']]
+        return data
+
+
+_matrices = None
+_matrices_lock = threading.Lock()
+
+
+def get_matrix(survey):
+    """Матрица опроса из кэша процесса, дополненная новыми ответами."""
+    global _matrices
+    with _matrices_lock:
+        if _matrices is None:
+            _matrices = LRUCacheBackend(getattr(settings, 'CROSSTAB_MAX_SURVEYS', 50))
+        key = survey.pk
+        matrix = _matrices.get(key)
+        if matrix is None or matrix.version != survey.version:
+            matrix = SurveyMatrix(survey.pk, survey.version)
+            _matrices.set(key, matrix)
+    with matrix.lock:
+        matrix.refresh(survey)
+    return matrix
+
+
+def clear_matrices():
+    with _matrices_lock:
+        if _matrices is not None:
+            _matrices.clear()
+
+
+def _parse_value(question, raw):
+    question_type = question['question_type']
+    if question_type == 'yesno':
+        value = raw.lower()
+        if value in YES_VALUES:
+            return True
+        if value in NO_VALUES:
+            return False
+        raise ValidationError(f"Ожидается yes или no: {raw}")
+    if question_type in ('radio', 'checkbox', 'ranking', 'rating'):
+        try:
+            return int(raw)
+        except ValueError:
+            raise ValidationError(f"Ожидается число: {raw}")
+    raise ValidationError(f"По вопросам типа {question_type} фильтровать нельзя")
+
+
+def parse_filters(specs, questions):
+    """Разбирает фильтры вида "id_вопроса:значение[,значение...]"; questions — {id: вопрос из определения}.
+
+    Значения одного фильтра объединяются (ИЛИ), разные фильтры пересекаются (И).
+    """
+    filters = []
+    for spec in specs:
+        question_id, _, raw_values = spec.partition(':')
+        try:
+            question = questions[int(question_id)]
+        except (ValueError, KeyError):
+            raise ValidationError(f"Вопрос не найден в этом опросе: {question_id}")
+        if not raw_values:
+            raise ValidationError(f"Не указано значение фильтра: {spec}")
+        filters.append((question['id'], {_parse_value(question, value) for value in raw_values.split(',')}))
+    return filters
+
+
+def survey_crosstab(survey, target, filters):
+    matrix = get_matrix(survey)
+    with matrix.lock:
+        return matrix.crosstab(target, filters)
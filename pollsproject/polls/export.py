@@ -0,0 +1,112 @@
+import csv
+import itertools
+import json
+
+from django.contrib.auth.models import User
+
+from . import archive
+from .models import Answer
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+class Echo:
+    # Псевдофайл для csv.writer: возвращает строку вместо записи в буфер
+    def write(self, value):
+        return value
+
+
+def load_export_questions(survey):
+    questions = list(survey.questions.prefetch_related('choices').order_by('id'))
+    choice_texts = {choice.id: choice.text for question in questions for choice in question.choices.all()}
+    return questions, choice_texts
+
+
+def _archived_rows(survey, chunk_size):
+    # Строки архива в формате запроса из iter_respondents; имена пользователей подгружаются пачками
+    rows = archive.iter_rows(survey)
+    while chunk := list(itertools.islice(rows, chunk_size)):
+        usernames = dict(User.objects.filter(id__in={row[1] for row in chunk}).values_list('id', 'username'))
+        for answer_id, user_id, *values in chunk:
+            yield (answer_id, user_id, usernames.get(user_id), *values)
+
+
+def _respondent(row):
+    # Ключ группировки строк (id ответа, user_id, ...): пользователь, а для анонимного ответа — сам ответ
+    return row[1], None if row[1] is not None else row[0]
+
+
+def iter_respondents(survey, questions, choice_texts, chunk_size=EXPORT_CHUNK_SIZE):
+    """Отдаёт (user_id, username, {question_id: значение}) по одному респонденту.
+
+    Ответы читаются курсором, упорядоченными по пользователю, поэтому в памяти
+    находятся только ответы текущего респондента. Анонимные ответы нельзя
+    связать между собой, поэтому каждый из них выгружается отдельной строкой.
+    """
+    types = {question.id: question.question_type for question in questions}
+    if survey.is_archived:
+        rows = _archived_rows(survey, chunk_size)
+    else:
+        rows = (
+            Answer.objects.for_survey(survey)
+            .order_by('user_id', 'id')
+            .values_list('id', 'user_id', 'user__username', 'question_id', 'choice_id', 'text_answer',
+                         'rating_answer', 'yesno_answer', 'ranking_answer')
+            .iterator(chunk_size=chunk_size)
+        )
+    for (user_id, _), group in itertools.groupby(rows, key=_respondent):
+        username, values = None, {}
+        for _, _, username, question_id, choice_id, text, rating, yesno, ranking in group:
+            qtype = types.get(question_id)
+            if qtype == 'checkbox':
+                values.setdefault(question_id, []).append(choice_texts.get(choice_id))
+            elif qtype == 'radio':
+                values[question_id] = choice_texts.get(choice_id)
+            elif qtype == 'text':
+                values[question_id] = text
+            elif qtype == 'rating':
+                values[question_id] = rating
+            elif qtype == 'yesno':
+                values[question_id] = yesno
+            elif qtype == 'ranking':
+                values[question_id] = [choice_texts.get(choice_id) for choice_id in ranking or []]
+        yield user_id, username, values
+
+
+def _csv_cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'да' if value else 'нет'
+    if isinstance(value, list):
+        return '; '.join(text or '' for text in value)
+    return value
+
+
+def stream_csv(survey, chunk_size=EXPORT_CHUNK_SIZE):
+    questions, choice_texts = load_export_questions(survey)
+    writer = csv.writer(Echo())
+    yield writer.writerow(['user_id', 'username'] + [f'{question.id}. {question.text}' for question in questions])
+    for user_id, username, values in iter_respondents(survey, questions, choice_texts, chunk_size):
+        yield writer.writerow(
+            [user_id or '', username or ''] + [_csv_cell(values.get(question.id)) for question in questions]
+        )
+
+
+def stream_jsonl(survey, chunk_size=EXPORT_CHUNK_SIZE):
+    questions, choice_texts = load_export_questions(survey)
+    for user_id, username, values in iter_respondents(survey, questions, choice_texts, chunk_size):
+        record = {'user_id': user_id, 'username': username, 'answers': {str(key): value for key, value in values.items()}}
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def stream_answers(survey, fmt, chunk_size=EXPORT_CHUNK_SIZE):
+    if fmt == 'csv':
+        return stream_csv(survey, chunk_size)
+    if fmt == 'jsonl':
+        return stream_jsonl(survey, chunk_size)
+    raise ValueError(f'Неизвестный формат выгрузки: {fmt}')
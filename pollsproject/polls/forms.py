@@ -10,6 +10,9 @@ class SurveyForm(forms.ModelForm):
         widgets = {'title': forms.TextInput(attrs={'class': 'form-control'})}
 
 class QuestionForm(forms.ModelForm):
+    # id существующего вопроса: по нему update_questions сохраняет переименованный вопрос и его ответы
+    id = forms.IntegerField(required=False, widget=forms.HiddenInput)
+
     class Meta:
         model = Question
         fields = ['text', 'question_type']
@@ -20,6 +23,8 @@ class QuestionForm(forms.ModelForm):
         }
 
 class ChoiceForm(forms.ModelForm):
+    id = forms.IntegerField(required=False, widget=forms.HiddenInput)
+
     class Meta:
         model = Choice
         fields = ['text']
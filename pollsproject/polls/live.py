@@ -0,0 +1,181 @@
+import itertools
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import Signal, receiver
+
+from .metrics import registry
+from .models import ChoiceResult, QuestionResult, RatingResult
+
+# Отправляется после коммита с приращениями счётчиков одного опроса (polls.stream).
+# Аргументы: survey_id, version, questions, choices, ratings.
+counters_changed = Signal()
+
+DEFAULT_LIVE_COUNTERS = {
+    'SHARDS': 16,
+    'SYNC_INTERVAL': 5,
+    'MAX_SURVEYS': 1000,
+}
+
+
+def load_totals(survey_id):
+    """Счётчики сводных таблиц опроса: тремя запросами, не читая ответы."""
+    totals = {row.pop('question_id'): row for row in QuestionResult.objects.filter(survey_id=survey_id)
+              .values('question_id', 'responses', 'rating_sum', 'yes_count', 'no_count')}
+    choice_totals = {row.pop('choice_id'): row for row in ChoiceResult.objects.filter(survey_id=survey_id)
+                     .values('choice_id', 'votes', 'borda')}
+    histograms = defaultdict(dict)
+    for question_id, value, count in RatingResult.objects.filter(survey_id=survey_id).values_list('question_id', 'value', 'count'):
+        histograms[question_id][value] = count
+    return totals, choice_totals, histograms
+
+
+class SurveyCounters:
+    """Счётчики одного опроса: снимок сводных таблиц плюс отправки этого процесса после снимка.
+
+    version — номер последнего учтённого приращения (LiveAggregator.versions).
+    """
+
+    def __init__(self, survey_id, version):
+        self.survey_id = survey_id
+        self.version = version
+        totals, choice_totals, histograms = load_totals(survey_id)
+        self.totals = defaultdict(Counter, {key: Counter(value) for key, value in totals.items()})
+        self.choice_totals = defaultdict(Counter, {key: Counter(value) for key, value in choice_totals.items()})
+        self.histograms = defaultdict(Counter, {key: Counter(value) for key, value in histograms.items()})
+        self.synced_at = time.monotonic()
+
+    def apply(self, questions, choices, ratings):
+        # Аргументы — приращения из results.summarize_answers, ключи — кортежи пар поле/значение
+        for lookup, delta in questions.items():
+            self.totals[dict(lookup)['question_id']].update(delta)
+        for lookup, delta in choices.items():
+            self.choice_totals[dict(lookup)['choice_id']].update(delta)
+        for lookup, delta in ratings.items():
+            lookup = dict(lookup)
+            self.histograms[lookup['question_id']][lookup['value']] += delta['count']
+
+    def snapshot(self):
+        return (
+            {key: dict(value) for key, value in self.totals.items()},
+            {key: dict(value) for key, value in self.choice_totals.items()},
+            {key: dict(value) for key, value in self.histograms.items()},
+        )
+
+
+class Shard:
+    def __init__(self, max_surveys):
+        self.max_surveys = max_surveys
+        self.surveys = OrderedDict()
+        self.lock = threading.Lock()
+
+
+class LiveAggregator:
+    """Живые счётчики результатов в памяти процесса, разбитые на шарды по опросу.
+
+    Отправки этого процесса прибавляются к счётчикам сразу после коммита.
+    Раз в SYNC_INTERVAL секунд опрос заново читается из сводных таблиц:
+    так счётчики восстанавливаются после перезапуска и догоняют отправки
+    других процессов. Сводные таблицы пишутся в транзакции отправки
+    (results.record_answers) и служат долговременным хранилищем.
+    Шард блокируется только на время обновления словарей, не на время запросов.
+    Счётчики приблизительные: отправка, закоммиченная во время перечитывания,
+    может быть учтена дважды или пропущена до следующей синхронизации.
+
+    Каждое приращение получает номер из общего для процесса ряда; снимок
+    возвращает номер последнего учтённого в нём, по нему поток SSE
+    отбрасывает дельты, уже вошедшие в снимок.
+    """
+
+    def __init__(self, shards, sync_interval, max_surveys):
+        self.sync_interval = sync_interval
+        self.versions = itertools.count(1)
+        self.shards = [Shard(max(1, max_surveys // shards)) for _ in range(shards)]
+
+    def shard(self, survey_id):
+        return self.shards[survey_id % len(self.shards)]
+
+    def counters(self, survey_id):
+        shard = self.shard(survey_id)
+        with shard.lock:
+            counters = shard.surveys.get(survey_id)
+            if counters is not None and time.monotonic() - counters.synced_at < self.sync_interval:
+                shard.surveys.move_to_end(survey_id)
+                registry.increment('live_counters_hits_total')
+                return counters
+        # Номер берётся до чтения: приращения с меньшими номерами уже закоммичены и попадут в снимок таблиц
+        counters = SurveyCounters(survey_id, next(self.versions))
+        registry.increment('live_counters_syncs_total')
+        with shard.lock:
+            shard.surveys[survey_id] = counters
+            shard.surveys.move_to_end(survey_id)
+            while len(shard.surveys) > shard.max_surveys:
+                shard.surveys.popitem(last=False)
+        return counters
+
+    def snapshot(self, survey_id):
+        counters = self.counters(survey_id)
+        with self.shard(survey_id).lock:
+            return counters.snapshot(), time.monotonic() - counters.synced_at, counters.version
+
+    def add(self, survey_id, questions, choices, ratings):
+        """Прибавляет приращения к счётчикам опроса в памяти и возвращает номер приращения."""
+        # Опросы, которых нет в памяти, загрузятся из сводных таблиц уже с этими ответами
+        shard = self.shard(survey_id)
+        with shard.lock:
+            version = next(self.versions)
+            counters = shard.surveys.get(survey_id)
+            if counters is not None:
+                counters.apply(questions, choices, ratings)
+                counters.version = version
+        return version
+
+    def forget(self, survey_id):
+        shard = self.shard(survey_id)
+        with shard.lock:
+            shard.surveys.pop(survey_id, None)
+
+
+_aggregator = None
+_aggregator_lock = threading.Lock()
+
+
+def get_aggregator():
+    global _aggregator
+    with _aggregator_lock:
+        if _aggregator is None:
+            config = {**DEFAULT_LIVE_COUNTERS, **getattr(settings, 'LIVE_COUNTERS', {})}
+            _aggregator = LiveAggregator(config['SHARDS'], config['SYNC_INTERVAL'], config['MAX_SURVEYS'])
+        return _aggregator
+
+
+@receiver(setting_changed)
+def reset_live_counters(setting, **kwargs):
+    global _aggregator
+    if setting == 'LIVE_COUNTERS':
+        _aggregator = None
+
+
+def record(questions, choices, ratings):
+    """Прибавляет приращения сводных таблиц к живым счётчикам после коммита транзакции."""
+    by_survey = defaultdict(lambda: ({}, {}, {}))
+    for position, entries in enumerate((questions, choices, ratings)):
+        for lookup, delta in entries.items():
+            by_survey[dict(lookup)['survey_id']][position][lookup] = delta
+
+    def apply():
+        aggregator = get_aggregator()
+        for survey_id, (questions, choices, ratings) in by_survey.items():
+            version = aggregator.add(survey_id, questions, choices, ratings)
+            counters_changed.send(sender=LiveAggregator, survey_id=survey_id, version=version,
+                                  questions=questions, choices=choices, ratings=ratings)
+    transaction.on_commit(apply)
+
+
+def forget(survey_id):
+    # После пересчёта сводных таблиц опрос перечитывается при следующем запросе
+    transaction.on_commit(lambda: get_aggregator().forget(survey_id))
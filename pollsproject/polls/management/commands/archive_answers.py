@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.archive import archive_survey
+from polls.models import Survey
+
+
+class Command(BaseCommand):
+    help = 'Переносит ответы закрытых опросов в колоночные файлы архива и удаляет их из таблицы ответов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('survey_ids', nargs='*', type=int,
+                            help='Идентификаторы опросов (по умолчанию — все закрытые опросы не в архиве)')
+
+    def handle(self, *args, **options):
+        surveys = Survey.objects.filter(is_active=False, is_archived=False)
+        if options['survey_ids']:
+            surveys = Survey.objects.filter(pk__in=options['survey_ids'])
+            missing = set(options['survey_ids']) - set(surveys.values_list('pk', flat=True))
+            if missing:
+                raise CommandError(f"Опросы не найдены: {', '.join(map(str, sorted(missing)))}")
+        for survey in surveys.iterator():
+            try:
+                rows, path = archive_survey(survey)
+            except ValueError as error:
+                raise CommandError(str(error))
+            self.stdout.write(f'Опрос {survey.pk}: {rows} ответов перенесено в {path}')
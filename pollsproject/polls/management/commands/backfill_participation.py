@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from polls.results import backfill_participation
+
+
+class Command(BaseCommand):
+    help = 'Заполняет таблицу участия пользователей в опросах по сохранённым ответам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = backfill_participation(options['batch_size'])
+        self.stdout.write(f'Записей об участии: {total}')
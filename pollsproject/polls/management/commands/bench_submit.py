@@ -0,0 +1,95 @@
+import itertools
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.shortcuts import get_object_or_404
+from django.test.utils import CaptureQueriesContext
+
+from polls.models import Survey, Question, Choice, Answer
+from polls.submissions import save_submission
+
+QUESTION_TYPES = ['radio', 'checkbox', 'text', 'rating', 'yesno', 'ranking']
+
+
+def legacy_submit(survey, user, payload):
+    # Прежняя реализация submit_answers: запрос на каждый вопрос, вариант и строку
+    for answer_data in payload:
+        question = get_object_or_404(Question, pk=answer_data['question'], survey=survey)
+        if question.question_type == 'radio':
+            choice = get_object_or_404(Choice, pk=answer_data['choice'], question=question)
+            Answer.objects.create(survey=survey, question=question, choice=choice, user=user)
+        elif question.question_type == 'checkbox':
+            for choice_id in answer_data['choices']:
+                choice = get_object_or_404(Choice, pk=choice_id, question=question)
+                Answer.objects.create(survey=survey, question=question, choice=choice, user=user)
+        elif question.question_type == 'text':
+            Answer.objects.create(survey=survey, question=question, text_answer=answer_data['text_answer'], user=user)
+        elif question.question_type == 'rating':
+            Answer.objects.create(survey=survey, question=question, rating_answer=answer_data['rating_answer'], user=user)
+        elif question.question_type == 'yesno':
+            Answer.objects.create(survey=survey, question=question, yesno_answer=answer_data['yesno_answer'], user=user)
+        elif question.question_type == 'ranking':
+            Answer.objects.create(survey=survey, question=question, ranking_answer=answer_data['ranking_answer'], user=user)
+
+
+def make_survey(author, questions, choices):
+    survey = Survey.objects.create(title='bench', author=author)
+    types = itertools.cycle(QUESTION_TYPES)
+    for i in range(questions):
+        question = Question.objects.create(survey=survey, text=f'Вопрос {i}', question_type=next(types))
+        if question.question_type in ('radio', 'checkbox', 'ranking'):
+            Choice.objects.bulk_create(Choice(question=question, text=f'Вариант {j}') for j in range(choices))
+    return survey
+
+
+def make_payload(survey):
+    payload = []
+    for question in survey.questions.prefetch_related('choices'):
+        choice_ids = [choice.id for choice in question.choices.all()]
+        item = {'question': question.id}
+        if question.question_type == 'radio':
+            item['choice'] = choice_ids[0]
+        elif question.question_type == 'checkbox':
+            item['choices'] = choice_ids[:2]
+        elif question.question_type == 'text':
+            item['text_answer'] = 'Ответ'
+        elif question.question_type == 'rating':
+            item['rating_answer'] = 4
+        elif question.question_type == 'yesno':
+            item['yesno_answer'] = True
+        elif question.question_type == 'ranking':
+            item['ranking_answer'] = list(reversed(choice_ids))
+        payload.append(item)
+    return payload
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает построчное и пакетное сохранение ответов на синтетическом опросе'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=50)
+        parser.add_argument('--choices', type=int, default=5)
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **options):
+        # Все данные создаются в транзакции, которая в конце откатывается
+        with transaction.atomic():
+            author = User.objects.create(username='bench-author')
+            survey = make_survey(author, options['questions'], options['choices'])
+            payload = make_payload(survey)
+            for name, submit in (('legacy', legacy_submit), ('bulk', save_submission)):
+                timings, queries = [], 0
+                for i in range(options['rounds']):
+                    user = User.objects.create(username=f'bench-{name}-{i}')
+                    with CaptureQueriesContext(connection) as ctx:
+                        start = time.perf_counter()
+                        submit(survey, user, payload)
+                        timings.append(time.perf_counter() - start)
+                    queries = len(ctx.captured_queries)
+                self.stdout.write(
+                    f'{name:>6}: {min(timings) * 1000:8.2f} ms (min), '
+                    f'{sum(timings) / len(timings) * 1000:8.2f} ms (avg), {queries} queries'
+                )
+            transaction.set_rollback(True)
@@ -0,0 +1,58 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from polls import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими данными и измеряет задержки, пропускную '
+            'способность и число SQL-запросов основных эндпоинтов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--surveys', type=int, default=20)
+        parser.add_argument('--questions', type=int, default=10, help='Вопросов в опросе')
+        parser.add_argument('--choices', type=int, default=4, help='Вариантов в вопросе')
+        parser.add_argument('--respondents', type=int, default=20, help='Респондентов на опрос')
+        parser.add_argument('--requests', type=int, default=100, help='Запросов на эндпоинт')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Файл для результатов в JSON')
+        parser.add_argument('--keep', action='store_true', help='Не откатывать созданные данные')
+        parser.add_argument('--scan-steps', type=int, default=0,
+                            help='Дополнительно замерить чтение одного опроса при росте таблицы ответов '
+                                 '(каждый шаг добавляет --surveys опросов)')
+
+    def handle(self, *args, **options):
+        scale = {key: options[key] for key in ('users', 'surveys', 'questions', 'choices', 'respondents')}
+        with transaction.atomic():
+            surveys, people = benchmark.seed(seed=options['seed'], **scale)
+            endpoints = benchmark.run(surveys, people, options['requests'], options['seed'])
+            scans = []
+            if options['scan_steps']:
+                scans = benchmark.scan_growth(
+                    options['scan_steps'], options['surveys'], options['questions'], options['choices'],
+                    options['respondents'], options['seed'],
+                )
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+        report = {'environment': benchmark.environment(), 'scale': scale, 'endpoints': endpoints}
+        if scans:
+            report['survey_scan'] = scans
+        for name, stats in endpoints.items():
+            self.stdout.write(
+                f"{name:>14}: p50 {stats['p50_ms']:8.2f} ms  p95 {stats['p95_ms']:8.2f} ms  "
+                f"p99 {stats['p99_ms']:8.2f} ms  {stats['throughput_rps']:8.1f} rps  "
+                f"queries {stats['queries_mean']:.1f} (max {stats['queries_max']})"
+            )
+        for row in scans:
+            self.stdout.write(
+                f"scan {row['rows']} of {row['total_answers']:>9} answers: "
+                f"p50 {row['p50_ms']:8.2f} ms  p95 {row['p95_ms']:8.2f} ms"
+            )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+            self.stdout.write(f"Результаты записаны в {options['output']}")
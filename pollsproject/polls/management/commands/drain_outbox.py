@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from polls.outbox import drain_outbox
+
+
+class Command(BaseCommand):
+    help = 'Переносит отправки из очереди SubmissionOutbox в таблицу ответов пакетами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Пауза в секундах, когда очередь пуста')
+        parser.add_argument('--once', action='store_true', help='Разобрать очередь и завершиться')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = drain_outbox(options['batch_size'])
+            if processed:
+                self.stdout.write(f'Обработано отправок: {processed}')
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['interval'])
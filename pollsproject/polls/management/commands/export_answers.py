@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, stream_answers
+from polls.models import Survey
+
+
+class Command(BaseCommand):
+    help = 'Выгружает ответы опроса в CSV или JSON Lines: одна строка на респондента'
+
+    def add_arguments(self, parser):
+        parser.add_argument('survey_id', type=int)
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--output', help='Путь к файлу (по умолчанию — стандартный вывод)')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            survey = Survey.objects.get(pk=options['survey_id'])
+        except Survey.DoesNotExist:
+            raise CommandError(f"Опрос {options['survey_id']} не найден")
+        chunks = stream_answers(survey, options['format'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.models import Survey
+from polls.results import rebuild_results
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сводные таблицы результатов по сохранённым ответам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('survey_ids', nargs='*', type=int,
+                            help='Идентификаторы опросов (по умолчанию — все опросы)')
+
+    def handle(self, *args, **options):
+        surveys = Survey.objects.all()
+        if options['survey_ids']:
+            surveys = surveys.filter(pk__in=options['survey_ids'])
+            missing = set(options['survey_ids']) - set(surveys.values_list('pk', flat=True))
+            if missing:
+                raise CommandError(f"Опросы не найдены: {', '.join(map(str, sorted(missing)))}")
+        for survey in surveys.iterator():
+            rebuild_results(survey)
+            self.stdout.write(f'Результаты опроса {survey.pk} пересчитаны')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.archive import restore_survey
+from polls.models import Survey
+
+
+class Command(BaseCommand):
+    help = 'Возвращает ответы опросов из файлов архива в таблицу ответов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('survey_ids', nargs='+', type=int, help='Идентификаторы опросов')
+
+    def handle(self, *args, **options):
+        surveys = Survey.objects.filter(pk__in=options['survey_ids'])
+        missing = set(options['survey_ids']) - set(surveys.values_list('pk', flat=True))
+        if missing:
+            raise CommandError(f"Опросы не найдены: {', '.join(map(str, sorted(missing)))}")
+        for survey in surveys.iterator():
+            try:
+                rows = restore_survey(survey)
+            except ValueError as error:
+                raise CommandError(str(error))
+            self.stdout.write(f'Опрос {survey.pk}: восстановлено {rows} ответов')
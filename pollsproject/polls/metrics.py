@@ -0,0 +1,112 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUERY_METRICS = {
+    'SERVER_TIMING': False,
+    'DUPLICATE_THRESHOLD': 3,
+}
+
+_IN_LIST = re.compile(r'IN \((?:%s|\?)(?:, (?:%s|\?))*\)')
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_SPACES = re.compile(r'\s+')
+
+
+def query_settings():
+    return {**DEFAULT_QUERY_METRICS, **getattr(settings, 'QUERY_METRICS', {})}
+
+
+def fingerprint(sql):
+    # Запросы, отличающиеся только параметрами, дают одинаковый отпечаток
+    sql = _IN_LIST.sub('IN (...)', sql)
+    sql = _LITERALS.sub('?', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+class QueryCollector:
+    """Обёртка для connection.execute_wrapper: считает запросы и время в БД."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self, threshold):
+        return {sql: count for sql, count in self.fingerprints.items() if count >= threshold}
+
+
+class MetricsRegistry:
+    """Накопленные метрики по представлениям, отдаются в текстовом формате Prometheus."""
+
+    COUNTERS = (
+        ('requests_total', 'Обработанные запросы'),
+        ('request_seconds_total', 'Суммарное время обработки, с'),
+        ('db_queries_total', 'SQL-запросы'),
+        ('db_seconds_total', 'Суммарное время SQL-запросов, с'),
+        ('duplicate_queries_total', 'Повторы одного и того же запроса сверх первого'),
+        ('n_plus_one_requests_total', 'Запросы с признаками N+1'),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = defaultdict(Counter)
+        self._extra = Counter()
+
+    def record(self, view, wall, collector, threshold):
+        duplicates = collector.duplicates(threshold)
+        with self._lock:
+            counters = self._views[view]
+            counters['requests_total'] += 1
+            counters['request_seconds_total'] += wall
+            counters['db_queries_total'] += collector.count
+            counters['db_seconds_total'] += collector.duration
+            counters['duplicate_queries_total'] += sum(count - 1 for count in duplicates.values())
+            counters['n_plus_one_requests_total'] += bool(duplicates)
+        for sql, count in duplicates.items():
+            logger.warning('N+1 in %s: %d x %s', view, count, sql)
+
+    def increment(self, name, value=1):
+        # Счётчики других подсистем, например отклонённые отправки
+        with self._lock:
+            self._extra[name] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {view: dict(counters) for view, counters in self._views.items()}, dict(self._extra)
+
+    def render(self, extra=None):
+        views, counters = self.snapshot()
+        counters.update(extra or {})
+        lines = []
+        for name, help_text in self.COUNTERS:
+            lines.append(f'# HELP polls_{name} {help_text}')
+            lines.append(f'# TYPE polls_{name} counter')
+            for view, values in sorted(views.items()):
+                lines.append(f'polls_{name}{{view="{view}"}} {values.get(name, 0):g}')
+        for name, value in sorted(counters.items()):
+            lines.append(f'# TYPE polls_{name} counter')
+            lines.append(f'polls_{name} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+            self._extra.clear()
+
+
+registry = MetricsRegistry()
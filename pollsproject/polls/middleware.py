@@ -0,0 +1,62 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import connection
+
+from .metrics import QueryCollector, query_settings, registry
+
+
+def _add_wrapper(collector):
+    connection.execute_wrappers.append(collector)
+
+
+def _remove_wrapper(collector):
+    connection.execute_wrappers.remove(collector)
+
+
+class QueryMetricsMiddleware:
+    """Время, число и длительность SQL-запросов для каждого представления polls.views."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        collector = QueryCollector()
+        start = time.perf_counter()
+        with connection.execute_wrapper(collector):
+            response = self.get_response(request)
+        return self.finish(request, response, time.perf_counter() - start, collector)
+
+    async def __acall__(self, request):
+        # Под ASGI синхронные представления и async ORM выполняются через
+        # sync_to_async(thread_sensitive=True) в одном потоке на запрос;
+        # обёртка ставится на соединение этого потока, а не цикла событий
+        collector = QueryCollector()
+        start = time.perf_counter()
+        await sync_to_async(_add_wrapper)(collector)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(_remove_wrapper)(collector)
+        return self.finish(request, response, time.perf_counter() - start, collector)
+
+    def finish(self, request, response, wall, collector):
+        match = request.resolver_match
+        if match is None or match.func.__module__ != 'polls.views':
+            return response
+        config = query_settings()
+        registry.record(match.url_name or match.view_name, wall, collector, config['DUPLICATE_THRESHOLD'])
+        if config['SERVER_TIMING']:
+            response['Server-Timing'] = (
+                f'app;dur={wall * 1000:.1f}, '
+                f'db;dur={collector.duration * 1000:.1f};desc="{collector.count} queries"'
+            )
+        return response
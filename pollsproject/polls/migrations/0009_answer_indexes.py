@@ -0,0 +1,50 @@
+# Generated by Django 5.2 on 2026-10-18 17:46
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_answers(apps, schema_editor):
+    """Оставляет по одному ответу (с наименьшим id) на ключ новых уникальных ограничений.
+
+    Раньше повторная отправка сохранялась целиком, и такие дубли не дали бы
+    создать ограничения. Анонимные ответы (user IS NULL) ограничениям не мешают.
+    Итоги затронутых опросов пересчитывает manage.py rebuild_results.
+    """
+    Answer = apps.get_model('polls', 'Answer')
+    duplicates = (
+        Answer.objects.filter(user__isnull=False).values('question_id', 'user_id', 'choice_id')
+        .annotate(keep=Min('id'), count=Count('id')).filter(count__gt=1).order_by()
+    )
+    for row in list(duplicates):
+        (Answer.objects.filter(question_id=row['question_id'], user_id=row['user_id'], choice_id=row['choice_id'])
+         .exclude(id=row['keep']).delete())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0008_survey_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_answers, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(condition=models.Q(('user__isnull', False)), fields=['survey', 'user'], name='answer_survey_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['user', 'survey'], name='answer_user_survey_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='answer',
+            constraint=models.UniqueConstraint(condition=models.Q(('choice__isnull', True)), fields=('question', 'user'), name='unique_answer_without_choice'),
+        ),
+        migrations.AddConstraint(
+            model_name='answer',
+            constraint=models.UniqueConstraint(fields=('question', 'user', 'choice'), name='unique_answer_choice'),
+        ),
+    ]
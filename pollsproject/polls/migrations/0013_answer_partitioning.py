@@ -0,0 +1,85 @@
+# Generated by Django 5.2 on 2026-10-18 18:00
+
+from django.conf import settings
+from django.db import migrations, models
+
+# Число hash-секций polls_answer; меняется только пересозданием таблицы
+DEFAULT_PARTITIONS = 16
+
+
+def rebuild_answer_table(apps, schema_editor, partitions):
+    """Пересоздаёт polls_answer с теми же данными: секционированной по survey_id или обычной.
+
+    Только для PostgreSQL. Первичный ключ секционированной таблицы — (id, survey_id),
+    id по-прежнему берётся из общей последовательности. Данные копируются
+    внутри транзакции миграции, на больших таблицах это долго.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    model = apps.get_model('polls', 'Answer')
+    table = model._meta.db_table
+    quote = schema_editor.quote_name
+    old = f'{table}_old'
+    sequence = f'{table}_id_seq'
+    execute = schema_editor.execute
+
+    execute(f'ALTER TABLE {quote(table)} RENAME TO {quote(old)}')
+    partition_by = f' PARTITION BY HASH ({quote("survey_id")})' if partitions else ''
+    # Без INCLUDING DEFAULTS: умолчание id ссылалось бы на последовательность старой таблицы
+    execute(f'CREATE TABLE {quote(table)} (LIKE {quote(old)}){partition_by}')
+    for remainder in range(partitions):
+        execute(f'CREATE TABLE {quote(f"{table}_p{remainder}")} PARTITION OF {quote(table)} '
+                f'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})')
+    execute(f'INSERT INTO {quote(table)} SELECT * FROM {quote(old)}')
+    # Вместе со старой таблицей удаляются её индексы, ограничения и identity-последовательность
+    execute(f'DROP TABLE {quote(old)}')
+
+    execute(f'CREATE SEQUENCE {quote(sequence)} OWNED BY {quote(table)}.{quote("id")}')
+    execute(f'ALTER TABLE {quote(table)} ALTER COLUMN {quote("id")} SET DEFAULT nextval(%s)', [sequence])
+    execute(f'SELECT setval(%s, COALESCE(MAX({quote("id")}), 0) + 1, false) FROM {quote(table)}', [sequence])
+    key = 'id, survey_id' if partitions else 'id'
+    execute(f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(f"{table}_pkey")} PRIMARY KEY ({key})')
+
+    for sql in schema_editor._model_indexes_sql(model):
+        execute(sql)
+    for constraint in model._meta.constraints:
+        schema_editor.add_constraint(model, constraint)
+    for field in model._meta.local_fields:
+        if field.remote_field and field.db_constraint:
+            execute(schema_editor._create_fk_sql(model, field, '_fk_%(to_table)s_%(to_column)s'))
+
+
+def partition_answers(apps, schema_editor):
+    rebuild_answer_table(apps, schema_editor, getattr(settings, 'POLLS_ANSWER_PARTITIONS', DEFAULT_PARTITIONS))
+
+
+def unpartition_answers(apps, schema_editor):
+    rebuild_answer_table(apps, schema_editor, 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0012_survey_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='answer',
+            name='unique_answer_without_choice',
+        ),
+        migrations.RemoveConstraint(
+            model_name='answer',
+            name='unique_answer_choice',
+        ),
+        migrations.AddConstraint(
+            model_name='answer',
+            constraint=models.UniqueConstraint(condition=models.Q(('choice__isnull', True)), fields=('survey', 'question', 'user'), name='unique_answer_without_choice'),
+        ),
+        migrations.AddConstraint(
+            model_name='answer',
+            constraint=models.UniqueConstraint(fields=('survey', 'question', 'user', 'choice'), name='unique_answer_choice'),
+        ),
+        migrations.RunPython(partition_answers, unpartition_answers),
+    ]
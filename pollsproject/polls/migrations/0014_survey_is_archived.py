@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0013_answer_partitioning'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='survey',
+            name='is_archived',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
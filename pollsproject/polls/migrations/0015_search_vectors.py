@@ -0,0 +1,57 @@
+# Generated by Django 5.2 on 2026-10-18 22:30
+
+from django.conf import settings
+from django.db import migrations
+
+# Конфигурация to_tsvector; после смены нужно пересоздать колонки (откатить и применить миграцию)
+DEFAULT_SEARCH_CONFIG = 'russian'
+
+SEARCH_SOURCES = (
+    ('Survey', 'title'),
+    ('Question', 'text'),
+    ('Answer', 'text_answer'),
+)
+
+
+def add_search_vectors(apps, schema_editor):
+    """Генерируемые колонки search_vector и GIN-индексы по ним, только для PostgreSQL.
+
+    Колонки пересчитывает сама СУБД при вставке и изменении строки, поэтому
+    bulk_create и update() их не обходят. Для пустых text_answer вектор NULL
+    и в частичный индекс не попадает. Добавление колонки переписывает таблицу.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    config = getattr(settings, 'POLLS_SEARCH_CONFIG', DEFAULT_SEARCH_CONFIG)
+    quote = schema_editor.quote_name
+    for model_name, field in SEARCH_SOURCES:
+        table = apps.get_model('polls', model_name)._meta.db_table
+        schema_editor.execute(
+            f'ALTER TABLE {quote(table)} ADD COLUMN search_vector tsvector '
+            f'GENERATED ALWAYS AS (to_tsvector(%s::regconfig, {quote(field)})) STORED',
+            [config],
+        )
+        schema_editor.execute(
+            f'CREATE INDEX {quote(f"{table}_search_gin")} ON {quote(table)} '
+            f'USING GIN (search_vector) WHERE search_vector IS NOT NULL'
+        )
+
+
+def remove_search_vectors(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for model_name, _ in SEARCH_SOURCES:
+        table = apps.get_model('polls', model_name)._meta.db_table
+        # Индекс удаляется вместе с колонкой
+        schema_editor.execute(f'ALTER TABLE {schema_editor.quote_name(table)} DROP COLUMN search_vector')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0014_survey_is_archived'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_vectors, remove_search_vectors),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2 on 2026-10-18 18:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+
+
+def copy_rankings(apps, schema_editor):
+    """Переносит ranking_answer в RankingPosition пачками по id ответа.
+
+    Старые данные не проверялись при записи: варианты не из этого вопроса
+    и повторы пропускаются, места остальных вариантов идут подряд.
+    """
+    Answer = apps.get_model('polls', 'Answer')
+    Choice = apps.get_model('polls', 'Choice')
+    RankingPosition = apps.get_model('polls', 'RankingPosition')
+    choices = {}
+    for choice_id, question_id in Choice.objects.filter(question__question_type='ranking').values_list('id', 'question_id'):
+        choices.setdefault(question_id, set()).add(choice_id)
+    last_id = 0
+    while True:
+        rows = list(
+            Answer.objects.filter(id__gt=last_id, ranking_answer__isnull=False).order_by('id')
+            .values_list('id', 'question_id', 'ranking_answer')[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        positions = []
+        for answer_id, question_id, ranking in rows:
+            valid = choices.get(question_id, set())
+            ranked = []
+            for choice_id in ranking if isinstance(ranking, list) else []:
+                if isinstance(choice_id, int) and choice_id in valid and choice_id not in ranked:
+                    ranked.append(choice_id)
+            positions.extend(RankingPosition(answer_id=answer_id, question_id=question_id, choice_id=choice_id,
+                                             position=position) for position, choice_id in enumerate(ranked))
+        RankingPosition.objects.bulk_create(positions)
+        last_id = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0015_search_vectors'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RankingPosition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField()),
+                ('answer', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='positions', to='polls.answer')),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='polls.choice')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='polls.question')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['question', 'answer'], name='ranking_question_idx')],
+                'constraints': [models.UniqueConstraint(fields=('answer', 'position'), name='unique_ranking_position'), models.UniqueConstraint(fields=('answer', 'choice'), name='unique_ranking_choice')],
+            },
+        ),
+        migrations.RunPython(copy_rankings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-18 18:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0016_ranking_positions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='rankingposition',
+            name='answer',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='positions', to='polls.answer'),
+        ),
+    ]
@@ -1,16 +1,48 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
 from django.db.models import JSONField
+from django.utils import timezone
+
+class SurveyQuerySet(models.QuerySet):
+    def with_questions(self):
+        # Всё дерево опроса за три запроса, независимо от числа опросов и вопросов
+        return self.select_related('author').prefetch_related('questions__choices')
 
 class Survey(models.Model):
     title = models.CharField(max_length=200)
     is_active = models.BooleanField(default=True)
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+    version = models.PositiveIntegerField(default=1, editable=False)
+    # Ответы закрытого опроса вынесены из polls_answer в файл архива (polls.archive)
+    is_archived = models.BooleanField(default=False, editable=False)
+
+    objects = SurveyQuerySet.as_manager()
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # Версия растёт при каждом сохранении, по ней инвалидируется кэш определения
+        bump = not self._state.adding
+        if bump:
+            self.version = models.F('version') + 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated_at'}
+        super().save(*args, **kwargs)
+        if bump:
+            self.refresh_from_db(fields=['version'])
+
+    @classmethod
+    def bump_version(cls, **lookup):
+        cls.objects.filter(**lookup).update(version=models.F('version') + 1, updated_at=timezone.now())
+
+    @property
+    def last_modified(self):
+        return self.updated_at or self.created_at
+
 class Question(models.Model):
     QUESTION_TYPES = (
         ('radio', 'Radio'),
@@ -38,7 +70,27 @@ class Choice(models.Model):
     def __str__(self):
         return self.text
 
+def answer_id_overlap():
+    return getattr(settings, 'POLLS_ANSWER_ID_OVERLAP', 1000)
+
+class AnswerQuerySet(models.QuerySet):
+    def for_survey(self, survey):
+        # В Postgres polls_answer секционирована по survey_id (миграция 0013):
+        # с этим фильтром запрос читает только одну секцию
+        return self.filter(survey=survey)
+
+    def since(self, watermark):
+        """Ответы для дочитывания после watermark — наибольшего уже прочитанного id.
+
+        id выдаётся при вставке, а строка становится видна при фиксации транзакции,
+        поэтому ответ с меньшим id может появиться позже. Последние
+        POLLS_ANSWER_ID_OVERLAP id перечитываются; уже учтённые строки вызывающий пропускает сам.
+        """
+        return self.filter(id__gt=watermark - answer_id_overlap())
+
 class Answer(models.Model):
+    RATING_MIN, RATING_MAX = 1, 5
+
     question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='answers')
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE, null=True, blank=True)
@@ -47,14 +99,157 @@ class Answer(models.Model):
     yesno_answer = models.BooleanField(null=True, blank=True)  
     ranking_answer = JSONField(null=True, blank=True)         
     survey = models.ForeignKey(Survey, on_delete=models.CASCADE)
-    
+
+    objects = AnswerQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Ответы пользователя на опрос (detail); анонимные ответы в индекс не попадают
+            models.Index(fields=['survey', 'user'], condition=models.Q(user__isnull=False),
+                         name='answer_survey_user_idx'),
+            # Опросы, в которых участвовал пользователь (profile, profile_view)
+            models.Index(fields=['user', 'survey'], name='answer_user_survey_idx'),
+        ]
+        # Уникальные ограничения секционированной таблицы обязаны включать ключ секционирования,
+        # поэтому в них есть survey; вопрос и так принадлежит одному опросу
+        constraints = [
+            # Один ответ пользователя на вопрос без вариантов (text, rating, yesno, ranking)
+            models.UniqueConstraint(fields=['survey', 'question', 'user'], condition=models.Q(choice__isnull=True),
+                                    name='unique_answer_without_choice'),
+            # Каждый вариант radio/checkbox пользователь может отметить только один раз
+            models.UniqueConstraint(fields=['survey', 'question', 'user', 'choice'], name='unique_answer_choice'),
+        ]
+
     def __str__(self):
         return f"Answer to {self.question} by {self.user}"
 
     def clean(self):
         if self.question.question_type == 'radio' and not self.choice:
             raise ValidationError("Для вопроса с типом 'radio' требуется выбрать вариант ответа")
-        elif self.question.question_type == 'rating' and (self.rating_answer is None or self.rating_answer < 1 or self.rating_answer > 5):
-            raise ValidationError("Рейтинг должен быть числом от 1 до 5")
+        elif self.question.question_type == 'rating' and (self.rating_answer is None or not self.RATING_MIN <= self.rating_answer <= self.RATING_MAX):
+            raise ValidationError(f"Рейтинг должен быть числом от {self.RATING_MIN} до {self.RATING_MAX}")
         elif self.question.question_type == 'ranking' and not isinstance(self.ranking_answer, list):
-            raise ValidationError("Для ранжирования требуется список вариантов")
\ No newline at end of file
+            raise ValidationError("Для ранжирования требуется список вариантов")
+
+class RankingPositionQuerySet(models.QuerySet):
+    def create_for(self, answers, choices=None):
+        # Единственное место, где места выводятся из ranking_answer: новые отправки
+        # (results.record_submissions) и восстановление из архива.
+        # Ответы уже сохранены (после bulk_create у них есть id);
+        # choices — id существующих вариантов, места удалённых вариантов пропускаются
+        return self.bulk_create([
+            RankingPosition(answer_id=answer.id, question_id=answer.question_id, choice_id=choice_id, position=position)
+            for answer in answers if answer.ranking_answer
+            for position, choice_id in enumerate(answer.ranking_answer)
+            if choices is None or choice_id in choices
+        ], batch_size=5000)
+
+class RankingPosition(models.Model):
+    """Место варианта в ответе на вопрос ranking: типизированная копия Answer.ranking_answer.
+
+    Источник данных — ranking_answer, строки выводятся из него только
+    RankingPositionQuerySet.create_for. Ключ секционированной polls_answer —
+    (id, survey_id), поэтому внешний ключ на ответ не создаётся в БД
+    (db_constraint=False). Каскад по ответу отключил бы быстрое удаление ответов,
+    поэтому места удаляются явно: по question_id при архивации опроса, каскадом
+    вопроса и варианта и вместе с ответами удаляемого пользователя (signals).
+    """
+    answer = models.ForeignKey(Answer, on_delete=models.DO_NOTHING, related_name='positions',
+                               db_constraint=False, db_index=False)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='+')
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE, related_name='+')
+    position = models.PositiveSmallIntegerField()
+
+    objects = RankingPositionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Все места одного вопроса для аналитики ранжирования
+            models.Index(fields=['question', 'answer'], name='ranking_question_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['answer', 'position'], name='unique_ranking_position'),
+            models.UniqueConstraint(fields=['answer', 'choice'], name='unique_ranking_choice'),
+        ]
+
+class QuestionResult(models.Model):
+    survey = models.ForeignKey(Survey, on_delete=models.CASCADE, related_name='question_results')
+    question = models.OneToOneField(Question, on_delete=models.CASCADE, related_name='result')
+    responses = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    yes_count = models.IntegerField(default=0)
+    no_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Results for {self.question}"
+
+
+class ChoiceResult(models.Model):
+    survey = models.ForeignKey(Survey, on_delete=models.CASCADE, related_name='choice_results')
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='choice_results')
+    choice = models.OneToOneField(Choice, on_delete=models.CASCADE, related_name='result')
+    votes = models.IntegerField(default=0)
+    borda = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Results for {self.choice}"
+
+
+class RatingResult(models.Model):
+    survey = models.ForeignKey(Survey, on_delete=models.CASCADE, related_name='rating_results')
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='rating_results')
+    value = models.IntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['question', 'value'], name='unique_rating_result'),
+        ]
+
+    def __str__(self):
+        return f"{self.question}: {self.value}"
+
+
+class SurveyParticipation(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='participations')
+    survey = models.ForeignKey(Survey, on_delete=models.CASCADE, related_name='participations')
+    submitted_at = models.DateTimeField(default=timezone.now)
+    answer_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'survey'], name='unique_participation'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-submitted_at'], name='participation_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} in {self.survey}"
+
+
+class SubmissionOutbox(models.Model):
+    STATUSES = (
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    idempotency_key = models.CharField(max_length=100)
+    survey = models.ForeignKey(Survey, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    payload = JSONField()
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    error = JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'idempotency_key'], name='unique_submission_key'),
+        ]
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(status='pending'), name='outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"Submission {self.idempotency_key} by {self.user}"
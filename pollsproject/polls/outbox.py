@@ -0,0 +1,86 @@
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .models import Answer, SubmissionOutbox, SurveyParticipation
+from .results import record_submissions
+from .submissions import ARCHIVED, build_answers, claim_participation, load_questions
+
+ALREADY_SUBMITTED = "Вы уже ответили на этот опрос"
+
+
+def enqueue_submission(survey, user, key, payload):
+    # Повтор запроса с тем же ключом возвращает уже принятую отправку
+    try:
+        with transaction.atomic():
+            return SubmissionOutbox.objects.create(idempotency_key=key, survey=survey, user=user, payload=payload)
+    except IntegrityError:
+        return SubmissionOutbox.objects.get(user=user, idempotency_key=key)
+
+
+def _insert(entries):
+    # Отправки пишутся одним bulk_create; если пакет нарушил уникальность
+    # (например, параллельная синхронная отправка), каждая пишется отдельно
+    try:
+        with transaction.atomic():
+            claim_participation([(entry.survey, entry.user, answers) for entry, answers in entries])
+            Answer.objects.bulk_create([answer for _, answers in entries for answer in answers])
+        return entries
+    except IntegrityError:
+        saved = []
+        for entry, answers in entries:
+            try:
+                with transaction.atomic():
+                    claim_participation([(entry.survey, entry.user, answers)])
+                    Answer.objects.bulk_create(answers)
+                saved.append((entry, answers))
+            except IntegrityError:
+                entry.status, entry.error = 'failed', [ALREADY_SUBMITTED]
+        return saved
+
+
+def drain_outbox(batch_size=100):
+    """Переносит пакет принятых отправок из очереди в Answer и возвращает их число."""
+    with transaction.atomic():
+        entries = list(
+            SubmissionOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status='pending').select_related('survey', 'user').order_by('id')[:batch_size]
+        )
+        if not entries:
+            return 0
+        participated = set(
+            SurveyParticipation.objects
+            .filter(survey__in={entry.survey_id for entry in entries}, user__in={entry.user_id for entry in entries})
+            .values_list('user_id', 'survey_id')
+        )
+        questions, accepted = {}, []
+        for entry in entries:
+            key = (entry.user_id, entry.survey_id)
+            if key in participated:
+                entry.status, entry.error = 'failed', [ALREADY_SUBMITTED]
+                continue
+            # Опрос мог уйти в архив, пока отправка ждала в очереди
+            if entry.survey.is_archived:
+                entry.status, entry.error = 'failed', [ARCHIVED]
+                continue
+            if entry.survey_id not in questions:
+                questions[entry.survey_id] = load_questions(entry.survey)
+            try:
+                answers = build_answers(entry.survey, entry.user, entry.payload, questions[entry.survey_id])
+            except ValidationError as exc:
+                entry.status, entry.error = 'failed', exc.detail
+                continue
+            participated.add(key)
+            accepted.append((entry, answers))
+
+        # Сводные таблицы и участие обновляются сразу для всего пакета,
+        # а не сигналом answers_submitted на каждую отправку
+        saved = _insert(accepted)
+        record_submissions([(entry.survey, entry.user, answers) for entry, answers in saved])
+        for entry, _ in saved:
+            entry.status = 'done'
+        now = timezone.now()
+        for entry in entries:
+            entry.processed_at = now
+        SubmissionOutbox.objects.bulk_update(entries, ['status', 'error', 'processed_at'])
+    return len(entries)
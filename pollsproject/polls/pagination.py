@@ -0,0 +1,114 @@
+import base64
+import json
+
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.utils.urls import replace_query_param
+
+
+class SurveyCursorPagination(BasePagination):
+    """Keyset-пагинация по (created_at, id) от новых опросов к старым.
+
+    Курсор хранит ключ последнего опроса страницы, поэтому следующая страница
+    выбирается условием WHERE по индексу, а не через OFFSET.
+    Опросы без created_at (созданные до появления поля) идут в конце списка.
+    """
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Некорректный курсор'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def encode_cursor(self, survey):
+        created_at = survey.created_at.isoformat() if survey.created_at else None
+        raw = json.dumps([created_at, survey.pk]).encode()
+        return base64.urlsafe_b64encode(raw).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            created_at, pk = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if created_at is not None:
+                created_at = parse_datetime(created_at)
+                if created_at is None:
+                    raise ValueError(encoded)
+            return created_at, int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def after(self, created_at, pk):
+        if created_at is None:
+            return Q(created_at__isnull=True, pk__lt=pk)
+        return (Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+                | Q(created_at__isnull=True))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+        queryset = queryset.order_by(F('created_at').desc(nulls_last=True), '-pk')
+        if position is not None:
+            queryset = queryset.filter(self.after(*position))
+        page = list(queryset[:size + 1])
+        self.next_cursor = self.encode_cursor(page[size - 1]) if len(page) > size else None
+        return page[:size]
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+
+class SearchPagination(BasePagination):
+    """Постраничный вывод результатов поиска без подсчёта общего числа совпадений.
+
+    Порядок задаёт релевантность, поэтому страницы нумеруются; есть ли следующая,
+    поиск сообщает сам, выбрав на одну запись больше.
+    """
+    page_size = 20
+    max_page_size = 100
+    max_page = 50
+    page_query_param = 'page'
+    page_size_query_param = 'page_size'
+    invalid_page_message = 'Некорректный номер страницы'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_page(self, request):
+        try:
+            page = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            raise NotFound(self.invalid_page_message)
+        if not 1 <= page <= self.max_page:
+            raise NotFound(self.invalid_page_message)
+        return page
+
+    def paginate_search(self, search, request):
+        self.request = request
+        size = self.get_page_size(request)
+        self.page = self.get_page(request)
+        results, self.has_next = search(offset=(self.page - 1) * size, limit=size)
+        return results
+
+    def get_next_link(self):
+        if not self.has_next or self.page >= self.max_page:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.page_query_param, self.page + 1)
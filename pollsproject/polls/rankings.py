@@ -0,0 +1,119 @@
+import itertools
+
+import numpy as np
+
+from . import archive
+from .models import RankingPosition
+
+POSITIONS_CHUNK_SIZE = 5000
+# Сколько ячеек (ответы × варианты × варианты) сравнивается за раз при подсчёте попарных побед
+PAIRWISE_CHUNK_CELLS = 1 << 22
+
+
+def load_positions(survey, question_id):
+    """Места вариантов вопроса массивом (n, 3): answer_id, choice_id, position.
+
+    Из таблицы читаются только три целых столбца без разбора JSON;
+    для опроса в архиве места восстанавливаются из ranking_answer архива.
+    """
+    if survey.is_archived:
+        rows = (
+            (row[0], choice_id, position)
+            for row in archive.iter_rows(survey) if row[2] == question_id and row[7]
+            for position, choice_id in enumerate(row[7])
+        )
+    else:
+        rows = (
+            RankingPosition.objects.filter(question_id=question_id)
+            .values_list('answer_id', 'choice_id', 'position').iterator(chunk_size=POSITIONS_CHUNK_SIZE)
+        )
+    return np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64).reshape(-1, 3)
+
+
+def rank_matrix(positions, choice_ids):
+    """Матрица мест (ответы × варианты) и маска ранжированных ячеек.
+
+    choice_ids — отсортированный массив вариантов вопроса. Места удалённых
+    вариантов отбрасываются, оставшиеся места ответа сжимаются до 0..m-1, как
+    будто удалённого варианта в ответе не было; неранжированная ячейка получает
+    место len(choice_ids), которое после сжатия не совпадает ни с одним настоящим.
+    """
+    columns = np.searchsorted(choice_ids, positions[:, 1])
+    known = columns < len(choice_ids)
+    known[known] = choice_ids[columns[known]] == positions[known, 1]
+    answer_ids, rows = np.unique(positions[known, 0], return_inverse=True)
+    columns, places = columns[known], positions[known, 2]
+    # Порядковый номер места внутри ответа: сортировка по (ответ, место) и отсчёт от начала группы
+    order = np.lexsort((places, rows))
+    sorted_rows = rows[order]
+    compact = np.empty_like(places)
+    compact[order] = np.arange(len(order)) - np.searchsorted(sorted_rows, sorted_rows)
+    matrix = np.full((len(answer_ids), len(choice_ids)), len(choice_ids), dtype=np.int32)
+    matrix[rows, columns] = compact
+    ranked = np.zeros(matrix.shape, dtype=bool)
+    ranked[rows, columns] = True
+    return matrix, ranked
+
+
+def pairwise_wins(matrix):
+    """wins[i, j] — в скольких ответах вариант i стоит выше варианта j.
+
+    Неранжированный вариант проигрывает любому ранжированному, два
+    неранжированных между собой не сравниваются. Ответы обрабатываются
+    кусками, чтобы промежуточный булев массив не превышал PAIRWISE_CHUNK_CELLS.
+    """
+    size = matrix.shape[1]
+    wins = np.zeros((size, size), dtype=np.int64)
+    step = max(1, PAIRWISE_CHUNK_CELLS // max(1, size * size))
+    for start in range(0, len(matrix), step):
+        chunk = matrix[start:start + step]
+        wins += (chunk[:, :, None] < chunk[:, None, :]).sum(axis=0)
+    return wins
+
+
+def ranking_stats(positions, choice_ids):
+    """Средние места, очки Борда, первые места и матрица попарных побед по массиву из load_positions."""
+    choice_ids = np.sort(np.asarray(choice_ids, dtype=np.int64))
+    size = len(choice_ids)
+    matrix, ranked = rank_matrix(positions, choice_ids)
+    counts = ranked.sum(axis=0)
+    # Места в ответе 0-based; среднее место — 1-based и только по ответам, где вариант ранжирован
+    place_sums = np.where(ranked, matrix + 1, 0).sum(axis=0)
+    mean_rank = np.divide(place_sums, counts, out=np.full(size, np.nan), where=counts > 0)
+    # Как results.borda_points: в ответе из m вариантов место p стоит m - 1 - p очков
+    lengths = ranked.sum(axis=1, keepdims=True)
+    borda = np.where(ranked, lengths - 1 - matrix, 0).sum(axis=0)
+    first = (matrix == 0).sum(axis=0)
+    return {
+        'choice_ids': choice_ids,
+        'responses': len(matrix),
+        'ranked': counts,
+        'mean_rank': mean_rank,
+        'borda': borda,
+        'first': first,
+        'wins': pairwise_wins(matrix),
+    }
+
+
+def question_ranking_stats(survey, question):
+    choices = dict(question.choices.values_list('id', 'text'))
+    stats = ranking_stats(load_positions(survey, question.pk), list(choices))
+    return {
+        'question': question.pk,
+        'responses': stats['responses'],
+        'choices': [
+            {
+                'id': choice_id,
+                'text': choices[choice_id],
+                'ranked': int(ranked),
+                'mean_rank': None if np.isnan(mean_rank) else round(float(mean_rank), 4),
+                'borda': int(borda),
+                'first': int(first),
+            }
+            for choice_id, ranked, mean_rank, borda, first in zip(
+                stats['choice_ids'].tolist(), stats['ranked'], stats['mean_rank'], stats['borda'], stats['first'],
+            )
+        ],
+        # wins[i][j] — сколько раз choices[i] поставлен выше choices[j]
+        'pairwise': {'choices': stats['choice_ids'].tolist(), 'wins': stats['wins'].tolist()},
+    }
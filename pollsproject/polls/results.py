@@ -0,0 +1,214 @@
+import itertools
+from collections import Counter, defaultdict
+
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.utils import timezone
+
+from . import archive, live
+from .models import Answer, ChoiceResult, QuestionResult, RankingPosition, RatingResult, SurveyParticipation
+
+
+def borda_points(ranking):
+    # Первое место получает n - 1 очко, последнее — 0
+    size = len(ranking)
+    return [(choice_id, size - 1 - position) for position, choice_id in enumerate(ranking)]
+
+
+def _increment(model, entries):
+    """Прибавляет счётчики к строкам сводной таблицы, создавая недостающие строки.
+
+    entries — словарь {lookup: Counter}, где lookup — кортеж пар поле/значение,
+    достаточный для создания строки. Стоит два запроса на таблицу.
+    """
+    entries = {lookup: delta for lookup, delta in entries.items() if delta}
+    if not entries:
+        return
+    model.objects.bulk_create([model(**dict(lookup)) for lookup in entries], ignore_conflicts=True)
+    condition = Q()
+    for lookup in entries:
+        condition |= Q(**dict(lookup))
+    fields = {field for delta in entries.values() for field in delta}
+    updates = {}
+    for field in fields:
+        whens = [When(Q(**dict(lookup)), then=Value(delta[field]))
+                 for lookup, delta in entries.items() if delta[field]]
+        updates[field] = F(field) + Case(*whens, default=Value(0), output_field=models.IntegerField())
+    model.objects.filter(condition).update(**updates)
+
+
+def summarize_answers(answers):
+    """Приращения сводных таблиц по ответам: три словаря {lookup: Counter} для _increment."""
+    questions, choices, ratings = defaultdict(Counter), defaultdict(Counter), defaultdict(Counter)
+    counted = set()
+    for answer in answers:
+        question = answer.question
+        key = (('survey_id', answer.survey_id), ('question_id', question.id))
+        # Несколько отмеченных вариантов checkbox — это один ответ на вопрос
+        if question.question_type != 'checkbox' or (question.id, answer.user_id) not in counted:
+            counted.add((question.id, answer.user_id))
+            questions[key]['responses'] += 1
+        if answer.choice_id is not None:
+            choices[key + (('choice_id', answer.choice_id),)]['votes'] += 1
+        if answer.rating_answer is not None:
+            questions[key]['rating_sum'] += answer.rating_answer
+            ratings[key + (('value', answer.rating_answer),)]['count'] += 1
+        if answer.yesno_answer is not None:
+            questions[key]['yes_count' if answer.yesno_answer else 'no_count'] += 1
+        if answer.ranking_answer:
+            for choice_id, points in borda_points(answer.ranking_answer):
+                choices[key + (('choice_id', choice_id),)]['borda'] += points
+    return questions, choices, ratings
+
+
+def record_answers(answers):
+    """Инкрементально обновляет сводные таблицы по только что сохранённым ответам."""
+    questions, choices, ratings = summarize_answers(answers)
+    _increment(QuestionResult, questions)
+    _increment(ChoiceResult, choices)
+    _increment(RatingResult, ratings)
+    live.record(questions, choices, ratings)
+
+
+def _rebuild_from_archive(survey, questions, chunk_size=5000):
+    # Ответы одного пользователя не разрываются между пачками: иначе checkbox посчитается дважды
+    batch = []
+    for _, rows in itertools.groupby(archive.iter_rows(survey), key=lambda row: row[1]):
+        batch.extend(rows)
+        if len(batch) >= chunk_size:
+            record_answers(archive.answer_objects(survey, batch, questions))
+            batch = []
+    record_answers(archive.answer_objects(survey, batch, questions))
+
+
+@transaction.atomic
+def rebuild_results(survey):
+    """Пересчитывает сводные таблицы опроса с нуля по таблице ответов."""
+    QuestionResult.objects.filter(survey=survey).delete()
+    ChoiceResult.objects.filter(survey=survey).delete()
+    RatingResult.objects.filter(survey=survey).delete()
+
+    answers = Answer.objects.for_survey(survey)
+    questions = {question.id: question for question in survey.questions.prefetch_related('choices')}
+    live.forget(survey.pk)
+    if survey.is_archived:
+        _rebuild_from_archive(survey, questions)
+        return
+    per_question = {
+        row['question_id']: row
+        for row in answers.values('question_id').annotate(
+            rows=Count('id'),
+            users=Count('user', distinct=True),
+            rating_sum=Sum('rating_answer'),
+            yes_count=Count('id', filter=Q(yesno_answer=True)),
+            no_count=Count('id', filter=Q(yesno_answer=False)),
+        )
+    }
+    question_results = []
+    for question in questions.values():
+        row = per_question.get(question.id, {})
+        question_results.append(QuestionResult(
+            survey=survey,
+            question=question,
+            responses=row.get('users' if question.question_type == 'checkbox' else 'rows', 0),
+            rating_sum=row.get('rating_sum') or 0,
+            yes_count=row.get('yes_count', 0),
+            no_count=row.get('no_count', 0),
+        ))
+    QuestionResult.objects.bulk_create(question_results)
+
+    votes = dict(answers.filter(choice__isnull=False).values_list('choice_id').annotate(Count('id')))
+    borda = Counter()
+    ranking_rows = answers.filter(question__question_type='ranking', ranking_answer__isnull=False)
+    for ranking in ranking_rows.values_list('ranking_answer', flat=True).iterator(chunk_size=2000):
+        for choice_id, points in borda_points(ranking):
+            borda[choice_id] += points
+    ChoiceResult.objects.bulk_create([
+        ChoiceResult(survey=survey, question=question, choice=choice,
+                     votes=votes.get(choice.id, 0), borda=borda.get(choice.id, 0))
+        for question in questions.values() for choice in question.choices.all()
+    ])
+
+    histogram = answers.filter(rating_answer__isnull=False).values_list('question_id', 'rating_answer').annotate(Count('id'))
+    RatingResult.objects.bulk_create([
+        RatingResult(survey=survey, question_id=question_id, value=value, count=count)
+        for question_id, value, count in histogram
+    ])
+
+
+def format_results(survey_id, title, questions, totals, choice_totals, histograms):
+    """Итоги опроса в формате API.
+
+    questions — вопросы из определения опроса (словари с choices), totals —
+    {question_id: счётчики QuestionResult}, choice_totals — {choice_id: счётчики
+    ChoiceResult}, histograms — {question_id: {оценка: число}}.
+    """
+    data = []
+    for question in questions:
+        result = totals.get(question['id'], {})
+        entry = {
+            'id': question['id'],
+            'text': question['text'],
+            'question_type': question['question_type'],
+            'responses': result.get('responses', 0),
+        }
+        if question['question_type'] in ('radio', 'checkbox', 'ranking'):
+            key = 'borda' if question['question_type'] == 'ranking' else 'votes'
+            choices = [{'id': choice['id'], 'text': choice['text'], key: choice_totals.get(choice['id'], {}).get(key, 0)}
+                       for choice in question['choices']]
+            if question['question_type'] == 'ranking':
+                choices.sort(key=lambda choice: choice['borda'], reverse=True)
+            entry['choices'] = choices
+        elif question['question_type'] == 'rating':
+            histogram = dict(sorted(histograms.get(question['id'], {}).items()))
+            total = sum(histogram.values())
+            entry['histogram'] = histogram
+            entry['mean'] = round(result.get('rating_sum', 0) / total, 2) if total else None
+        elif question['question_type'] == 'yesno':
+            entry['yes'] = result.get('yes_count', 0)
+            entry['no'] = result.get('no_count', 0)
+        data.append(entry)
+    return {'survey': survey_id, 'title': title, 'questions': data}
+
+
+def survey_results(survey):
+    """Собирает итоги опроса из сводных таблиц: число запросов не зависит от числа ответов."""
+    questions = [
+        {'id': question.id, 'text': question.text, 'question_type': question.question_type,
+         'choices': [{'id': choice.id, 'text': choice.text} for choice in question.choices.all()]}
+        for question in survey.questions.prefetch_related('choices')
+    ]
+    return format_results(survey.id, survey.title, questions, *live.load_totals(survey.id))
+
+
+def record_submissions(submissions):
+    """Обновляет всё производное от принятых отправок: список [(survey, user, answers)].
+
+    Единая точка для синхронной отправки (сигнал answers_submitted) и пакетного
+    разбора очереди (outbox.drain_outbox): сводные таблицы, места ранжирования
+    и денормализованный список опросов пользователя для страниц профиля.
+    """
+    answers = [answer for _, _, rows in submissions for answer in rows]
+    record_answers(answers)
+    RankingPosition.objects.create_for(answers)
+    SurveyParticipation.objects.bulk_create(
+        [SurveyParticipation(user=user, survey=survey, answer_count=len(rows))
+         for survey, user, rows in submissions if user is not None and user.is_authenticated],
+        update_conflicts=True, unique_fields=['user', 'survey'], update_fields=['answer_count', 'submitted_at'],
+    )
+
+
+def backfill_participation(batch_size=1000):
+    """Заполняет SurveyParticipation по уже сохранённым ответам и возвращает число записей."""
+    rows = (Answer.objects.filter(user__isnull=False).order_by()
+            .values_list('user_id', 'survey_id').annotate(Count('id')).iterator(chunk_size=batch_size))
+    total = 0
+    while True:
+        batch = [SurveyParticipation(user_id=user_id, survey_id=survey_id, answer_count=count)
+                 for user_id, survey_id, count in itertools.islice(rows, batch_size)]
+        if not batch:
+            return total
+        SurveyParticipation.objects.bulk_create(
+            batch, update_conflicts=True, unique_fields=['user', 'survey'], update_fields=['answer_count']
+        )
+        total += len(batch)
@@ -0,0 +1,238 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+from django.db import connection, connections
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+
+from .conditional import list_state
+from .models import Answer, Question, Survey
+
+# Конфигурация to_tsvector в PostgreSQL; у миграции polls 0015 своя копия значения
+DEFAULT_SEARCH_CONFIG = 'russian'
+SEARCH_KINDS = ('survey', 'question', 'answer')
+SEARCH_CHUNK_SIZE = 5000
+
+WORD = re.compile(r'\w+')
+
+
+def search_config():
+    # Колонки search_vector построены с конфигурацией на момент миграции 0015; после смены
+    # POLLS_SEARCH_CONFIG запросы с ними не совпадают, пока колонки не пересозданы (см. check_search_config)
+    return getattr(settings, 'POLLS_SEARCH_CONFIG', DEFAULT_SEARCH_CONFIG)
+
+
+@register(Tags.database)
+def check_search_config(app_configs, databases=None, **kwargs):
+    """POLLS_SEARCH_CONFIG должна совпадать с конфигурацией, по которой построены колонки search_vector.
+
+    Проверка обращается к БД, поэтому выполняется в migrate и manage.py check --database default.
+    """
+    errors = []
+    for alias in databases or ():
+        if connections[alias].vendor != 'postgresql':
+            continue
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_get_expr(d.adbin, d.adrelid) FROM pg_attrdef d "
+                "JOIN pg_attribute a ON a.attrelid = d.adrelid AND a.attnum = d.adnum "
+                "WHERE a.attrelid = to_regclass(%s) AND a.attname = 'search_vector'",
+                [Survey._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if row and f"'{search_config()}'::regconfig" not in row[0]:
+            errors.append(Error(
+                f"POLLS_SEARCH_CONFIG = {search_config()!r}, а search_vector построены как {row[0]}",
+                hint="Верните прежнее значение или пересоздайте колонки: manage.py migrate polls 0014, затем migrate polls",
+                id='polls.E001',
+            ))
+    return errors
+
+
+def tokenize(text):
+    return [word.replace('ё', 'е') for word in WORD.findall(text.lower())]
+
+
+class InvertedIndex:
+    """Инвертированный индекс в памяти: термин -> {ключ документа: частота}, ранжирование BM25."""
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.lengths = {}
+        self.total_length = 0
+
+    def add(self, key, text):
+        terms = Counter(tokenize(text or ''))
+        if not terms:
+            return
+        for term, count in terms.items():
+            self.postings[term][key] = count
+        self.lengths[key] = sum(terms.values())
+        self.total_length += self.lengths[key]
+
+    def search(self, terms, accept=None):
+        """{ключ: оценка} документов, содержащих все термины запроса."""
+        postings = [self.postings.get(term, {}) for term in set(terms)]
+        if not postings or not all(postings):
+            return {}
+        postings.sort(key=len)
+        keys = [key for key in postings[0] if all(key in other for other in postings[1:])]
+        if accept is not None:
+            keys = [key for key in keys if accept(key)]
+        size = len(self.lengths)
+        average = self.total_length / size
+        scores = {}
+        for key in keys:
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[key] / average)
+            score = 0
+            for posting in postings:
+                idf = math.log(1 + (size - len(posting) + 0.5) / (len(posting) + 0.5))
+                count = posting[key]
+                score += idf * count * (self.k1 + 1) / (count + norm)
+            scores[key] = score
+        return scores
+
+
+class FallbackSearch:
+    """Поиск без PostgreSQL (SQLite, тесты): индексы строятся в памяти процесса.
+
+    Названия опросов и тексты вопросов переиндексируются целиком, когда меняется
+    состояние списка опросов (изменение вопроса повышает версию опроса).
+    Ответы только дописываются: индексируются ответы после watermark
+    (см. AnswerQuerySet.since), уже проиндексированные пропускаются,
+    а удалённые отбрасываются при загрузке найденных строк.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = None
+        self.structure = InvertedIndex()
+        self.answers = InvertedIndex()
+        self.answer_surveys = {}
+        self.watermark = 0
+
+    def refresh(self):
+        state = list_state()
+        if state != self.state:
+            self.structure = InvertedIndex()
+            for pk, title in Survey.objects.values_list('id', 'title').iterator(chunk_size=SEARCH_CHUNK_SIZE):
+                self.structure.add(('survey', pk), title)
+            rows = Question.objects.values_list('id', 'text').iterator(chunk_size=SEARCH_CHUNK_SIZE)
+            for pk, text in rows:
+                self.structure.add(('question', pk), text)
+            self.state = state
+        rows = (
+            Answer.objects.since(self.watermark).filter(text_answer__isnull=False).order_by('id')
+            .values_list('id', 'survey_id', 'text_answer').iterator(chunk_size=SEARCH_CHUNK_SIZE)
+        )
+        for pk, survey_id, text in rows:
+            if pk in self.answer_surveys:
+                continue
+            self.answers.add(pk, text)
+            self.answer_surveys[pk] = survey_id
+            self.watermark = max(self.watermark, pk)
+
+    def search(self, query, kinds, own_surveys, limit):
+        terms = tokenize(query)
+        with self.lock:
+            self.refresh()
+            scores = {key: score for key, score in self.structure.search(terms).items() if key[0] in kinds}
+            if 'answer' in kinds:
+                answers = self.answers.search(terms, lambda pk: self.answer_surveys[pk] in own_surveys)
+                scores.update((('answer', pk), score) for pk, score in answers.items())
+        return heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0][0], -item[0][1]))
+
+
+_fallback = None
+_fallback_lock = threading.Lock()
+
+
+def get_fallback():
+    global _fallback
+    with _fallback_lock:
+        if _fallback is None:
+            _fallback = FallbackSearch()
+        return _fallback
+
+
+def clear_search_index():
+    global _fallback
+    with _fallback_lock:
+        _fallback = None
+
+
+def _postgres_hits(query, kinds, user, limit):
+    # Каждая ветка отдаёт не больше limit лучших строк, общий порядок — по ts_rank
+    branches, params = [], []
+    tables = {
+        'survey': (Survey._meta.db_table, ''),
+        'question': (Question._meta.db_table, ''),
+        'answer': (Answer._meta.db_table, f' AND survey_id IN (SELECT id FROM {Survey._meta.db_table} WHERE author_id = %s)'),
+    }
+    for kind in kinds:
+        table, condition = tables[kind]
+        branches.append(
+            f"(SELECT %s AS kind, id, ts_rank(search_vector, query) AS rank FROM {table}, "
+            f"websearch_to_tsquery(%s::regconfig, %s) query WHERE search_vector @@ query{condition} "
+            f"ORDER BY rank DESC, id DESC LIMIT %s)"
+        )
+        params += [kind, search_config(), query] + ([user.pk] if condition else []) + [limit]
+    sql = ' UNION ALL '.join(branches) + ' ORDER BY rank DESC, kind, id DESC LIMIT %s'
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [limit])
+        return [((kind, pk), rank) for kind, pk, rank in cursor.fetchall()]
+
+
+def search(query, user, kinds=SEARCH_KINDS, offset=0, limit=20):
+    """Найденные опросы, вопросы и текстовые ответы по убыванию релевантности.
+
+    Ответы ищутся только в опросах пользователя и только в polls_answer:
+    ответы опросов в архиве (archive.py) не находятся. Возвращает не больше limit
+    записей, начиная с offset, и признак того, что есть ещё.
+    """
+    kinds = [kind for kind in SEARCH_KINDS if kind in kinds]
+    if connection.vendor == 'postgresql':
+        hits = _postgres_hits(query, kinds, user, offset + limit + 1)
+    else:
+        own_surveys = set(Survey.objects.filter(author=user).values_list('id', flat=True)) if 'answer' in kinds else ()
+        hits = get_fallback().search(query, kinds, own_surveys, offset + limit + 1)
+    page = hits[offset:offset + limit]
+    return hydrate(page), len(hits) > offset + limit
+
+
+def hydrate(hits):
+    ids = defaultdict(list)
+    for (kind, pk), _ in hits:
+        ids[kind].append(pk)
+    rows = {
+        'survey': {pk: {'survey': pk, 'text': title}
+                   for pk, title in Survey.objects.filter(pk__in=ids['survey']).values_list('id', 'title')},
+        'question': {pk: {'survey': survey_id, 'text': text} for pk, survey_id, text in
+                     Question.objects.filter(pk__in=ids['question']).values_list('id', 'survey_id', 'text')},
+        'answer': {pk: {'survey': survey_id, 'question': question_id, 'text': text} for pk, survey_id, question_id, text in
+                   Answer.objects.filter(pk__in=ids['answer']).values_list('id', 'survey_id', 'question_id', 'text_answer')},
+    }
+    results = []
+    for (kind, pk), rank in hits:
+        # Строка могла быть удалена (или перенесена в архив) после индексации
+        if pk in rows[kind]:
+            results.append({'type': kind, 'id': pk, 'rank': round(rank, 4), **rows[kind][pk]})
+    return results
+
+
+def admin_search(queryset, search_term):
+    """Полнотекстовый фильтр для search_fields админки в PostgreSQL; None — использовать стандартный."""
+    if not search_term or connection.vendor != 'postgresql':
+        return None
+    table = queryset.model._meta.db_table
+    match = RawSQL(f'{connection.ops.quote_name(table)}.search_vector @@ websearch_to_tsquery(%s::regconfig, %s)',
+                   [search_config(), search_term], output_field=BooleanField())
+    return queryset.alias(search_match=match).filter(search_match=True)
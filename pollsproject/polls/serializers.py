@@ -1,5 +1,7 @@
+from django.db import transaction
 from rest_framework import serializers
 from .models import Survey, Question, Choice, Answer
+from . import authoring
 from django.contrib.auth.models import User
 
 class UserSerializer(serializers.ModelSerializer):
@@ -12,29 +14,61 @@ class ChoiceSerializer(serializers.ModelSerializer):
         model = Choice
         fields = ['id', 'text']
 
+class QuestionDefinitionSerializer(serializers.ModelSerializer):
+    choices = ChoiceSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Question
+        fields = ['id', 'text', 'question_type', 'choices']
+
+class SurveyDefinitionSerializer(serializers.ModelSerializer):
+    questions = QuestionDefinitionSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Survey
+        fields = ['id', 'title', 'is_active', 'questions']
+
 class AnswerSerializer(serializers.ModelSerializer):
     class Meta:
         model = Answer
-        fields = ['id', 'user', 'survey', 'question', 'choice', 'text_answer', 'rating_answer', 'yesno_answer', 'ranking_answer', 'created_at']
+        fields = ['id', 'user', 'survey', 'question', 'choice', 'text_answer', 'rating_answer', 'yesno_answer', 'ranking_answer']
+
+class ChoiceInputField(serializers.Field):
+    # Вариант ответа на входе: строка или {"id": ..., "text": ...} для сопоставления при обновлении
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            return data
+        if isinstance(data, dict) and isinstance(data.get('text'), str):
+            return {'id': data.get('id'), 'text': data['text']}
+        raise serializers.ValidationError("Ожидается строка или объект с полем text")
+
+class QuestionListSerializer(serializers.ListSerializer):
+    def create(self, validated_data):
+        # Все вопросы списка сохраняются одним пакетом
+        survey = validated_data[0]['survey'] if validated_data else None
+        return authoring.add_questions(survey, validated_data) if survey else []
 
 class QuestionSerializer(serializers.ModelSerializer):
     choices = serializers.ListField(
-        child=serializers.CharField(),
+        child=ChoiceInputField(),
         write_only=True,
         required=False,
         default=[]
     )
     choices_display = serializers.SerializerMethodField(source='choices')
 
+    id = serializers.IntegerField(required=False)
     text = serializers.CharField(allow_blank=True)
 
     class Meta:
         model = Question
         fields = ['id', 'text', 'question_type', 'choices', 'choices_display']
         extra_kwargs = {'choices_display': {'read_only': True}}
+        list_serializer_class = QuestionListSerializer
 
     def get_choices_display(self, obj):
-        return [choice.text for choice in obj.choices.all()]
+        # С id: редактор отправляет его обратно, и переименованный вариант сохраняет ответы
+        return [{'id': choice.id, 'text': choice.text} for choice in obj.choices.all()]
 
     def validate(self, data):
         valid_types = [choice[0] for choice in Question._meta.get_field('question_type').choices]
@@ -45,12 +79,7 @@ class QuestionSerializer(serializers.ModelSerializer):
         return data
 
     def create(self, validated_data):
-        choices_data = validated_data.pop('choices', [])
-        question = Question.objects.create(**validated_data)
-        for choice_text in choices_data:
-            if choice_text:
-                Choice.objects.create(question=question, text=choice_text)
-        return question
+        return authoring.add_questions(validated_data['survey'], [validated_data])[0]
 
 class SurveySerializer(serializers.ModelSerializer):
     questions = QuestionSerializer(many=True)
@@ -60,6 +89,14 @@ class SurveySerializer(serializers.ModelSerializer):
         model = Survey
         fields = ['id', 'title', 'is_active', 'questions', 'author']
 
+    def __init__(self, *args, **kwargs):
+        # fields позволяет отдать только часть полей, например без вложенных вопросов
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
     def validate(self, data):
         print("SurveySerializer validate data:", data)
         if not data.get('title'):
@@ -69,22 +106,29 @@ class SurveySerializer(serializers.ModelSerializer):
         return data
 
     def create(self, validated_data):
-        questions_data = validated_data.pop('questions', [])
-        survey = Survey.objects.create(**validated_data)
-        for question_data in questions_data:
-            question_data['survey'] = survey
-            QuestionSerializer().create(question_data)
+        survey, _ = authoring.create_survey(
+            validated_data['author'], validated_data['title'], validated_data.get('questions', []),
+            is_active=validated_data.get('is_active', True),
+        )
         return survey
 
+    @transaction.atomic
     def update(self, instance, validated_data):
+        # Архивный опрос принимает ответы только после manage.py restore_answers
+        if instance.is_archived and validated_data.get('is_active'):
+            raise serializers.ValidationError({'is_active': "Опрос в архиве: сначала восстановите ответы (manage.py restore_answers)"})
         questions_data = validated_data.pop('questions', None)
         instance.title = validated_data.get('title', instance.title)
         instance.is_active = validated_data.get('is_active', instance.is_active)
         instance.save()
 
         if questions_data:
-            instance.questions.all().delete()
-            for question_data in questions_data:
-                question_data['survey'] = instance
-                QuestionSerializer().create(question_data)
-        return instance
\ No newline at end of file
+            # Сводка изменений попадает в ответ, см. to_representation
+            self.changes = authoring.update_questions(instance, questions_data)
+        return instance
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if getattr(self, 'changes', None) is not None:
+            data['changes'] = self.changes
+        return data
\ No newline at end of file
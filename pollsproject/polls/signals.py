@@ -0,0 +1,73 @@
+import threading
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+from rest_framework.authtoken.models import Token
+
+from .archive import archive_path
+from .authentication import get_token_cache
+from .models import Choice, Question, RankingPosition, Survey
+from .results import record_submissions
+
+# Отправляется внутри транзакции после пакетного сохранения ответов:
+# bulk_create не вызывает post_save, поэтому сводные данные обновляются здесь.
+# Аргументы: survey, user, answers.
+answers_submitted = Signal()
+
+
+@receiver(answers_submitted)
+def update_results(sender, survey, user, answers, **kwargs):
+    record_submissions([(survey, user, answers)])
+
+
+_state = threading.local()
+
+
+@contextmanager
+def single_version_bump(survey):
+    # Массовые изменения дерева: вместо UPDATE на каждый вопрос и вариант
+    # версия опроса увеличивается один раз при выходе
+    _state.deferred = True
+    try:
+        yield
+    finally:
+        _state.deferred = False
+    Survey.bump_version(pk=survey.pk)
+
+
+@receiver([post_save, post_delete], sender=Question)
+def bump_survey_version_for_question(sender, instance, **kwargs):
+    if not getattr(_state, 'deferred', False):
+        Survey.bump_version(pk=instance.survey_id)
+
+
+@receiver([post_save, post_delete], sender=Choice)
+def bump_survey_version_for_choice(sender, instance, **kwargs):
+    if not getattr(_state, 'deferred', False):
+        Survey.bump_version(questions=instance.question_id)
+
+
+@receiver(post_delete, sender=Survey)
+def remove_answer_archive(sender, instance, **kwargs):
+    if instance.is_archived:
+        transaction.on_commit(lambda: archive_path(instance.pk).unlink(missing_ok=True))
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance, **kwargs):
+    get_token_cache().discard(instance.key)
+
+
+@receiver(pre_delete, sender=User)
+def remove_user_positions(sender, instance, **kwargs):
+    # Ответы пользователя удаляются каскадом, а их места — нет (on_delete=DO_NOTHING)
+    RankingPosition.objects.filter(answer__user=instance).delete()
+
+
+@receiver([post_save, post_delete], sender=User)
+def forget_user_tokens(sender, instance, **kwargs):
+    # Деактивация, смена прав и т.п.: закэшированная копия пользователя устарела
+    get_token_cache().discard_user(instance.pk)
@@ -0,0 +1,209 @@
+import asyncio
+import json
+import threading
+from collections import Counter, defaultdict, namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .live import counters_changed, get_aggregator
+from .metrics import registry
+
+DEFAULT_LIVE_STREAM = {
+    'TICK': 0.5,
+    'QUEUE_SIZE': 32,
+    'HEARTBEAT': 15,
+}
+
+# Маркер в очереди подписчика: он отстал, вместо пропущенных дельт нужен полный снимок
+RESYNC = object()
+
+# Сообщение такта: first и last — номера первого и последнего приращения в нём (LiveAggregator.versions)
+Delta = namedtuple('Delta', 'first last data')
+
+
+def stream_settings():
+    return {**DEFAULT_LIVE_STREAM, **getattr(settings, 'LIVE_STREAM', {})}
+
+
+def sse_message(event, data, event_id=None):
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False, separators=(",", ":"))}')
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+class Subscriber:
+    def __init__(self, survey_id, queue_size):
+        self.survey_id = survey_id
+        self.queue = asyncio.Queue(queue_size)
+        self.lagging = False
+
+    def offer(self, message):
+        # Медленный клиент не задерживает остальных: его очередь сбрасывается,
+        # и до получения полного снимка новые дельты ему не кладутся — они уже будут в снимке
+        if self.lagging:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            registry.increment('live_stream_resyncs_total')
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+            self.lagging = True
+
+    async def next_message(self, timeout):
+        message = await asyncio.wait_for(self.queue.get(), timeout)
+        if message is RESYNC:
+            self.lagging = False
+        return message
+
+
+class Publisher:
+    """Рассылает дельты живых счётчиков всем подписчикам опроса из одного места в процессе.
+
+    Дельты приходят из потоков, в которых коммитятся отправки, и копятся
+    под блокировкой. Раз в TICK секунд задача в цикле событий забирает
+    накопленное, кодирует одно сообщение на опрос и раскладывает его по
+    очередям подписчиков, поэтому стоимость отправки не зависит от числа
+    клиентов, а к БД на клиента не обращается.
+
+    Дельта такта помечается номерами вошедших в неё приращений: поток
+    сравнивает их с номером своего снимка (см. event_stream).
+    """
+
+    def __init__(self, tick, queue_size):
+        self.tick = tick
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+        self.pending = {}
+        self.versions = {}
+        self.sequence = Counter()
+        self.task = None
+
+    def subscribe(self, survey_id):
+        subscriber = Subscriber(survey_id, self.queue_size)
+        with self.lock:
+            self.subscribers[survey_id].add(subscriber)
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.task.get_loop() is not loop:
+            self.task = loop.create_task(self.run())
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            subscribers = self.subscribers.get(subscriber.survey_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.subscribers[subscriber.survey_id]
+                    self.pending.pop(subscriber.survey_id, None)
+                    self.versions.pop(subscriber.survey_id, None)
+
+    def publish(self, survey_id, version, questions, choices, ratings):
+        """Добавляет приращения с номером version к дельте опроса текущего такта; вызывается из любого потока."""
+        with self.lock:
+            if survey_id not in self.subscribers:
+                return
+            first, last = self.versions.get(survey_id, (version, version))
+            self.versions[survey_id] = (min(first, version), max(last, version))
+            delta = self.pending.setdefault(survey_id, {
+                'questions': defaultdict(Counter), 'choices': defaultdict(Counter), 'ratings': defaultdict(Counter),
+            })
+            for lookup, counts in questions.items():
+                delta['questions'][dict(lookup)['question_id']].update(counts)
+            for lookup, counts in choices.items():
+                delta['choices'][dict(lookup)['choice_id']].update(counts)
+            for lookup, counts in ratings.items():
+                lookup = dict(lookup)
+                delta['ratings'][lookup['question_id']][lookup['value']] += counts['count']
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            versions, self.versions = self.versions, {}
+            targets = {survey_id: list(self.subscribers.get(survey_id, ())) for survey_id in pending}
+        for survey_id, delta in pending.items():
+            self.sequence[survey_id] += 1
+            message = Delta(*versions[survey_id], sse_message('delta', delta, self.sequence[survey_id]))
+            for subscriber in targets[survey_id]:
+                subscriber.offer(message)
+        return bool(pending)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            if self.flush():
+                registry.increment('live_stream_ticks_total')
+            with self.lock:
+                if not self.subscribers:
+                    return
+
+
+_publisher = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher():
+    global _publisher
+    with _publisher_lock:
+        if _publisher is None:
+            config = stream_settings()
+            _publisher = Publisher(config['TICK'], config['QUEUE_SIZE'])
+        return _publisher
+
+
+@receiver(setting_changed)
+def reset_publisher(setting, **kwargs):
+    global _publisher
+    if setting == 'LIVE_STREAM':
+        _publisher = None
+
+
+@receiver(counters_changed)
+def publish_counters(sender, survey_id, version, questions, choices, ratings, **kwargs):
+    get_publisher().publish(survey_id, version, questions, choices, ratings)
+
+
+async def snapshot_message(survey_id):
+    """Снимок живых счётчиков: номер последнего учтённого приращения и сообщение SSE."""
+    # К сводным таблицам снимок обращается раз в SYNC_INTERVAL
+    (totals, choice_totals, histograms), _, version = await sync_to_async(get_aggregator().snapshot)(survey_id)
+    data = {'questions': totals, 'choices': choice_totals, 'ratings': histograms}
+    return version, sse_message('snapshot', data, get_publisher().sequence[survey_id])
+
+
+async def event_stream(survey_id):
+    """SSE-поток опроса: сначала снимок счётчиков, затем дельты по тактам публикатора.
+
+    Подписка оформляется до снимка, поэтому дельта между ними не теряется.
+    Дельта, целиком вошедшая в снимок, пропускается; дельта, вошедшая
+    частично, заменяется новым снимком — разделить склеенный такт нельзя.
+    """
+    publisher = get_publisher()
+    heartbeat = stream_settings()['HEARTBEAT']
+    subscriber = publisher.subscribe(survey_id)
+    registry.increment('live_stream_connections_total')
+    try:
+        yield f'retry: {int(heartbeat * 1000)}\n\n'.encode()
+        version, snapshot = await snapshot_message(survey_id)
+        yield snapshot
+        while True:
+            try:
+                message = await subscriber.next_message(heartbeat)
+            except asyncio.TimeoutError:
+                # Комментарий SSE держит соединение открытым через прокси
+                yield b': ping\n\n'
+                continue
+            if message is RESYNC or message.first <= version < message.last:
+                version, snapshot = await snapshot_message(survey_id)
+                yield snapshot
+            elif message.first > version:
+                yield message.data
+    finally:
+        publisher.unsubscribe(subscriber)
@@ -0,0 +1,188 @@
+from django.db import IntegrityError, transaction
+from rest_framework.exceptions import ValidationError
+
+from .models import Answer, Choice, Question, Survey, SurveyParticipation
+from .signals import answers_submitted
+
+YES_VALUES = (True, 'yes', 'true')
+NO_VALUES = (False, 'no', 'false')
+# Ответы архивного опроса лежат в файле архива; новые строки в polls_answer к ним не добавляются
+ARCHIVED = "Опрос в архиве и не принимает ответов"
+
+
+def load_questions(survey):
+    # Вопросы и варианты ответа всего опроса загружаются двумя запросами
+    return {question.id: question for question in survey.questions.prefetch_related('choices')}
+
+
+def questions_from_definition(definition):
+    # Вопросы из закэшированного определения опроса: проверка ответов без запросов к БД
+    questions = {}
+    for data in definition['questions']:
+        question = Question(id=data['id'], survey_id=definition['id'], text=data['text'],
+                            question_type=data['question_type'])
+        question._choice_map = {choice['id']: Choice(id=choice['id'], question_id=question.id, text=choice['text'])
+                                for choice in data['choices']}
+        questions[question.id] = question
+    return questions
+
+
+def claim_participation(submissions):
+    """Вставляет строки участия (без upsert) в транзакции, которая пишет ответы.
+
+    Из двух одновременных отправок одного пользователя в опрос вторая получит
+    IntegrityError на unique_participation, даже если её ответы не пересекаются
+    с первой по уникальным ограничениям Answer.
+    """
+    SurveyParticipation.objects.bulk_create(
+        [SurveyParticipation(user=user, survey=survey, answer_count=len(answers))
+         for survey, user, answers in submissions if user is not None and user.is_authenticated]
+    )
+
+
+def _to_int(value):
+    if isinstance(value, bool):
+        raise ValidationError("Ожидается идентификатор")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValidationError("Ожидается идентификатор")
+
+
+def _choice_map(question):
+    if not hasattr(question, '_choice_map'):
+        question._choice_map = {choice.id: choice for choice in question.choices.all()}
+    return question._choice_map
+
+
+def _get_choice(question, choice_id):
+    choice = _choice_map(question).get(_to_int(choice_id))
+    if choice is None:
+        raise ValidationError(f"Вариант {choice_id} не относится к вопросу {question.id}")
+    return choice
+
+
+def _build_rows(survey, user, item, questions):
+    if not isinstance(item, dict):
+        raise ValidationError("Ответ должен быть объектом")
+    question = questions.get(_to_int(item.get('question')))
+    if question is None:
+        raise ValidationError("Вопрос не найден в этом опросе")
+
+    row = {'survey': survey, 'question': question, 'user': user}
+    qtype = question.question_type
+    if qtype == 'radio':
+        return [Answer(choice=_get_choice(question, item.get('choice')), **row)]
+    if qtype == 'checkbox':
+        choice_ids = item.get('choices')
+        if choice_ids is None and item.get('choice') is not None:
+            choice_ids = [item['choice']]
+        if not isinstance(choice_ids, list):
+            raise ValidationError("Для вопроса с типом 'checkbox' требуется список вариантов")
+        return [Answer(choice=_get_choice(question, choice_id), **row) for choice_id in choice_ids]
+    if qtype == 'text':
+        text = item.get('text_answer')
+        if text is not None and not isinstance(text, str):
+            raise ValidationError("Текстовый ответ должен быть строкой")
+        return [Answer(text_answer=text, **row)]
+    if qtype == 'rating':
+        rating = item.get('rating_answer')
+        if isinstance(rating, bool):
+            raise ValidationError("Рейтинг должен быть числом")
+        try:
+            rating = int(rating)
+        except (TypeError, ValueError):
+            raise ValidationError("Рейтинг должен быть числом")
+        if not Answer.RATING_MIN <= rating <= Answer.RATING_MAX:
+            raise ValidationError(f"Рейтинг должен быть числом от {Answer.RATING_MIN} до {Answer.RATING_MAX}")
+        return [Answer(rating_answer=rating, **row)]
+    if qtype == 'yesno':
+        value = item.get('yesno_answer')
+        value = value.lower() if isinstance(value, str) else value
+        if value in YES_VALUES:
+            return [Answer(yesno_answer=True, **row)]
+        if value in NO_VALUES:
+            return [Answer(yesno_answer=False, **row)]
+        raise ValidationError("Ответ на вопрос 'да/нет' должен быть логическим значением")
+    if qtype == 'ranking':
+        ranking = item.get('ranking_answer')
+        if not isinstance(ranking, list):
+            raise ValidationError("Для ранжирования требуется список вариантов")
+        ranked_ids = [_get_choice(question, choice_id).id for choice_id in ranking]
+        if len(set(ranked_ids)) != len(ranked_ids):
+            raise ValidationError("Варианты в ранжировании не должны повторяться")
+        return [Answer(ranking_answer=ranked_ids, **row)]
+    raise ValidationError(f"Неизвестный тип вопроса: {qtype}")
+
+
+def build_answers(survey, user, payload, questions=None):
+    """Проверяет весь набор ответов в памяти и возвращает несохранённые Answer."""
+    if not isinstance(payload, list):
+        raise ValidationError("Ожидается список ответов")
+    if questions is None:
+        questions = load_questions(survey)
+    answers, errors, seen = [], [], set()
+    for item in payload:
+        try:
+            rows = _build_rows(survey, user, item, questions)
+            # Повторный ответ на тот же вопрос нарушил бы уникальность в Answer
+            keys = {(row.question.id, row.choice_id if row.question.question_type == 'checkbox' else None)
+                    for row in rows}
+            if keys & seen or len(keys) != len(rows):
+                raise ValidationError("Повторный ответ на вопрос")
+            seen |= keys
+            answers.extend(rows)
+            errors.append({})
+        except ValidationError as exc:
+            errors.append(exc.detail)
+    if any(errors):
+        raise ValidationError(errors)
+    return answers
+
+
+def form_payload(questions, data):
+    """Ответы HTML-формы опроса в формате API; questions — вопросы из определения опроса.
+
+    Поле question_<id> несёт ответ на вопрос, для ranking каждый вариант
+    приходит отдельным полем ranking_<id вопроса>_<id варианта> с номером места.
+    Вопросы без ответа пропускаются.
+    """
+    payload = []
+    for question in questions:
+        name, qtype = f"question_{question['id']}", question['question_type']
+        item = {'question': question['id']}
+        if qtype == 'checkbox':
+            if data.getlist(name):
+                payload.append({**item, 'choices': data.getlist(name)})
+        elif qtype == 'ranking':
+            places = {}
+            for choice in question['choices']:
+                place = data.get(f"ranking_{question['id']}_{choice['id']}")
+                if place is None:
+                    continue
+                try:
+                    places[choice['id']] = int(place)
+                except ValueError:
+                    raise ValidationError("Место в ранжировании должно быть числом")
+            if len(set(places.values())) != len(places):
+                raise ValidationError("Места в ранжировании не должны повторяться")
+            if places:
+                payload.append({**item, 'ranking_answer': sorted(places, key=places.get)})
+        elif data.get(name, '').strip():
+            key = {'radio': 'choice', 'text': 'text_answer', 'rating': 'rating_answer', 'yesno': 'yesno_answer'}[qtype]
+            payload.append({**item, key: data[name]})
+    return payload
+
+
+def save_submission(survey, user, payload):
+    if survey.is_archived:
+        raise ValidationError(ARCHIVED)
+    answers = build_answers(survey, user, payload)
+    try:
+        with transaction.atomic():
+            claim_participation([(survey, user, answers)])
+            Answer.objects.bulk_create(answers)
+            answers_submitted.send(sender=Survey, survey=survey, user=user, answers=answers)
+    except IntegrityError:
+        raise ValidationError("Вы уже ответили на этот опрос")
+    return answers
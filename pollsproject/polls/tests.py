@@ -1,3 +1,1377 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import re
+import tempfile
+from collections import Counter
+from unittest import skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, connection, transaction
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from .archive import archive_path, archive_survey, restore_survey
+from .authentication import get_token_cache
+from .cache import get_survey_cache
+from .crosstab import _bitset, clear_matrices
+from .models import (Survey, Question, Choice, Answer, ChoiceResult, QuestionResult, RankingPosition, RatingResult,
+                     SubmissionOutbox, SurveyParticipation)
+from .outbox import drain_outbox
+from .live import get_aggregator
+from .metrics import QueryCollector, registry
+from .rankings import load_positions, ranking_stats
+from .stream import RESYNC, Publisher, get_publisher
+from .results import _increment, backfill_participation, rebuild_results
+from .search import check_search_config, clear_search_index, search_config
+from .textstats import HyperLogLog, clear_text_stats, hash64
+from .submissions import ARCHIVED, save_submission
+from .throttling import get_submitted
+
+
+def make_survey(author, questions=3, choices=3):
+    survey = Survey.objects.create(title='Опрос', author=author)
+    for i in range(questions):
+        question = Question.objects.create(survey=survey, text=f'Вопрос {i}', question_type='radio')
+        Choice.objects.bulk_create(Choice(question=question, text=f'Вариант {j}') for j in range(choices))
+    return survey
+
+
+@override_settings(SUBMISSION_THROTTLE={'USER_RATE': None, 'SURVEY_RATE': None})
+class SubmissionValidationTests(TestCase):
+    """Ответы проверяются по типу вопроса до записи; ошибка — 400 со списком ошибок по элементам."""
+
+    def setUp(self):
+        get_submitted().clear()
+        self.survey = Survey.objects.create(title='Типы', author=User.objects.create_user('author'))
+        self.questions = {
+            qtype: Question.objects.create(survey=self.survey, text=qtype, question_type=qtype)
+            for qtype in ('radio', 'checkbox', 'text', 'rating', 'yesno', 'ranking')
+        }
+        for qtype in ('radio', 'checkbox', 'ranking'):
+            Choice.objects.bulk_create(Choice(question=self.questions[qtype], text=f'Вариант {i}') for i in range(2))
+        self.other_choice = Choice.objects.create(
+            question=Question.objects.create(survey=self.survey, text='Другой', question_type='radio'), text='Чужой')
+        self.user = User.objects.create_user('respondent')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def submit(self, payload):
+        return self.client.post(reverse('polls:submit_answers', args=[self.survey.pk]), payload, format='json')
+
+    def item(self, qtype, **values):
+        return {'question': self.questions[qtype].id, **values}
+
+    def test_invalid_values(self):
+        choices = {qtype: list(self.questions[qtype].choices.values_list('id', flat=True))
+                   for qtype in ('radio', 'checkbox', 'ranking')}
+        cases = [
+            self.item('radio', choice=self.other_choice.id),
+            self.item('checkbox', choices=choices['checkbox'][0]),
+            self.item('text', text_answer=5),
+            self.item('rating', rating_answer=Answer.RATING_MAX + 1),
+            self.item('rating', rating_answer=Answer.RATING_MIN - 1),
+            self.item('rating', rating_answer=True),
+            self.item('yesno', yesno_answer='может быть'),
+            self.item('ranking', ranking_answer=[choices['ranking'][0], choices['ranking'][0]]),
+            self.item('ranking', ranking_answer=[self.other_choice.id]),
+        ]
+        for payload in cases:
+            with self.subTest(payload=payload):
+                response = self.submit([payload])
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(len(response.data), 1)
+                self.assertTrue(response.data[0])
+        self.assertFalse(Answer.objects.exists())
+
+    def test_valid_values(self):
+        choices = {qtype: list(self.questions[qtype].choices.values_list('id', flat=True))
+                   for qtype in ('radio', 'checkbox', 'ranking')}
+        response = self.submit([
+            self.item('radio', choice=choices['radio'][0]),
+            self.item('checkbox', choices=choices['checkbox']),
+            self.item('text', text_answer='Хорошо'),
+            self.item('rating', rating_answer=Answer.RATING_MAX),
+            self.item('yesno', yesno_answer='yes'),
+            self.item('ranking', ranking_answer=choices['ranking'][::-1]),
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Answer.objects.count(), 7)
+
+    def test_partial_errors_save_nothing(self):
+        response = self.submit([self.item('text', text_answer='а'), self.item('rating', rating_answer='x')])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertTrue(response.data[1])
+        self.assertFalse(Answer.objects.exists())
+
+    def test_integrity_error_is_bad_request(self):
+        # Ответ есть, а записи об участии нет: повтор ловит уже уникальное ограничение Answer
+        Answer.objects.create(survey=self.survey, question=self.questions['text'], user=self.user, text_answer='а')
+        response = self.submit([self.item('text', text_answer='б')])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, ['Вы уже ответили на этот опрос'])
+        self.assertEqual(Answer.objects.count(), 1)
+
+
+class DetailFormSubmissionTests(TestCase):
+    """HTML-форма опроса сохраняет ответы той же пакетной записью, что и API."""
+
+    def setUp(self):
+        get_submitted().clear()
+        get_survey_cache().clear()
+        self.survey = Survey.objects.create(title='Форма', author=User.objects.create_user('author'))
+        self.radio = Question.objects.create(survey=self.survey, text='Выбор', question_type='radio')
+        self.ranking = Question.objects.create(survey=self.survey, text='Порядок', question_type='ranking')
+        self.rating = Question.objects.create(survey=self.survey, text='Оценка', question_type='rating')
+        Choice.objects.bulk_create(Choice(question=question, text=f'Вариант {i}')
+                                   for question in (self.radio, self.ranking) for i in range(3))
+        self.user = User.objects.create_user('respondent')
+        self.client.force_login(self.user)
+
+    def post(self, **fields):
+        return self.client.post(reverse('polls:detail', args=[self.survey.pk]), fields)
+
+    def ranking_fields(self, places):
+        return {f'ranking_{self.ranking.id}_{choice_id}': str(place)
+                for choice_id, place in zip(self.ranking.choices.order_by('id').values_list('id', flat=True), places)}
+
+    def test_submit(self):
+        choice = self.radio.choices.first()
+        first, second, third = self.ranking.choices.order_by('id').values_list('id', flat=True)
+        response = self.post(**{f'question_{self.radio.id}': str(choice.id), f'question_{self.rating.id}': '4'},
+                             **self.ranking_fields([2, 3, 1]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['show_thanks'])
+        self.assertEqual(Answer.objects.get(question=self.radio).choice, choice)
+        self.assertEqual(Answer.objects.get(question=self.rating).rating_answer, 4)
+        self.assertEqual(Answer.objects.get(question=self.ranking).ranking_answer, [third, first, second])
+        self.assertEqual(self.radio.result.responses, 1)
+        self.assertTrue(SurveyParticipation.objects.filter(user=self.user, survey=self.survey).exists())
+
+    def test_invalid_form(self):
+        for fields in ({f'question_{self.rating.id}': '9'}, self.ranking_fields([1, 1, 2]), {}):
+            with self.subTest(fields=fields):
+                response = self.post(**fields)
+                self.assertTrue(response.context['error_message'])
+                self.assertNotIn('show_thanks', response.context)
+        self.assertFalse(Answer.objects.exists())
+
+    def test_repeat_submission(self):
+        fields = {f'question_{self.rating.id}': '3'}
+        self.post(**fields)
+        # Повторная форма не показывается, но прямой POST отклоняется проверкой участия
+        get_submitted().clear()
+        Answer.objects.all().delete()
+        response = self.post(**fields)
+        self.assertEqual(response.context['error_message'], 'Вы уже ответили на этот опрос')
+        self.assertFalse(Answer.objects.exists())
+
+
+@override_settings(SUBMISSION_THROTTLE={'USER_RATE': None, 'SURVEY_RATE': None})
+class ResultsParityTests(TestCase):
+    """Сводные таблицы, обновляемые отправками, совпадают с пересчётом rebuild_results."""
+
+    def setUp(self):
+        get_submitted().clear()
+        self.survey = Survey.objects.create(title='Итоги', author=User.objects.create_user('author'))
+        self.questions = {
+            qtype: Question.objects.create(survey=self.survey, text=qtype, question_type=qtype)
+            for qtype in ('radio', 'checkbox', 'rating', 'yesno', 'ranking')
+        }
+        for qtype in ('radio', 'checkbox', 'ranking'):
+            Choice.objects.bulk_create(Choice(question=self.questions[qtype], text=f'Вариант {i}') for i in range(3))
+        self.choices = {qtype: list(self.questions[qtype].choices.order_by('id').values_list('id', flat=True))
+                        for qtype in ('radio', 'checkbox', 'ranking')}
+        self.client = APIClient()
+
+    def counters(self):
+        # Нулевые строки rebuild_results создаёт для всех вопросов и вариантов, инкременты — только для затронутых
+        return (
+            {row for row in QuestionResult.objects.values_list('question_id', 'responses', 'rating_sum', 'yes_count', 'no_count')
+             if any(row[1:])},
+            {row for row in ChoiceResult.objects.values_list('choice_id', 'votes', 'borda') if any(row[1:])},
+            set(RatingResult.objects.values_list('question_id', 'value', 'count')),
+        )
+
+    def test_incremental_matches_rebuild(self):
+        for number in range(6):
+            ranking = self.choices['ranking'][number // 2:] + self.choices['ranking'][:number // 2]
+            payload = [
+                {'question': self.questions['radio'].id, 'choice': self.choices['radio'][number % 3]},
+                {'question': self.questions['checkbox'].id, 'choices': self.choices['checkbox'][:number % 3 + 1]},
+                {'question': self.questions['rating'].id, 'rating_answer': number % 5 + 1},
+                {'question': self.questions['yesno'].id, 'yesno_answer': number % 2 == 0},
+                {'question': self.questions['ranking'].id, 'ranking_answer': ranking},
+            ]
+            # Часть пользователей отвечает не на все вопросы
+            self.client.force_authenticate(User.objects.create_user(f'user{number}'))
+            response = self.client.post(reverse('polls:submit_answers', args=[self.survey.pk]),
+                                        payload[:3 + number % 3], format='json')
+            self.assertEqual(response.status_code, 201)
+        incremental = self.counters()
+        self.assertEqual(QuestionResult.objects.get(question=self.questions['checkbox']).responses, 6)
+        rebuild_results(self.survey)
+        self.assertEqual(self.counters(), incremental)
+
+    def test_results_visible_to_author_only(self):
+        url = reverse('polls:survey_results_api', args=[self.survey.pk])
+        self.client.force_authenticate(User.objects.create_user('respondent'))
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_authenticate(self.survey.author)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_increment_existing_rows(self):
+        radio = self.questions['radio']
+        first, second, _ = self.choices['radio']
+        key = (('survey_id', self.survey.pk), ('question_id', radio.id))
+        # Строку уже создала другая транзакция: bulk_create с ignore_conflicts её пропускает
+        ChoiceResult.objects.create(survey=self.survey, question=radio, choice_id=first, votes=5)
+        _increment(ChoiceResult, {
+            key + (('choice_id', first),): Counter(votes=2),
+            key + (('choice_id', second),): Counter(votes=3, borda=1),
+        })
+        _increment(ChoiceResult, {key + (('choice_id', second),): Counter(votes=1)})
+        self.assertEqual(
+            set(ChoiceResult.objects.values_list('choice_id', 'votes', 'borda')),
+            {(first, 7, 0), (second, 4, 1)},
+        )
+
+
+class ExportTests(TestCase):
+    """Выгрузка: одна строка на респондента, анонимные ответы не склеиваются."""
+
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+        self.survey = Survey.objects.create(title='Выгрузка', author=self.author)
+        self.radio = Question.objects.create(survey=self.survey, text='Выбор', question_type='radio')
+        self.checkbox = Question.objects.create(survey=self.survey, text='Отметки', question_type='checkbox')
+        Choice.objects.bulk_create(Choice(question=question, text=f'{question.text} {i}')
+                                   for question in (self.radio, self.checkbox) for i in range(2))
+        first, second = self.radio.choices.order_by('id')
+        self.user = User.objects.create_user('respondent')
+        Answer.objects.create(survey=self.survey, question=self.radio, user=self.user, choice=first)
+        for choice in self.checkbox.choices.all():
+            Answer.objects.create(survey=self.survey, question=self.checkbox, user=self.user, choice=choice)
+        for choice in (first, second):
+            Answer.objects.create(survey=self.survey, question=self.radio, choice=choice)
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def export(self, fmt):
+        response = self.client.get(reverse('polls:survey_export_api', args=[self.survey.pk, fmt]))
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv(self):
+        header, *rows = csv.reader(io.StringIO(self.export('csv')))
+        self.assertEqual(header, ['user_id', 'username', f'{self.radio.id}. Выбор', f'{self.checkbox.id}. Отметки'])
+        self.assertCountEqual(rows, [
+            [str(self.user.id), 'respondent', 'Выбор 0', 'Отметки 0; Отметки 1'],
+            ['', '', 'Выбор 0', ''],
+            ['', '', 'Выбор 1', ''],
+        ])
+
+    def test_jsonl(self):
+        records = [json.loads(line) for line in self.export('jsonl').splitlines()]
+        self.assertCountEqual(records, [
+            {'user_id': self.user.id, 'username': 'respondent',
+             'answers': {str(self.radio.id): 'Выбор 0', str(self.checkbox.id): ['Отметки 0', 'Отметки 1']}},
+            {'user_id': None, 'username': None, 'answers': {str(self.radio.id): 'Выбор 0'}},
+            {'user_id': None, 'username': None, 'answers': {str(self.radio.id): 'Выбор 1'}},
+        ])
+
+    def test_author_only(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse('polls:survey_export_api', args=[self.survey.pk, 'csv']))
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(SUBMISSION_THROTTLE={'USER_RATE': None, 'SURVEY_RATE': None})
+class ParticipationTests(TestCase):
+    """Списки опросов в профиле совпадают с прежним запросом по ответам пользователя."""
+
+    def setUp(self):
+        get_submitted().clear()
+        author = User.objects.create_user('author')
+        self.surveys = [make_survey(author, questions=2, choices=2) for _ in range(3)]
+        self.user = User.objects.create_user('respondent')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def answer_derived(self):
+        return set(Survey.objects.filter(questions__answers__user=self.user).distinct().values_list('id', flat=True))
+
+    def profile_lists(self):
+        api = self.client.get(reverse('polls:profile_api', args=[self.user.username])).data['surveys']
+        self.client.force_login(self.user)
+        html = self.client.get(reverse('polls:profile', args=[self.user.username])).context['surveys']
+        return {survey['id'] for survey in api}, {survey.id for survey in html}
+
+    def test_after_submission(self):
+        for survey in self.surveys[:2]:
+            payload = [{'question': question.id, 'choice': question.choices.first().id}
+                       for question in survey.questions.all()]
+            response = self.client.post(reverse('polls:submit_answers', args=[survey.pk]), payload, format='json')
+            self.assertEqual(response.status_code, 201)
+        expected = self.answer_derived()
+        self.assertEqual(len(expected), 2)
+        self.assertEqual(self.profile_lists(), (expected, expected))
+        self.assertEqual(set(SurveyParticipation.objects.values_list('survey_id', 'answer_count')),
+                         {(survey.pk, 2) for survey in self.surveys[:2]})
+
+    def test_after_backfill(self):
+        # Ответы, сохранённые до появления таблицы участия
+        for survey in self.surveys[1:]:
+            for question in survey.questions.all():
+                Answer.objects.create(survey=survey, question=question, user=self.user, choice=question.choices.first())
+        Answer.objects.create(survey=self.surveys[0], question=self.surveys[0].questions.first(),
+                              choice=self.surveys[0].questions.first().choices.first())
+        self.assertFalse(SurveyParticipation.objects.exists())
+        self.assertEqual(backfill_participation(batch_size=1), 2)
+        expected = self.answer_derived()
+        self.assertEqual(self.profile_lists(), (expected, expected))
+        self.assertEqual(backfill_participation(), 2)
+        self.assertEqual(SurveyParticipation.objects.count(), 2)
+
+
+class QueryMetricsTests(TestCase):
+    """Middleware считает запросы каждого представления, /metrics отдаёт их в формате Prometheus."""
+
+    def setUp(self):
+        registry.reset()
+        get_survey_cache().clear()
+        self.user = User.objects.create_user('reader')
+        make_survey(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @override_settings(QUERY_METRICS={'SERVER_TIMING': True})
+    def test_view_counters(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('polls:survey_list_api'), {'expand': 'questions'})
+        queries = len(ctx.captured_queries)
+        self.assertGreater(queries, 0)
+        self.assertIn(f'desc="{queries} queries"', response['Server-Timing'])
+        counters = registry.snapshot()[0]['survey_list_api']
+        self.assertEqual(counters['requests_total'], 1)
+        self.assertEqual(counters['db_queries_total'], queries)
+
+        body = self.client.get(reverse('polls:metrics')).content.decode()
+        self.assertIn('# TYPE polls_requests_total counter', body)
+        self.assertIn('polls_requests_total{view="survey_list_api"} 1\n', body)
+        self.assertIn(f'polls_db_queries_total{{view="survey_list_api"}} {queries}\n', body)
+        self.assertIn('polls_survey_cache_hits_total 0\n', body)
+
+    async def test_async_handler(self):
+        # Под ASGI синхронные представления выполняются в потоке sync_to_async, запросы всё равно учитываются
+        token = await Token.objects.acreate(user=self.user)
+        headers = {'Authorization': f'Token {token.key}'}
+        response = await self.async_client.get(reverse('polls:survey_list_api'), headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(registry.snapshot()[0]['survey_list_api']['db_queries_total'], 0)
+
+        survey = await Survey.objects.afirst()
+        question = await survey.questions.afirst()
+        choice = await question.choices.afirst()
+        response = await self.async_client.post(
+            reverse('polls:submit_answers_async', args=[survey.pk]), [{'question': question.id, 'choice': choice.id}],
+            content_type='application/json', headers={**headers, 'Idempotency-Key': 'key'},
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertGreater(registry.snapshot()[0]['submit_answers_async']['db_queries_total'], 0)
+        self.assertEqual(await sync_to_async(lambda: connection.execute_wrappers)(), [])
+
+    def test_duplicate_queries(self):
+        collector = QueryCollector()
+        for value in (1, 2, 3):
+            collector(lambda *args: None, f'SELECT * FROM polls_choice WHERE question_id = {value}', (), False, {})
+        collector(lambda *args: None, 'SELECT * FROM polls_choice WHERE id IN (%s, %s)', (1, 2), False, {})
+        self.assertEqual(collector.count, 4)
+        with self.assertLogs('polls.metrics', 'WARNING'):
+            registry.record('detail', 0.01, collector, threshold=3)
+        counters = registry.snapshot()[0]['detail']
+        self.assertEqual(counters['duplicate_queries_total'], 2)
+        self.assertEqual(counters['n_plus_one_requests_total'], 1)
+
+
+class SurveyQueryCountTests(TestCase):
+    """Число запросов при чтении опросов не зависит от объёма данных."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        get_survey_cache().clear()
+
+    def populate(self, surveys, questions, choices):
+        Survey.objects.all().delete()
+        for i in range(surveys):
+            author, _ = User.objects.get_or_create(username=f'author-{i}')
+            make_survey(author, questions, choices)
+
+    def test_survey_list(self):
+        for surveys, questions, choices in [(1, 1, 1), (20, 5, 4)]:
+            self.populate(surveys, questions, choices)
+            with self.assertNumQueries(1):
+                response = self.client.get(reverse('polls:survey_list_api'))
+            self.assertEqual(len(response.data['surveys']), surveys)
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse('polls:survey_list_api'), {'expand': 'questions'})
+            self.assertEqual(len(response.data['surveys'][0]['questions']), questions)
+
+    def test_survey_list_pages(self):
+        self.populate(7, 1, 1)
+        seen, url = [], reverse('polls:survey_list_api')
+        params = {'page_size': 3, 'fields': 'id,title'}
+        while url:
+            response = self.client.get(url, params)
+            self.assertTrue(all(set(item) == {'id', 'title'} for item in response.data['surveys']))
+            seen.extend(item['id'] for item in response.data['surveys'])
+            url, params = response.data['next'], None
+        self.assertEqual(seen, list(Survey.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_survey_detail(self):
+        for questions, choices in [(1, 1), (30, 6)]:
+            self.populate(1, questions, choices)
+            survey = Survey.objects.get()
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse('polls:survey_detail_api', args=[survey.pk]))
+            self.assertEqual(len(response.data['questions']), questions)
+            # Повторное чтение отдаётся из кэша определения
+            with self.assertNumQueries(1):
+                response = self.client.get(reverse('polls:survey_detail_api', args=[survey.pk]))
+            self.assertEqual(len(response.data['questions']), questions)
+
+    def test_survey_detail_cache_invalidation(self):
+        self.populate(1, 1, 1)
+        survey = Survey.objects.get()
+        url = reverse('polls:survey_detail_api', args=[survey.pk])
+        self.client.get(url)
+        question = survey.questions.get()
+        Choice.objects.create(question=question, text='Новый вариант')
+        choices = self.client.get(url).data['questions'][0]['choices_display']
+        self.assertIn('Новый вариант', [choice['text'] for choice in choices])
+        survey.title = 'Новое название'
+        survey.save()
+        self.assertEqual(self.client.get(url).data['title'], 'Новое название')
+        self.assertEqual(get_survey_cache().stats(), {'hits': 0, 'misses': 3})
+
+    def test_profile(self):
+        for surveys in [1, 10]:
+            self.populate(surveys, 3, 3)
+            for survey in Survey.objects.all():
+                SurveyParticipation.objects.create(survey=survey, user=self.user, answer_count=1)
+            with self.assertNumQueries(4):
+                response = self.client.get(reverse('polls:profile_api', args=[self.user.username]))
+            self.assertEqual(len(response.data['surveys']), surveys)
+
+
+class AnswerIndexTests(TestCase):
+    """Горячие запросы к ответам используют составные индексы (проверка через EXPLAIN)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('respondent')
+        cls.survey = make_survey(cls.user, questions=2, choices=2)
+        for question in cls.survey.questions.all():
+            Answer.objects.create(survey=cls.survey, question=question, user=cls.user,
+                                  choice=question.choices.first())
+
+    def explain(self, queryset):
+        if connection.vendor == 'postgresql':
+            # На маленькой таблице планировщик иначе предпочтёт последовательное чтение
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def assertUsesIndex(self, plan, name, columns):
+        # В секционированной таблице Postgres в плане видны индексы секций: polls_answer_pN_<колонки>_idx
+        self.assertTrue(name in plan or f'{columns}_idx' in plan, plan)
+
+    def test_detail_uses_survey_user_index(self):
+        plan = self.explain(Answer.objects.for_survey(self.survey).filter(user=self.user))
+        self.assertUsesIndex(plan, 'answer_survey_user_idx', 'survey_id_user_id')
+
+    def test_profile_uses_user_survey_index(self):
+        plan = self.explain(Answer.objects.filter(user=self.user).values('survey'))
+        self.assertUsesIndex(plan, 'answer_user_survey_idx', 'user_id_survey_id')
+
+    @skipUnless(connection.vendor == 'postgresql', 'секционирование есть только в PostgreSQL')
+    def test_survey_queries_read_one_partition(self):
+        plan = self.explain(Answer.objects.for_survey(self.survey))
+        self.assertEqual(len(set(re.findall(r'polls_answer_p\d+', plan))), 1, plan)
+
+    def test_single_answer_is_unique(self):
+        question = Question.objects.create(survey=self.survey, text='Текст', question_type='text')
+        Answer.objects.create(survey=self.survey, question=question, user=self.user, text_answer='а')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Answer.objects.create(survey=self.survey, question=question, user=self.user, text_answer='б')
+
+
+class DetailQueryCountTests(TestCase):
+    """Страница опроса с ответами пользователя: число запросов не зависит от ранжирований."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('respondent')
+        self.client.force_login(self.user)
+        get_survey_cache().clear()
+
+    def answered_survey(self, questions, choices):
+        survey = Survey.objects.create(title='Ранжирование', author=self.user)
+        for i in range(questions):
+            question = Question.objects.create(survey=survey, text=f'Вопрос {i}', question_type='ranking')
+            Choice.objects.bulk_create(Choice(question=question, text=f'Вариант {j}') for j in range(choices))
+            ranking = list(question.choices.values_list('id', flat=True))
+            Answer.objects.create(survey=survey, question=question, user=self.user, ranking_answer=ranking)
+        return survey
+
+    def count_queries(self, survey):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('polls:detail', args=[survey.pk]))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_constant_query_count(self):
+        small, _ = self.count_queries(self.answered_survey(1, 2))
+        large, response = self.count_queries(self.answered_survey(5, 10))
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.context['user_answers']), 5)
+        self.assertEqual(len(response.context['user_answers'][0]['ranked_choices']), 10)
+
+    def test_deleted_ranked_choice(self):
+        survey = self.answered_survey(1, 3)
+        question = survey.questions.get()
+        answer = Answer.objects.get(question=question)
+        answer.ranking_answer = answer.ranking_answer + [10 ** 9, 'x']
+        answer.save()
+        question.choices.first().delete()
+        _, response = self.count_queries(survey)
+        self.assertEqual(len(response.context['user_answers'][0]['ranked_choices']), 2)
+
+
+class SubmissionOutboxTests(TestCase):
+    """Асинхронная отправка: повтор с тем же ключом не создаёт дублей, очередь разбирается пакетом."""
+
+    def setUp(self):
+        self.survey = make_survey(User.objects.create_user('author'))
+        self.question = self.survey.questions.first()
+        self.payload = [{'question': self.question.id, 'choice': self.question.choices.first().id}]
+        get_survey_cache().clear()
+
+    def submit(self, user, key):
+        token = Token.objects.get_or_create(user=user)[0]
+        return self.client.post(
+            reverse('polls:submit_answers_async', args=[self.survey.pk]), self.payload,
+            content_type='application/json', HTTP_AUTHORIZATION=f'Token {token.key}', HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_idempotent_submission(self):
+        user = User.objects.create_user('respondent')
+        first = self.submit(user, 'key-1')
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(self.submit(user, 'key-1').json()['id'], first.json()['id'])
+        self.submit(user, 'key-2')
+        self.assertEqual(drain_outbox(), 2)
+        self.assertEqual(Answer.objects.filter(user=user).count(), 1)
+        statuses = dict(SubmissionOutbox.objects.values_list('idempotency_key', 'status'))
+        self.assertEqual(statuses, {'key-1': 'done', 'key-2': 'failed'})
+        self.assertEqual(self.question.result.responses, 1)
+
+    def test_batch_query_count(self):
+        def drain(count):
+            for i in range(count):
+                self.submit(User.objects.create_user(f'user-{count}-{i}'), 'key')
+            with CaptureQueriesContext(connection) as ctx:
+                drain_outbox()
+            return len(ctx.captured_queries)
+
+        self.assertEqual(drain(2), drain(10))
+
+
+class SurveyImportTests(TestCase):
+    """Импорт опроса: число запросов не зависит от размера дерева, ошибка не оставляет частей опроса."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('author'))
+
+    def tree(self, questions):
+        return {'title': 'Импорт', 'questions': [
+            {'text': f'Вопрос {i}', 'question_type': 'radio', 'choices': ['да', 'нет']} for i in range(questions)
+        ]}
+
+    def import_survey(self, data):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('polls:survey_import_api'), data, format='json')
+        return response, len(ctx.captured_queries)
+
+    def test_constant_query_count(self):
+        small, small_queries = self.import_survey(self.tree(2))
+        large, large_queries = self.import_survey(self.tree(200))
+        self.assertEqual(large.status_code, 201)
+        self.assertEqual(small_queries, large_queries)
+        self.assertEqual(large.data['questions'], sorted(large.data['questions']))
+        self.assertEqual(Choice.objects.filter(question__survey=large.data['id']).count(), 400)
+
+    def test_invalid_tree_is_not_saved(self):
+        data = self.tree(3)
+        data['questions'][2]['choices'] = []
+        response, _ = self.import_survey(data)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[:2], [{}, {}])
+        self.assertFalse(Survey.objects.exists())
+
+
+class SurveyUpdateTests(TestCase):
+    """Обновление опроса через API меняет только изменённые вопросы и сохраняет ответы."""
+
+    def test_answers_survive_update(self):
+        author = User.objects.create_user('author')
+        survey = make_survey(author, questions=2, choices=2)
+        first, second = survey.questions.order_by('id')
+        kept = first.choices.first()
+        Answer.objects.create(survey=survey, question=first, user=author, choice=kept)
+        Answer.objects.create(survey=survey, question=second, user=author, choice=second.choices.first())
+        client = APIClient()
+        client.force_authenticate(author)
+        response = client.put(reverse('polls:survey_detail_api', args=[survey.pk]), {
+            'title': survey.title,
+            'questions': [
+                {'text': first.text, 'question_type': first.question_type, 'choices': [kept.text, 'Новый']},
+                {'text': 'Новый вопрос', 'question_type': 'text'},
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['changes']['questions'], {'created': 1, 'updated': 0, 'deleted': 1, 'unchanged': 1})
+        self.assertEqual(response.data['changes']['choices'], {'created': 1, 'updated': 0, 'deleted': 3, 'unchanged': 1})
+        self.assertEqual(list(Answer.objects.values_list('question_id', 'choice_id')), [(first.id, kept.id)])
+
+    def test_html_editor_keeps_answers(self):
+        """Редактор на шаблоне передаёт id вопросов и вариантов: переименование через polls:edit сохраняет ответы."""
+        author = User.objects.create_user('author')
+        survey = make_survey(author, questions=1, choices=2)
+        question = survey.questions.get()
+        renamed, kept = question.choices.order_by('id')
+        answer = Answer.objects.create(survey=survey, question=question, user=author, choice=renamed)
+        self.client.force_login(author)
+        url = reverse('polls:edit', args=[survey.pk])
+        page = self.client.get(url)
+        self.assertContains(page, f'name="choices-questions-0-0-id" value="{renamed.id}"')
+        response = self.client.post(url, {
+            'title': survey.title,
+            'questions-TOTAL_FORMS': '1', 'questions-INITIAL_FORMS': '1',
+            'questions-0-id': str(question.id), 'questions-0-text': 'Новый текст', 'questions-0-question_type': 'radio',
+            'choices-questions-0-TOTAL_FORMS': '2', 'choices-questions-0-INITIAL_FORMS': '2',
+            'choices-questions-0-0-id': str(renamed.id), 'choices-questions-0-0-text': 'Переименованный',
+            'choices-questions-0-1-id': str(kept.id), 'choices-questions-0-1-text': kept.text,
+        })
+        self.assertRedirects(response, reverse('polls:index'), fetch_redirect_response=False)
+        question.refresh_from_db()
+        renamed.refresh_from_db()
+        self.assertEqual((question.text, renamed.text), ('Новый текст', 'Переименованный'))
+        self.assertEqual(list(Answer.objects.values_list('id', 'choice_id')), [(answer.id, renamed.id)])
+
+    def test_renamed_choice_keeps_answers(self):
+        """Редактор отправляет варианты с id из choices_display: переименование не удаляет ответы."""
+        author = User.objects.create_user('author')
+        survey = make_survey(author, questions=1, choices=2)
+        question = survey.questions.get()
+        renamed = question.choices.order_by('id').first()
+        Answer.objects.create(survey=survey, question=question, user=author, choice=renamed)
+        client = APIClient()
+        client.force_authenticate(author)
+        url = reverse('polls:survey_detail_api', args=[survey.pk])
+        loaded = client.get(url).data['questions'][0]
+        choices = [dict(choice) for choice in loaded['choices_display']]
+        choices[0]['text'] = 'Переименованный'
+        response = client.put(url, {
+            'title': survey.title,
+            'questions': [{'id': loaded['id'], 'text': loaded['text'], 'question_type': loaded['question_type'], 'choices': choices}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['changes']['choices'], {'created': 0, 'updated': 1, 'deleted': 0, 'unchanged': 1})
+        renamed.refresh_from_db()
+        self.assertEqual(renamed.text, 'Переименованный')
+        self.assertEqual(list(Answer.objects.values_list('choice_id', flat=True)), [renamed.id])
+
+
+class CrosstabTests(TestCase):
+    """Срез результатов по ответам на другой вопрос, включая ответы, пришедшие после построения матрицы."""
+
+    def setUp(self):
+        clear_matrices()
+        get_survey_cache().clear()
+        self.author = User.objects.create_user('author')
+        self.survey = make_survey(self.author, questions=2, choices=2)
+        self.first, self.second = self.survey.questions.order_by('id')
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def answer(self, name, first, second):
+        user = User.objects.create_user(name)
+        Answer.objects.create(survey=self.survey, question=self.first, user=user, choice=self.first.choices.all()[first])
+        Answer.objects.create(survey=self.survey, question=self.second, user=user, choice=self.second.choices.all()[second])
+
+    def votes(self, choice):
+        response = self.client.get(reverse('polls:survey_crosstab_api', args=[self.survey.pk]), {
+            'target': self.second.id, 'filter': f'{self.first.id}:{self.first.choices.all()[choice].id}',
+        })
+        self.assertEqual(response.status_code, 200)
+        return [entry['votes'] for entry in response.data['choices']]
+
+    def test_filtered_counts(self):
+        self.answer('a', 0, 0)
+        self.answer('b', 0, 1)
+        self.answer('c', 1, 1)
+        self.assertEqual(self.votes(0), [1, 1])
+        self.assertEqual(self.votes(1), [0, 1])
+        self.answer('d', 1, 0)
+        self.assertEqual(self.votes(1), [1, 1])
+
+    def test_late_commit(self):
+        """Ответ с id меньше watermark (транзакция зафиксирована позже) всё равно попадает в матрицу."""
+        self.answer('late', 1, 0)
+        late = list(Answer.objects.filter(user__username='late'))
+        Answer.objects.filter(user__username='late').delete()
+        self.answer('a', 1, 1)
+        self.assertEqual(self.votes(1), [0, 1])
+        Answer.objects.bulk_create(late)
+        self.assertEqual(self.votes(1), [1, 1])
+
+    def test_archive_read_once(self):
+        self.answer('a', 0, 0)
+        Survey.objects.filter(pk=self.survey.pk).update(is_active=False)
+        self.survey.refresh_from_db()
+        with tempfile.TemporaryDirectory() as directory, override_settings(POLLS_ARCHIVE_ROOT=directory):
+            archive_survey(self.survey)
+            self.assertEqual(self.votes(0), [1, 0])
+            # Повторный запрос не открывает архив
+            archive_path(self.survey.pk).unlink()
+            self.assertEqual(self.votes(0), [1, 0])
+
+    def test_bitset(self):
+        indexes = [70, 3, 1000, 3, 64]
+        self.assertEqual(_bitset(indexes), sum(1 << index for index in set(indexes)))
+
+    def test_author_only(self):
+        self.client.force_authenticate(User.objects.create_user('respondent'))
+        response = self.client.get(reverse('polls:survey_crosstab_api', args=[self.survey.pk]), {'target': self.second.id})
+        self.assertEqual(response.status_code, 403)
+
+
+class TokenCacheTests(TestCase):
+    """Повторный запрос с тем же токеном не обращается к authtoken_token."""
+
+    def setUp(self):
+        get_token_cache().clear()
+        self.user = User.objects.create_user('reader')
+        self.token = Token.objects.create(user=self.user)
+
+    def get(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('polls:survey_list_api'), HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        return response.status_code, len(ctx.captured_queries)
+
+    def test_cached_lookup(self):
+        status, cold = self.get()
+        self.assertEqual(status, 200)
+        self.assertEqual(self.get(), (200, cold - 1))
+
+    def test_deactivated_user(self):
+        self.get()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get()[0], 401)
+
+    def test_deleted_token(self):
+        self.get()
+        self.token.delete()
+        self.assertEqual(self.get()[0], 401)
+
+
+class ConditionalGetTests(TestCase):
+    """Совпавший If-None-Match даёт 304 без загрузки вопросов; правка вопроса меняет ETag."""
+
+    def setUp(self):
+        get_survey_cache().clear()
+        self.author = User.objects.create_user('author')
+        self.survey = make_survey(self.author)
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def assertRevalidates(self, url):
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        choice = Choice.objects.filter(question__survey=self.survey).first()
+        choice.text = 'Изменённый вариант'
+        choice.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_detail(self):
+        self.assertRevalidates(reverse('polls:survey_detail_api', args=[self.survey.pk]))
+
+    def test_list(self):
+        self.assertRevalidates(reverse('polls:survey_list_api') + '?expand=questions')
+
+    def test_detail_page_csrf(self):
+        # После повторного входа CSRF-секрет другой: страница с формой отдаётся заново
+        url = reverse('polls:detail', args=[self.survey.pk])
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.author)
+        client.get(url)
+        etag = client.get(url)['ETag']
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        client.cookies[settings.CSRF_COOKIE_NAME] = get_random_string(32)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        token = re.search(r'csrfmiddlewaretoken" value="(\w+)', response.content.decode()).group(1)
+        question = self.survey.questions.first()
+        response = client.post(url, {f'question_{question.id}': str(question.choices.first().id),
+                                     'csrfmiddlewaretoken': token})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Answer.objects.filter(user=self.author).exists())
+
+
+class SubmissionGuardTests(TestCase):
+    """Повторная отправка отклоняется без запросов к БД, частые запросы — ограничиваются."""
+
+    def setUp(self):
+        get_submitted().clear()
+        self.user = User.objects.create_user('respondent')
+        self.survey = make_survey(User.objects.create_user('author'))
+        question = self.survey.questions.first()
+        self.payload = [{'question': question.id, 'choice': question.choices.first().id}]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def submit(self):
+        return self.client.post(reverse('polls:submit_answers', args=[self.survey.pk]), self.payload, format='json')
+
+    @override_settings(SUBMISSION_THROTTLE={'USER_RATE': None, 'SURVEY_RATE': None})
+    def test_duplicate_submission(self):
+        self.assertEqual(self.submit().status_code, 201)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.submit().status_code, 409)
+        self.assertEqual(Answer.objects.count(), 1)
+
+    @override_settings(SUBMISSION_THROTTLE={'USER_RATE': '2/min', 'SURVEY_RATE': None})
+    def test_user_rate(self):
+        self.submit()
+        self.submit()
+        with self.assertNumQueries(0):
+            response = self.submit()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def submit_async(self, key):
+        token = Token.objects.get_or_create(user=self.user)[0]
+        return self.client.post(
+            reverse('polls:submit_answers_async', args=[self.survey.pk]), self.payload,
+            format='json', HTTP_AUTHORIZATION=f'Token {token.key}', HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    @override_settings(SUBMISSION_THROTTLE={'USER_RATE': None, 'SURVEY_RATE': None})
+    def test_async_duplicate(self):
+        self.assertEqual(self.submit().status_code, 201)
+        response = self.submit_async('key')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(SubmissionOutbox.objects.exists())
+
+    @override_settings(SUBMISSION_THROTTLE={'USER_RATE': '1/min', 'SURVEY_RATE': None})
+    def test_async_rate(self):
+        self.assertEqual(self.submit_async('key-1').status_code, 202)
+        response = self.submit_async('key-2')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(SubmissionOutbox.objects.count(), 1)
+
+    def test_concurrent_submission(self):
+        # Вторая отправка прошла check_not_submitted до того, как первая сохранилась,
+        # и отвечает на другой вопрос: её отклоняет unique_participation
+        save_submission(self.survey, self.user, self.payload)
+        other = self.survey.questions.last()
+        with self.assertRaises(ValidationError):
+            save_submission(self.survey, self.user, [{'question': other.id, 'choice': other.choices.first().id}])
+        self.assertEqual(Answer.objects.count(), 1)
+
+
+class AnswerArchiveTests(TestCase):
+    """Архив закрытого опроса: результаты, выгрузка и страница опроса не меняются, восстановление обратимо."""
+
+    def setUp(self):
+        clear_matrices()
+        get_survey_cache().clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(POLLS_ARCHIVE_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.author = User.objects.create_user('author')
+        self.survey = make_survey(self.author, questions=1, choices=2)
+        radio = self.survey.questions.get()
+        text = Question.objects.create(survey=self.survey, text='Комментарий', question_type='text')
+        ranking = Question.objects.create(survey=self.survey, text='Порядок', question_type='ranking')
+        self.user = User.objects.create_user('respondent')
+        first, second = radio.choices.all()
+        for user, choice in ((self.user, first), (User.objects.create_user('other'), second), (None, first)):
+            Answer.objects.create(survey=self.survey, question=radio, user=user, choice=choice)
+        Answer.objects.create(survey=self.survey, question=text, user=self.user, text_answer='Всё ясно ✓')
+        order = Choice.objects.bulk_create(Choice(question=ranking, text=f'Место {i}') for i in range(2))
+        Answer.objects.create(survey=self.survey, question=ranking, user=self.user,
+                              ranking_answer=[order[1].id, order[0].id])
+        Survey.objects.filter(pk=self.survey.pk).update(is_active=False)
+        self.survey.refresh_from_db()
+        rebuild_results(self.survey)
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def snapshot(self):
+        results = self.client.get(reverse('polls:survey_results_api', args=[self.survey.pk])).data
+        export = b''.join(self.client.get(reverse('polls:survey_export_api', args=[self.survey.pk, 'jsonl'])).streaming_content)
+        self.client.force_login(self.user)
+        detail = self.client.get(reverse('polls:detail', args=[self.survey.pk])).content.decode()
+        return results, export, re.sub(r'csrfmiddlewaretoken" value="\w+', '', detail)
+
+    def test_round_trip(self):
+        rows = list(Answer.objects.order_by('id').values_list())
+        before = self.snapshot()
+        self.assertIn('Всё ясно ✓', before[2])
+
+        archive_survey(self.survey)
+        self.assertFalse(Answer.objects.exists())
+        self.assertTrue(archive_path(self.survey.pk).exists())
+        self.assertEqual(self.snapshot(), before)
+        rebuild_results(self.survey)
+        self.assertEqual(self.snapshot(), before)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(restore_survey(self.survey), len(rows))
+        self.assertEqual(list(Answer.objects.order_by('id').values_list()), rows)
+        self.assertFalse(archive_path(self.survey.pk).exists())
+        self.assertEqual(self.snapshot(), before)
+
+
+    def test_restore_without_deleted_user(self):
+        """Ответы пользователя, удалённого пока опрос в архиве, не восстанавливаются, остальные — да."""
+        other = User.objects.get(username='other')
+        kept = list(Answer.objects.exclude(user=other).order_by('id').values_list())
+        archive_survey(self.survey)
+        other.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(restore_survey(self.survey), len(kept))
+        self.assertEqual(list(Answer.objects.order_by('id').values_list()), kept)
+
+@override_settings(SUBMISSION_THROTTLE={'USER_RATE': None, 'SURVEY_RATE': None})
+class ArchivedSubmissionTests(TestCase):
+    """Опрос в архиве не принимает ответов ни одним путём, даже если его снова сделали активным."""
+
+    def setUp(self):
+        get_submitted().clear()
+        get_survey_cache().clear()
+        self.author = User.objects.create_user('author')
+        self.survey = make_survey(self.author, questions=1, choices=2)
+        self.question = self.survey.questions.get()
+        self.choice = self.question.choices.first()
+        self.payload = [{'question': self.question.id, 'choice': self.choice.id}]
+        self.user = User.objects.create_user('respondent')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(POLLS_ARCHIVE_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        Survey.objects.filter(pk=self.survey.pk).update(is_active=False)
+        self.survey.refresh_from_db()
+        archive_survey(self.survey)
+        # Опрос снова включён в обход API, например в админке
+        Survey.objects.filter(pk=self.survey.pk).update(is_active=True)
+        self.survey.refresh_from_db()
+
+    def test_update_cannot_activate(self):
+        Survey.objects.filter(pk=self.survey.pk).update(is_active=False)
+        client = APIClient()
+        client.force_authenticate(self.author)
+        response = client.put(reverse('polls:survey_detail_api', args=[self.survey.pk]), {
+            'title': self.survey.title, 'is_active': True,
+            'questions': [{'id': self.question.id, 'text': self.question.text, 'question_type': 'radio',
+                           'choices': [{'id': choice.id, 'text': choice.text} for choice in self.question.choices.all()]}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('is_active', response.data)
+        self.survey.refresh_from_db()
+        self.assertFalse(self.survey.is_active)
+
+    def test_api(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(reverse('polls:submit_answers', args=[self.survey.pk]), self.payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Answer.objects.exists())
+
+    def test_detail_form(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('polls:detail', args=[self.survey.pk]),
+                                    {f'question_{self.question.id}': str(self.choice.id)})
+        self.assertEqual(response.context['error_message'], ARCHIVED)
+        self.assertFalse(Answer.objects.exists())
+
+    def test_async(self):
+        token = Token.objects.create(user=self.user)
+        response = self.client.post(
+            reverse('polls:submit_answers_async', args=[self.survey.pk]), self.payload,
+            content_type='application/json', HTTP_AUTHORIZATION=f'Token {token.key}', HTTP_IDEMPOTENCY_KEY='key',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(SubmissionOutbox.objects.exists())
+
+    def test_queued_before_archiving(self):
+        SubmissionOutbox.objects.create(idempotency_key='key', survey=self.survey, user=self.user, payload=self.payload)
+        self.assertEqual(drain_outbox(), 1)
+        self.assertEqual(SubmissionOutbox.objects.values_list('status', 'error').get(), ('failed', [ARCHIVED]))
+        self.assertFalse(Answer.objects.exists())
+
+
+class SearchTests(TestCase):
+    """Поиск по названиям, вопросам и текстовым ответам: ранжирование, права и постраничный вывод."""
+
+    def setUp(self):
+        clear_search_index()
+        self.author = User.objects.create_user('author')
+        self.survey = Survey.objects.create(title='Погода и климат', author=self.author)
+        question = Question.objects.create(survey=self.survey, text='Какая погода вам нравится?', question_type='text')
+        other = Survey.objects.create(title='Кино', author=User.objects.create_user('other'))
+        other_question = Question.objects.create(survey=other, text='Любимый фильм', question_type='text')
+        Answer.objects.create(survey=self.survey, question=question, text_answer='Тёплая погода, погода без ветра')
+        Answer.objects.create(survey=other, question=other_question, text_answer='Фильм про погоду и погода')
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def search(self, **params):
+        response = self.client.get(reverse('polls:search_api'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_ranked_results(self):
+        results = self.search(q='погода')['results']
+        self.assertEqual({(result['type'], result['survey']) for result in results},
+                         {('survey', self.survey.pk), ('question', self.survey.pk), ('answer', self.survey.pk)})
+        self.assertEqual([result['rank'] for result in results], sorted((result['rank'] for result in results), reverse=True))
+        self.assertEqual(self.search(q='погода ветра', type='answer')['results'][0]['text'], 'Тёплая погода, погода без ветра')
+
+    def test_new_rows_and_pages(self):
+        self.search(q='погода')
+        Survey.objects.create(title='Погода завтра', author=self.author)
+        first = self.search(q='погода', page_size=2)
+        self.assertEqual(len(first['results']), 2)
+        second = self.client.get(first['next']).data
+        self.assertEqual(len(second['results']), 2)
+        self.assertIsNone(second['next'])
+        self.assertEqual(self.client.get(reverse('polls:search_api')).status_code, 400)
+
+    def test_late_commit(self):
+        """Ответ с id меньше watermark (транзакция зафиксирована позже) индексируется, уже найденные — один раз."""
+        question = self.survey.questions.get()
+        late = Answer.objects.create(survey=self.survey, question=question, text_answer='Гроза к вечеру')
+        Answer.objects.filter(pk=late.pk).delete()
+        Answer.objects.create(survey=self.survey, question=question, text_answer='Гроза утром')
+        self.assertEqual(len(self.search(q='гроза', type='answer')['results']), 1)
+        Answer.objects.bulk_create([late])
+        results = self.search(q='гроза', type='answer')['results']
+        self.assertEqual(sorted(result['text'] for result in results), ['Гроза к вечеру', 'Гроза утром'])
+
+    @skipUnless(connection.vendor == 'postgresql', 'search_vector есть только в PostgreSQL')
+    def test_config_check(self):
+        self.assertEqual(check_search_config(None, databases=['default']), [])
+        with override_settings(POLLS_SEARCH_CONFIG='english' if search_config() != 'english' else 'simple'):
+            self.assertEqual([error.id for error in check_search_config(None, databases=['default'])], ['polls.E001'])
+
+
+class TextStatsTests(TestCase):
+    """Частые термины и n-граммы текстового вопроса, дополняемые новыми ответами."""
+
+    def setUp(self):
+        clear_text_stats()
+        self.author = User.objects.create_user('author')
+        self.survey = Survey.objects.create(title='Отзывы', author=self.author)
+        self.question = Question.objects.create(survey=self.survey, text='Что улучшить?', question_type='text')
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def answer(self, text):
+        Answer.objects.create(survey=self.survey, question=self.question, text_answer=text,
+                              user=User.objects.create_user(f'user{Answer.objects.count()}'))
+
+    def stats(self):
+        response = self.client.get(reverse('polls:question_text_stats_api', args=[self.survey.pk, self.question.pk]))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_top_terms(self):
+        for text in ('Быстрая доставка', 'быстрая доставка и поддержка', 'Медленная доставка'):
+            self.answer(text)
+        data = self.stats()
+        self.assertEqual(data['responses'], 3)
+        self.assertEqual(data['distinct_responses'], 3)
+        self.assertEqual(data['terms'][:2], [{'text': 'доставка', 'count': 3}, {'text': 'быстрая', 'count': 2}])
+        self.assertEqual(data['bigrams'][0], {'text': 'быстрая доставка', 'count': 2})
+
+        self.answer('поддержка поддержка поддержка поддержка')
+        with self.assertNumQueries(4):
+            data = self.stats()
+        self.assertEqual(data['terms'][0], {'text': 'поддержка', 'count': 5})
+
+    def test_late_commit(self):
+        """Ответ с id меньше watermark (транзакция зафиксирована позже) учитывается, и только один раз."""
+        late = Answer.objects.create(survey=self.survey, question=self.question, text_answer='Поздний ответ')
+        Answer.objects.filter(pk=late.pk).delete()
+        self.answer('Ранний ответ')
+        self.assertEqual(self.stats()['responses'], 1)
+        Answer.objects.bulk_create([late])
+        self.assertEqual(self.stats()['responses'], 2)
+        self.assertEqual(self.stats()['responses'], 2)
+
+    def test_archive_read_once(self):
+        self.answer('Быстрая доставка')
+        Survey.objects.filter(pk=self.survey.pk).update(is_active=False)
+        self.survey.refresh_from_db()
+        with tempfile.TemporaryDirectory() as directory, override_settings(POLLS_ARCHIVE_ROOT=directory):
+            archive_survey(self.survey)
+            self.assertEqual(self.stats()['responses'], 1)
+            # Повторный запрос не открывает архив
+            archive_path(self.survey.pk).unlink()
+            self.assertEqual(self.stats()['responses'], 1)
+
+    def test_distinct_estimate(self):
+        sketch = HyperLogLog()
+        for number in range(20000):
+            sketch.add(hash64(str(number)))
+        self.assertAlmostEqual(sketch.count(), 20000, delta=1000)
+
+
+@override_settings(SUBMISSION_THROTTLE={'USER_RATE': None, 'SURVEY_RATE': None}, LIVE_COUNTERS={'SYNC_INTERVAL': 60})
+class LiveResultsTests(TestCase):
+    """Живые итоги совпадают со сводными таблицами и обновляются отправками без чтения таблиц."""
+
+    def setUp(self):
+        get_submitted().clear()
+        get_survey_cache().clear()
+        self.author = User.objects.create_user('author')
+        self.survey = make_survey(self.author, questions=2, choices=2)
+        self.question = self.survey.questions.first()
+        self.client = APIClient()
+
+    def submit(self, name, choice):
+        self.client.force_authenticate(User.objects.create_user(name))
+        payload = [{'question': self.question.id, 'choice': self.question.choices.all()[choice].id}]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('polls:submit_answers', args=[self.survey.pk]), payload, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def live(self):
+        self.client.force_authenticate(self.author)
+        response = self.client.get(reverse('polls:survey_live_api', args=[self.survey.pk]))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_counts_follow_submissions(self):
+        self.submit('a', 0)
+        self.client.force_authenticate(self.author)
+        self.assertEqual(self.live()['questions'], self.client.get(
+            reverse('polls:survey_results_api', args=[self.survey.pk])).data['questions'])
+        self.submit('b', 1)
+        self.submit('c', 1)
+        with CaptureQueriesContext(connection) as queries:
+            data = self.live()
+        self.assertEqual([choice['votes'] for choice in data['questions'][0]['choices']], [1, 2])
+        self.assertFalse([query for query in queries if 'result' in query['sql'] or 'polls_answer' in query['sql']])
+
+        get_aggregator().forget(self.survey.pk)
+        self.assertEqual([choice['votes'] for choice in self.live()['questions'][0]['choices']], [1, 2])
+
+    def test_author_only(self):
+        self.client.force_authenticate(User.objects.create_user('respondent'))
+        self.assertEqual(self.client.get(reverse('polls:survey_live_api', args=[self.survey.pk])).status_code, 403)
+
+
+class LiveStreamTests(TestCase):
+    """Дельты за такт склеиваются в одно сообщение на всех подписчиков, отставшие получают снимок."""
+
+    def delta(self, choice_id):
+        lookup = (('survey_id', 1), ('question_id', 10))
+        return {lookup: {'responses': 1}}, {lookup + (('choice_id', choice_id),): {'votes': 1}}, {}
+
+    async def test_coalesced_fanout(self):
+        publisher = Publisher(tick=60, queue_size=2)
+        subscribers = [publisher.subscribe(1) for _ in range(3)]
+        for version, choice_id in ((1, 100), (3, 100), (2, 101)):
+            publisher.publish(1, version, *self.delta(choice_id))
+        publisher.publish(2, 4, *self.delta(100))
+        publisher.flush()
+        for subscriber in subscribers:
+            self.assertEqual(subscriber.queue.qsize(), 1)
+        message = subscribers[0].queue.get_nowait()
+        self.assertEqual((message.first, message.last), (1, 3))
+        event = message.data.decode().split('\n')
+        self.assertEqual(event[:2], ['event: delta', 'id: 1'])
+        self.assertEqual(json.loads(event[2][len('data: '):]), {
+            'questions': {'10': {'responses': 3}}, 'choices': {'100': {'votes': 2}, '101': {'votes': 1}}, 'ratings': {},
+        })
+
+        for version in range(5, 8):
+            publisher.publish(1, version, *self.delta(100))
+            publisher.flush()
+        self.assertIs(subscribers[1].queue.get_nowait(), RESYNC)
+        self.assertTrue(subscribers[1].queue.empty())
+        for subscriber in subscribers:
+            publisher.unsubscribe(subscriber)
+        self.assertFalse(publisher.subscribers)
+        publisher.task.cancel()
+
+    async def test_stream(self):
+        survey = await sync_to_async(make_survey)(await User.objects.acreate(username='author'))
+        await self.async_client.aforce_login(await User.objects.aget(username='author'))
+        response = await self.async_client.get(reverse('polls:survey_live_stream', args=[survey.pk]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = aiter(response.streaming_content)
+        self.assertTrue((await anext(events)).startswith(b'retry:'))
+        self.assertTrue((await anext(events)).startswith(b'event: snapshot'))
+        get_publisher().publish(survey.pk, next(get_aggregator().versions), *self.delta(100))
+        get_publisher().flush()
+        self.assertTrue((await anext(events)).startswith(b'event: delta'))
+        await events.aclose()
+
+    async def test_snapshot_version(self):
+        """Дельта, уже учтённая в снимке, не повторяется; частично учтённая заменяется снимком."""
+        survey = await sync_to_async(make_survey)(await User.objects.acreate(username='author'))
+        await self.async_client.aforce_login(await User.objects.aget(username='author'))
+        response = await self.async_client.get(reverse('polls:survey_live_stream', args=[survey.pk]))
+        events = aiter(response.streaming_content)
+        await anext(events)
+        self.assertTrue((await anext(events)).startswith(b'event: snapshot'))
+        _, _, version = await sync_to_async(get_aggregator().snapshot)(survey.pk)
+        publisher = get_publisher()
+        publisher.publish(survey.pk, version, *self.delta(100))
+        publisher.flush()
+        publisher.publish(survey.pk, version + 1, *self.delta(101))
+        publisher.flush()
+        event = (await anext(events)).decode()
+        self.assertTrue(event.startswith('event: delta'))
+        self.assertIn('"101"', event)
+        self.assertNotIn('"100"', event)
+        publisher.publish(survey.pk, version, *self.delta(100))
+        publisher.publish(survey.pk, version + 1, *self.delta(101))
+        publisher.flush()
+        self.assertTrue((await anext(events)).startswith(b'event: snapshot'))
+        await events.aclose()
+
+    async def test_author_only(self):
+        survey = await sync_to_async(make_survey)(await User.objects.acreate(username='author'))
+        await self.async_client.aforce_login(await User.objects.acreate(username='respondent'))
+        response = await self.async_client.get(reverse('polls:survey_live_stream', args=[survey.pk]))
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(SUBMISSION_THROTTLE={'USER_RATE': None, 'SURVEY_RATE': None})
+class RankingStatsTests(TestCase):
+    """Места ранжирования пишутся при отправке и дают те же итоги, что разбор ranking_answer."""
+
+    def setUp(self):
+        get_submitted().clear()
+        get_survey_cache().clear()
+        self.author = User.objects.create_user('author')
+        self.survey = Survey.objects.create(title='Предпочтения', author=self.author)
+        self.question = Question.objects.create(survey=self.survey, text='Порядок', question_type='ranking')
+        self.choices = [choice.id for choice in Choice.objects.bulk_create(
+            Choice(question=self.question, text=f'Вариант {i}') for i in range(4))]
+        self.client = APIClient()
+
+    def submit(self, name, ranking):
+        self.client.force_authenticate(User.objects.create_user(name))
+        payload = [{'question': self.question.id, 'ranking_answer': ranking}]
+        response = self.client.post(reverse('polls:submit_answers', args=[self.survey.pk]), payload, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_matches_brute_force(self):
+        a, b, c, d = self.choices
+        rankings = [[a, b, c, d], [b, a, d, c], [c, a], [a, c, b], [d]]
+        for number, ranking in enumerate(rankings):
+            self.submit(f'user{number}', ranking)
+        self.assertEqual(RankingPosition.objects.filter(question=self.question).count(), 14)
+
+        url = reverse('polls:question_ranking_stats_api', args=[self.survey.pk, self.question.pk])
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_authenticate(self.author)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        self.assertEqual(data['responses'], 5)
+        by_choice = {choice['id']: choice for choice in data['choices']}
+        for choice_id in self.choices:
+            places = [ranking.index(choice_id) + 1 for ranking in rankings if choice_id in ranking]
+            self.assertAlmostEqual(by_choice[choice_id]['mean_rank'], sum(places) / len(places), places=4)
+            self.assertEqual(by_choice[choice_id]['borda'],
+                             sum(len(ranking) - place for ranking, place in zip(
+                                 [r for r in rankings if choice_id in r], places)))
+            self.assertEqual(by_choice[choice_id]['first'], sum(ranking[0] == choice_id for ranking in rankings))
+        wins = data['pairwise']['wins']
+        order = data['pairwise']['choices']
+        for i, first in enumerate(order):
+            for j, second in enumerate(order):
+                expected = sum(
+                    first in ranking and (second not in ranking or ranking.index(first) < ranking.index(second))
+                    for ranking in rankings
+                )
+                self.assertEqual(wins[i][j], expected)
+
+    def test_deleted_choice(self):
+        """Места после удалённого варианта сдвигаются, итоги совпадают со сводной таблицей."""
+        a, b, c, d = self.choices
+        self.submit('first', [a, b, c])
+        self.submit('second', [d, a])
+        Choice.objects.filter(pk=a).delete()
+        self.client.force_authenticate(self.author)
+        data = self.client.get(reverse('polls:question_ranking_stats_api', args=[self.survey.pk, self.question.pk])).data
+        by_choice = {choice['id']: choice for choice in data['choices']}
+        self.assertEqual({choice_id: by_choice[choice_id]['ranked'] for choice_id in (b, c, d)}, {b: 1, c: 1, d: 1})
+        self.assertEqual({choice_id: by_choice[choice_id]['mean_rank'] for choice_id in (b, c, d)}, {b: 1, c: 2, d: 1})
+        borda = dict(ChoiceResult.objects.filter(choice__question=self.question).values_list('choice_id', 'borda'))
+        self.assertEqual({choice_id: by_choice[choice_id]['borda'] for choice_id in (b, c)}, {b: borda[b], c: borda[c]})
+        self.assertEqual((by_choice[b]['borda'], by_choice[c]['borda'], by_choice[d]['first']), (1, 0, 1))
+
+    def test_user_deletion(self):
+        a, b, c, d = self.choices
+        self.submit('first', [b, a, c])
+        self.submit('second', [b, d])
+        User.objects.get(username='first').delete()
+        self.assertEqual(list(RankingPosition.objects.order_by('position').values_list('choice_id', flat=True)), [b, d])
+
+    def test_archived_survey(self):
+        a, b, c, d = self.choices
+        self.submit('first', [b, a, c])
+        self.submit('second', [b, d])
+        expected = ranking_stats(load_positions(self.survey, self.question.pk), self.choices)
+        Survey.objects.filter(pk=self.survey.pk).update(is_active=False)
+        self.survey.refresh_from_db()
+        with tempfile.TemporaryDirectory() as directory, override_settings(POLLS_ARCHIVE_ROOT=directory):
+            with CaptureQueriesContext(connection) as ctx:
+                archive_survey(self.survey)
+            self.assertFalse(RankingPosition.objects.exists())
+            # Ответы и места удаляются без выборки id удаляемых строк
+            deletes = [query['sql'] for query in ctx.captured_queries if query['sql'].startswith('DELETE')]
+            self.assertEqual(len(deletes), 2)
+            self.assertFalse([query for query in deletes if '"answer_id" IN' in query])
+            archived = ranking_stats(load_positions(self.survey, self.question.pk), self.choices)
+            restore_survey(self.survey)
+        self.assertEqual(RankingPosition.objects.count(), 5)
+        for key in ('borda', 'first', 'wins'):
+            self.assertEqual(archived[key].tolist(), expected[key].tolist())
+        self.assertEqual(archived['borda'].tolist(), [1, 3, 0, 0])
@@ -0,0 +1,233 @@
+import heapq
+import math
+import threading
+from array import array
+
+from django.conf import settings
+
+from . import archive
+from .cache import LRUCacheBackend
+from .models import Answer, answer_id_overlap
+from .search import tokenize
+
+TEXT_STATS_CHUNK_SIZE = 5000
+NGRAM_SIZES = (1, 2, 3)
+
+# Частые служебные слова не попадают в топ терминов, но остаются внутри n-грамм
+STOP_WORDS = frozenset(
+    'и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было '
+    'вот от меня еще нет о из ему теперь когда даже ну ли если уже или ни быть был него до вас нибудь '
+    'опять уж вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их чем была '
+    'сам чтоб без будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой совсем ним '
+    'здесь этом один почти мой тем чтобы нее были куда зачем всех никогда можно при наконец два об другой '
+    'хоть после над больше тот через эти нас про всего них какая много разве три эту моя впрочем хорошо '
+    'свою этой перед иногда лучше чуть том нельзя такой им более всегда конечно всю между '
+    'a an the and or of to in on for with is are was were be it this that i you we they not no'.split()
+)
+
+
+def hash64(value):
+    # Статистика живёт в памяти одного процесса, поэтому подходит встроенный hash() (SipHash)
+    return hash(value) & 0xFFFFFFFFFFFFFFFF
+
+
+class CountMinSketch:
+    """Оценка частоты сверху с ошибкой не больше e / width * N с вероятностью 1 - exp(-depth).
+
+    Используется консервативное обновление: растут только ячейки, равные
+    минимуму, что заметно уменьшает завышение оценок.
+    """
+
+    def __init__(self, width=4096, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = array('q', bytes(8 * width * depth))
+        self.total = 0
+
+    def _cells(self, hashed):
+        # Двойное хэширование: строки таблицы из двух половин одного хэша
+        low, high = hashed & 0xFFFFFFFF, hashed >> 32
+        width = self.width
+        return [row * width + (low + row * high) % width for row in range(self.depth)]
+
+    def add(self, hashed):
+        """Учитывает элемент и возвращает новую оценку его частоты."""
+        table = self.table
+        cells = self._cells(hashed)
+        estimate = min(table[cell] for cell in cells) + 1
+        for cell in cells:
+            if table[cell] < estimate:
+                table[cell] = estimate
+        self.total += 1
+        return estimate
+
+    def estimate(self, hashed):
+        return min(self.table[cell] for cell in self._cells(hashed))
+
+    def error_bound(self):
+        return math.ceil(math.e / self.width * self.total)
+
+
+class HeavyHitters:
+    """k самых частых элементов потока по оценкам count-min; память O(k + width * depth).
+
+    Минимум топа хранится в куче с ленивым обновлением: запись с устаревшей
+    оценкой исправляется, только когда оказывается на вершине.
+    """
+
+    def __init__(self, capacity, sketch=None):
+        self.capacity = capacity
+        self.sketch = sketch or CountMinSketch()
+        self.top = {}
+        self.heap = []
+
+    def add(self, item):
+        estimate = self.sketch.add(hash64(item))
+        top, heap = self.top, self.heap
+        if item in top:
+            top[item] = estimate
+            return
+        if len(top) < self.capacity:
+            top[item] = estimate
+            heapq.heappush(heap, (estimate, item))
+            return
+        if estimate <= heap[0][0]:
+            return
+        while heap[0][0] != top[heap[0][1]]:
+            heapq.heapreplace(heap, (top[heap[0][1]], heap[0][1]))
+        if estimate > heap[0][0]:
+            del top[heapq.heapreplace(heap, (estimate, item))[1]]
+            top[item] = estimate
+
+    def most_common(self, count):
+        return heapq.nsmallest(count, self.top.items(), key=lambda item: (-item[1], item[0]))
+
+
+class HyperLogLog:
+    """Оценка числа различных элементов; стандартная ошибка около 1.04 / sqrt(2 ** precision)."""
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, hashed):
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            # Малые мощности: линейный подсчёт точнее
+            estimate = size * math.log(size / zeros)
+        return round(estimate)
+
+
+class QuestionTextStats:
+    """Частоты терминов, n-грамм и число различных ответов на текстовый вопрос.
+
+    Ответы читаются потоком пачками; память ограничена размерами скетчей
+    и не зависит от числа ответов. Статистика дополняется ответами после
+    watermark (см. AnswerQuerySet.since), поэтому повторный запрос читает только
+    новые ответы; id учтённых ответов из перечитываемого окна хранятся в recent.
+    Архив опроса не меняется и читается один раз.
+    """
+
+    def __init__(self, question_id, capacity):
+        self.question_id = question_id
+        self.watermark = 0
+        self.recent = set()
+        self.complete = False
+        self.responses = 0
+        self.tokens = 0
+        self.ngrams = {size: HeavyHitters(capacity) for size in NGRAM_SIZES}
+        self.distinct = HyperLogLog()
+        self.lock = threading.Lock()
+
+    def add(self, text):
+        words = tokenize(text)
+        if not words:
+            return
+        self.responses += 1
+        self.tokens += len(words)
+        self.distinct.add(hash64(' '.join(words)))
+        for word in words:
+            if word not in STOP_WORDS:
+                self.ngrams[1].add(word)
+        for size in NGRAM_SIZES[1:]:
+            for start in range(len(words) - size + 1):
+                self.ngrams[size].add(' '.join(words[start:start + size]))
+
+    def refresh(self, survey):
+        if survey.is_archived:
+            if self.complete:
+                return
+            # Строки архива упорядочены не по id, поэтому watermark — максимум
+            rows = ((row[0], row[4]) for row in archive.iter_rows(survey)
+                    if row[2] == self.question_id and row[4] and row[0] > self.watermark)
+        else:
+            rows = (
+                Answer.objects.for_survey(survey).since(self.watermark)
+                .filter(question_id=self.question_id, text_answer__isnull=False)
+                .order_by('id').values_list('id', 'text_answer').iterator(chunk_size=TEXT_STATS_CHUNK_SIZE)
+            )
+        for answer_id, text in rows:
+            # Скетчи не идемпотентны: перечитанный ответ учитывается один раз
+            if answer_id in self.recent:
+                continue
+            self.add(text)
+            self.recent.add(answer_id)
+            self.watermark = max(self.watermark, answer_id)
+        low = self.watermark - answer_id_overlap()
+        self.recent = {answer_id for answer_id in self.recent if answer_id > low}
+        self.complete = survey.is_archived
+
+    def summary(self, top):
+        names = {1: 'terms', 2: 'bigrams', 3: 'trigrams'}
+        data = {
+            'question': self.question_id,
+            'responses': self.responses,
+            'tokens': self.tokens,
+            'distinct_responses': self.distinct.count(),
+        }
+        for size, hitters in self.ngrams.items():
+            data[names[size]] = [{'text': text, 'count': count} for text, count in hitters.most_common(top)]
+            # Счётчики — оценки сверху, завышены не больше чем на error
+            data[f'{names[size]}_error'] = hitters.sketch.error_bound()
+        return data
+
+
+_text_stats = None
+_text_stats_lock = threading.Lock()
+
+
+def get_text_stats(survey, question_id):
+    """Статистика вопроса из кэша процесса, дополненная новыми ответами."""
+    global _text_stats
+    with _text_stats_lock:
+        if _text_stats is None:
+            _text_stats = LRUCacheBackend(getattr(settings, 'TEXT_STATS_MAX_QUESTIONS', 50))
+        stats = _text_stats.get(question_id)
+        if stats is None:
+            stats = QuestionTextStats(question_id, getattr(settings, 'TEXT_STATS_CAPACITY', 200))
+            _text_stats.set(question_id, stats)
+    with stats.lock:
+        stats.refresh(survey)
+    return stats
+
+
+def clear_text_stats():
+    with _text_stats_lock:
+        if _text_stats is not None:
+            _text_stats.clear()
+
+
+def question_text_stats(survey, question_id, top):
+    stats = get_text_stats(survey, question_id)
+    with stats.lock:
+        return stats.summary(top)
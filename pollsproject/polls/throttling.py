@@ -0,0 +1,192 @@
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.throttling import BaseThrottle
+
+from .metrics import registry
+from .models import SurveyParticipation
+
+DEFAULT_SUBMISSION_THROTTLE = {
+    'USER_RATE': '10/min',
+    'SURVEY_RATE': '50/s',
+    'MAX_KEYS': 100000,
+}
+
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+
+def parse_rate(rate):
+    # '10/min' -> (10, 60); None отключает ограничение
+    if rate is None:
+        return None
+    count, period = rate.split('/')
+    return int(count), PERIODS[period]
+
+
+def submission_settings():
+    return {**DEFAULT_SUBMISSION_THROTTLE, **getattr(settings, 'SUBMISSION_THROTTLE', {})}
+
+
+class TokenBuckets:
+    """Token bucket на ключ в памяти процесса; давно не использованные ключи вытесняются."""
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, period, now=None):
+        """Забирает один токен; возвращает 0, если запрос разрешён, иначе сколько секунд ждать."""
+        now = time.monotonic() if now is None else now
+        refill = capacity / period
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return 0 if allowed else (1 - tokens) / refill
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SubmittedSet:
+    """Пары (пользователь, опрос), для которых отправка уже точно сохранена."""
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._keys
+
+    def add(self, key):
+        with self._lock:
+            self._keys[key] = True
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+
+_buckets = None
+_submitted = None
+
+
+def get_buckets():
+    global _buckets
+    if _buckets is None:
+        _buckets = TokenBuckets(submission_settings()['MAX_KEYS'])
+    return _buckets
+
+
+def get_submitted():
+    global _submitted
+    if _submitted is None:
+        _submitted = SubmittedSet(submission_settings()['MAX_KEYS'])
+    return _submitted
+
+
+@receiver(setting_changed)
+def reset_submission_guard(setting, **kwargs):
+    global _buckets, _submitted
+    if setting == 'SUBMISSION_THROTTLE':
+        _buckets = _submitted = None
+
+
+class SubmissionThrottle(BaseThrottle):
+    """Базовый throttle отправок: срабатывает до любой работы с ORM в представлении."""
+
+    rate_setting = None
+
+    def get_key(self, request, view):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        rate = parse_rate(submission_settings()[self.rate_setting])
+        if rate is None:
+            return True
+        self.delay = get_buckets().consume(self.get_key(request, view), *rate)
+        if self.delay:
+            registry.increment(f'submissions_throttled_{self.scope}_total')
+        return not self.delay
+
+    def wait(self):
+        return self.delay
+
+
+class SubmissionUserThrottle(SubmissionThrottle):
+    scope = 'user'
+    rate_setting = 'USER_RATE'
+
+    def get_key(self, request, view):
+        return ('user', request.user.pk if request.user.is_authenticated else self.get_ident(request))
+
+
+class SubmissionSurveyThrottle(SubmissionThrottle):
+    scope = 'survey'
+    rate_setting = 'SURVEY_RATE'
+
+    def get_key(self, request, view):
+        return ('survey', view.kwargs.get('survey_id'))
+
+
+SUBMISSION_THROTTLES = [SubmissionUserThrottle, SubmissionSurveyThrottle]
+
+
+def throttle_wait(request, survey_id):
+    """Применяет SUBMISSION_THROTTLES вне DRF; возвращает, сколько секунд ждать, или None.
+
+    request.user уже должен быть аутентифицирован представлением.
+    """
+    view = SimpleNamespace(kwargs={'survey_id': survey_id})
+    waits = [throttle.wait() for throttle in (cls() for cls in SUBMISSION_THROTTLES)
+             if not throttle.allow_request(request, view)]
+    return max(waits) if waits else None
+
+
+class AlreadySubmitted(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "Вы уже ответили на этот опрос"
+    default_code = 'already_submitted'
+
+
+def check_not_submitted(user, survey_id):
+    """Отклоняет повторную отправку: сначала по памяти процесса, затем по SurveyParticipation.
+
+    Таблица ответов не читается. Гонку двух одновременных отправок эта проверка
+    не закрывает: её разрешает unique_participation, строку которого
+    claim_participation вставляет в транзакции сохранения ответов.
+    """
+    if not user.is_authenticated:
+        return
+    key = (user.pk, int(survey_id))
+    submitted = get_submitted()
+    if key not in submitted:
+        if not SurveyParticipation.objects.filter(user=user, survey_id=survey_id).exists():
+            return
+        submitted.add(key)
+    registry.increment('submissions_duplicate_total')
+    raise AlreadySubmitted()
+
+
+def mark_submitted(user, survey_id):
+    if user.is_authenticated:
+        get_submitted().add((user.pk, int(survey_id)))
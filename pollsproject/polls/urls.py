@@ -1,19 +1,9 @@
 from django.urls import path, include
 from django.contrib.auth import views as auth_views
 from . import views
-from rest_framework.decorators import api_view
 
 app_name = 'polls'
 
-@api_view(['POST'])
-def add_questions_api(request, survey_id):
-    survey = get_object_or_404(Survey, pk=survey_id)
-    serializer = QuestionSerializer(data=request.data, many=True)
-    if serializer.is_valid():
-        serializer.save(survey=survey)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
 urlpatterns = [
     # Обычные маршруты (для шаблонов)
     path('', views.index, name='index'),
@@ -24,14 +14,27 @@ urlpatterns = [
     path('auth/', include('django.contrib.auth.urls')),
     path('register/', views.register, name='register'),
     path('profile/<str:username>/', views.profile, name='profile'),
+    path('metrics', views.metrics_view, name='metrics'),
 
     # API-маршруты (для React)
     path('api/surveys/', views.SurveyList.as_view(), name='survey_list_api'),
     path('api/surveys/create/', views.SurveyCreate.as_view(), name='survey_create_api'),
     path('api/surveys/<int:pk>/', views.SurveyDetail.as_view(), name='survey_detail_api'),
-    path('api/surveys/<int:survey_id>/questions/', add_questions_api, name='add_questions_api'),
+    path('api/surveys/<int:survey_id>/questions/', views.add_questions_api, name='add_questions_api'),
+    path('api/surveys/import/', views.import_survey, name='survey_import_api'),
     path('api/register/', views.RegisterView.as_view(), name='api_register'),
     path('api/login/', views.LoginView.as_view(), name='api_login'),
     path('api/profile/<str:username>/', views.profile_view, name='profile_api'),
     path('api/surveys/<int:survey_id>/submit/', views.SubmitAnswers.as_view(), name='submit_answers'),
+    path('api/surveys/<int:survey_id>/submit-async/', views.submit_answers_async, name='submit_answers_async'),
+    path('api/surveys/<int:survey_id>/results/', views.results_view, name='survey_results_api'),
+    path('api/surveys/<int:survey_id>/live/', views.live_results_view, name='survey_live_api'),
+    path('api/surveys/<int:survey_id>/live/stream/', views.live_stream, name='survey_live_stream'),
+    path('api/surveys/<int:survey_id>/crosstab/', views.crosstab_view, name='survey_crosstab_api'),
+    path('api/surveys/<int:survey_id>/export/<str:fmt>/', views.export_view, name='survey_export_api'),
+    path('api/surveys/<int:survey_id>/questions/<int:question_id>/text-stats/', views.text_stats_view,
+         name='question_text_stats_api'),
+    path('api/surveys/<int:survey_id>/questions/<int:question_id>/ranking-stats/', views.ranking_stats_view,
+         name='question_ranking_stats_api'),
+    path('api/search/', views.search_view, name='search_api'),
 ]
\ No newline at end of file
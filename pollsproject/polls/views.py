@@ -1,4 +1,14 @@
+import json
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, get_object_or_404, redirect
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+from rest_framework.exceptions import APIException, AuthenticationFailed, Throttled, ValidationError
+from rest_framework.settings import api_settings
 from django.forms import formset_factory
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
@@ -9,42 +19,82 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.authtoken.views import ObtainAuthToken
-from rest_framework.decorators import api_view
-from .models import Survey, Question, Choice, Answer
-from .forms import QuestionFormSet, ChoiceFormSet
-from .serializers import SurveySerializer, AnswerSerializer, UserSerializer
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
+from .models import Survey, Answer
+from .forms import SurveyForm, QuestionFormSet, ChoiceFormSet
+from .serializers import SurveySerializer, SurveyDefinitionSerializer, QuestionSerializer, AnswerSerializer, UserSerializer
+from . import archive, authoring
+from .submissions import ARCHIVED, build_answers, form_payload, questions_from_definition, save_submission
+from .results import format_results, survey_results
+from .live import get_aggregator
+from .stream import event_stream
+from .crosstab import parse_filters, survey_crosstab
+from .pagination import SearchPagination, SurveyCursorPagination
+from .search import SEARCH_KINDS, search
+from .textstats import question_text_stats
+from .rankings import question_ranking_stats
+from .cache import get_survey_cache
+from .export import EXPORT_FORMATS, stream_answers
+from .metrics import registry
+from .authentication import remember_token
+from .throttling import SUBMISSION_THROTTLES, AlreadySubmitted, check_not_submitted, mark_submitted, throttle_wait
+from .conditional import detail_etag, index_etag, make_etag, not_modified, set_validators, survey_etag
+from .outbox import enqueue_submission
 
 class SubmitAnswers(generics.CreateAPIView):
     serializer_class = AnswerSerializer
     permission_classes = [IsAuthenticated]
+    throttle_classes = SUBMISSION_THROTTLES
 
     def create(self, request, *args, **kwargs):
-        survey_id = self.kwargs['survey_id']
-        survey = get_object_or_404(Survey, pk=survey_id)
+        check_not_submitted(request.user, self.kwargs['survey_id'])
+        survey = get_object_or_404(Survey, pk=self.kwargs['survey_id'])
         if not survey.is_active:
             return Response({"detail": "Survey is not active"}, status=status.HTTP_400_BAD_REQUEST)
-        answers_data = request.data  
-        for answer_data in answers_data:
-            answer_data['survey'] = survey_id
-            answer_data['user'] = request.user.id
-            serializer = self.get_serializer(data=answer_data)
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
+        save_submission(survey, request.user, request.data)
+        mark_submitted(request.user, survey.pk)
         return Response({"message": "Ответы сохранены"}, status=status.HTTP_201_CREATED)
 
 
 class SurveyList(generics.ListAPIView):
-    queryset = Survey.objects.all()
     serializer_class = SurveySerializer
+    pagination_class = SurveyCursorPagination
     permission_classes = [IsAuthenticated] 
+
+    def get_fields(self):
+        # ?fields=id,title — только нужные поля, ?expand=questions — вместе с вопросами
+        available = SurveySerializer.Meta.fields
+        requested = self.request.query_params.get('fields')
+        if requested:
+            fields = [name for name in available if name in requested.split(',')]
+        else:
+            fields = [name for name in available if name != 'questions']
+        if 'questions' in self.request.query_params.get('expand', '').split(',') and 'questions' not in fields:
+            fields.append('questions')
+        return fields
+
+    def get_queryset(self):
+        return Survey.objects.select_related('author')
+
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
+        fields = self.get_fields()
+        page = self.paginate_queryset(self.get_queryset())
+        # ETag по id и версиям опросов страницы: если страница не менялась,
+        # вопросы не загружаются и ничего не сериализуется
+        etag = make_etag(*(f'{survey.pk}.{survey.version}' for survey in page), request.get_full_path(),
+                         request.user.pk, request.user.username, request.user.email)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+        if 'questions' in fields:
+            prefetch_related_objects(page, 'questions__choices')
+        serializer = self.get_serializer(page, many=True, fields=fields)
         user_serializer = UserSerializer(request.user)  
-        return Response({
+        return set_validators(Response({
             'surveys': serializer.data,
-            'user': user_serializer.data
-        })
+            'user': user_serializer.data,
+            'next': self.paginator.get_next_link(),
+        }), etag)
 
 class RegisterView(APIView):
     permission_classes = [AllowAny]
@@ -52,8 +102,9 @@ class RegisterView(APIView):
         serializer = UserSerializer(data=request.data)
         if serializer.is_valid():
             user = serializer.save()
-            token, created = Token.objects.get_or_create(user=user)
+            token = Token.objects.create(user=user)
             login(request, user)  
+            remember_token(token)
             return Response({'token': token.key, 'user_id': user.id, 'username': user.username})
         return Response(serializer.errors, status=400)
 
@@ -65,6 +116,7 @@ class LoginView(ObtainAuthToken):
         user = serializer.validated_data['user']
         token, created = Token.objects.get_or_create(user=user)
         login(request, user)  
+        remember_token(token)
         return Response({'token': token.key, 'user_id': user.id, 'username': user.username})
 
 class SurveyCreate(generics.CreateAPIView):
@@ -76,17 +128,29 @@ class SurveyCreate(generics.CreateAPIView):
         serializer.save(author=self.request.user)
 
 class SurveyDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Survey.objects.all()
+    queryset = Survey.objects.select_related('author')
     serializer_class = SurveySerializer
     permission_classes = [IsAuthenticated]
 
+    def retrieve(self, request, *args, **kwargs):
+        survey = self.get_object()
+        etag = survey_etag(survey)
+        response = not_modified(request, etag, survey.last_modified)
+        if response is None:
+            response = Response(get_survey_cache().get_or_build(survey, 'api', lambda: self.serialize(survey)))
+        return set_validators(response, etag, survey.last_modified)
+
+    def serialize(self, survey):
+        prefetch_related_objects([survey], 'questions__choices')
+        return self.get_serializer(survey).data
+
     def put(self, request, *args, **kwargs):
         if self.get_object().author != request.user:
             return Response({"detail": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
         return super().put(request, *args, **kwargs)
 
 class SurveyEdit(generics.RetrieveUpdateAPIView):
-    queryset = Survey.objects.all()
+    queryset = Survey.objects.with_questions()
     serializer_class = SurveySerializer
     permission_classes = [IsAuthenticated]
 
@@ -94,25 +158,32 @@ class SurveyEdit(generics.RetrieveUpdateAPIView):
         serializer.save(author=self.request.user)
 
 @api_view(['POST'])
-def add_questions(request, survey_id):
+def add_questions_api(request, survey_id):
     survey = get_object_or_404(Survey, pk=survey_id)
     if survey.author != request.user:
         return Response({"detail": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
-    for q_data in request.data:
-        question = Question.objects.create(
-            survey=survey,
-            text=q_data['text'],
-            question_type=q_data['question_type']
-        )
-        for choice_text in q_data.get('choices', []):
-            if choice_text:
-                Choice.objects.create(question=question, text=choice_text)
-    return Response({"detail": "Questions added"}, status=status.HTTP_201_CREATED)
+    serializer = QuestionSerializer(data=request.data, many=True)
+    serializer.is_valid(raise_exception=True)
+    serializer.save(survey=survey)
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def import_survey(request):
+    # Опрос целиком из JSON: {"title", "is_active", "questions": [{"text", "question_type", "choices"}]}
+    data = request.data
+    if not isinstance(data, dict):
+        return Response({"detail": "Ожидается объект опроса"}, status=status.HTTP_400_BAD_REQUEST)
+    survey, questions = authoring.create_survey(
+        request.user, data.get('title'), data.get('questions'), is_active=bool(data.get('is_active', True))
+    )
+    return Response({'id': survey.id, 'questions': [question.id for question in questions]},
+                    status=status.HTTP_201_CREATED)
 
 @api_view(['GET'])
 def profile_view(request, username):
     user = get_object_or_404(User, username=username)
-    surveys = Survey.objects.filter(questions__answers__user=user).distinct()
+    surveys = Survey.objects.filter(participations__user=user).order_by('-participations__submitted_at').with_questions()
     return Response({
         "user": {
             "username": user.username,
@@ -123,85 +194,279 @@ def profile_view(request, username):
         "surveys": SurveySerializer(surveys, many=True).data
     })
 
+@api_view(['GET'])
+def results_view(request, survey_id):
+    # Итоги, как и выгрузка ответов, видит только автор опроса
+    survey = get_object_or_404(Survey, pk=survey_id)
+    if survey.author != request.user:
+        return Response({"detail": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
+    return Response(survey_results(survey))
+
+@api_view(['GET'])
+def live_results_view(request, survey_id):
+    # Итоги из памяти процесса: опрос и определение — из кэша, ответы и сводные таблицы не читаются
+    survey = get_object_or_404(Survey.objects.only('id', 'title', 'version', 'author_id'), pk=survey_id)
+    if survey.author_id != request.user.pk:
+        return Response({"detail": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
+    definition = get_survey_cache().get_or_build(survey, 'definition', lambda: survey_definition(survey))
+    totals, age, _ = get_aggregator().snapshot(survey.pk)
+    data = format_results(survey.pk, survey.title, definition['questions'], *totals)
+    data['age'] = round(age, 3)
+    return Response(data)
+
+@api_view(['GET'])
+def crosstab_view(request, survey_id):
+    # ?target=<id вопроса>&filter=<id вопроса>:<значение>[,<значение>] (фильтров может быть несколько)
+    survey = get_object_or_404(Survey, pk=survey_id)
+    if survey.author != request.user:
+        return Response({"detail": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
+    definition = get_survey_cache().get_or_build(survey, 'definition', lambda: survey_definition(survey))
+    questions = {question['id']: question for question in definition['questions']}
+    try:
+        target = questions[int(request.query_params.get('target', ''))]
+    except (ValueError, KeyError):
+        return Response({"detail": "Параметр target должен быть id вопроса этого опроса"},
+                        status=status.HTTP_400_BAD_REQUEST)
+    filters = parse_filters(request.query_params.getlist('filter'), questions)
+    return Response(survey_crosstab(survey, target, filters))
+
+@api_view(['GET'])
+def text_stats_view(request, survey_id, question_id):
+    # ?top=<число> — сколько терминов и n-грамм вернуть (по умолчанию 20, не больше 100)
+    survey = get_object_or_404(Survey, pk=survey_id)
+    if survey.author != request.user:
+        return Response({"detail": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
+    get_object_or_404(survey.questions, pk=question_id, question_type='text')
+    try:
+        top = min(max(int(request.query_params.get('top', 20)), 1), 100)
+    except ValueError:
+        return Response({"detail": "Параметр top должен быть числом"}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(question_text_stats(survey, question_id, top))
+
+@api_view(['GET'])
+def ranking_stats_view(request, survey_id, question_id):
+    # Средние места, очки Борда и матрица попарных побед вопроса ranking
+    survey = get_object_or_404(Survey, pk=survey_id)
+    if survey.author != request.user:
+        return Response({"detail": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
+    question = get_object_or_404(survey.questions, pk=question_id, question_type='ranking')
+    return Response(question_ranking_stats(survey, question))
+
+@api_view(['GET'])
+def search_view(request):
+    # ?q=<запрос>&type=survey,question,answer&page=<номер>; текстовые ответы — только в своих опросах
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({"detail": "Параметр q обязателен"}, status=status.HTTP_400_BAD_REQUEST)
+    kinds = request.query_params.get('type', ','.join(SEARCH_KINDS)).split(',')
+    if set(kinds) - set(SEARCH_KINDS):
+        return Response({"detail": f"Параметр type: допустимы {', '.join(SEARCH_KINDS)}"},
+                        status=status.HTTP_400_BAD_REQUEST)
+    paginator = SearchPagination()
+    results = paginator.paginate_search(
+        lambda offset, limit: search(query, request.user, kinds, offset, limit), request
+    )
+    return Response({'next': paginator.get_next_link(), 'results': results})
+
+@api_view(['GET'])
+def export_view(request, survey_id, fmt):
+    survey = get_object_or_404(Survey, pk=survey_id)
+    if survey.author != request.user:
+        return Response({"detail": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
+    if fmt not in EXPORT_FORMATS:
+        raise Http404
+    response = StreamingHttpResponse(stream_answers(survey, fmt), content_type=EXPORT_FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="survey-{survey.pk}.{fmt}"'
+    return response
+
 @api_view(['POST'])
+@throttle_classes(SUBMISSION_THROTTLES)
 def submit_answers(request, survey_id):
+    check_not_submitted(request.user, survey_id)
     survey = get_object_or_404(Survey, pk=survey_id)
     if not survey.is_active:
         return Response({"detail": "Survey is not active"}, status=status.HTTP_400_BAD_REQUEST)
-    
-    for answer_data in request.data:
-        question = get_object_or_404(Question, pk=answer_data['question'], survey=survey)
-        if question.question_type == 'radio':
-            choice = get_object_or_404(Choice, pk=answer_data['choice'], question=question)
-            Answer.objects.create(question=question, choice=choice, user=request.user)
-        elif question.question_type == 'checkbox':
-            for choice_id in answer_data['choices']:
-                choice = get_object_or_404(Choice, pk=choice_id, question=question)
-                Answer.objects.create(question=question, choice=choice, user=request.user)
-        elif question.question_type == 'text':
-            Answer.objects.create(question=question, text_answer=answer_data['text_answer'], user=request.user)
-        elif question.question_type == 'rating':
-            Answer.objects.create(question=question, rating_answer=answer_data['rating_answer'], user=request.user)
-        elif question.question_type == 'yesno':
-            Answer.objects.create(question=question, yesno_answer=answer_data['yesno_answer'], user=request.user)
-        elif question.question_type == 'ranking':
-            Answer.objects.create(question=question, ranking_answer=answer_data['ranking_answer'], user=request.user)
+
+    save_submission(survey, request.user, request.data)
+    mark_submitted(request.user, survey.pk)
     return Response({"detail": "Answers submitted"}, status=status.HTTP_201_CREATED)
 
+def metrics_view(request):
+    cache_stats = get_survey_cache().stats()
+    body = registry.render({
+        'survey_cache_hits_total': cache_stats['hits'],
+        'survey_cache_misses_total': cache_stats['misses'],
+    })
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def survey_definition(survey):
+    prefetch_related_objects([survey], 'questions__choices')
+    return SurveyDefinitionSerializer(survey).data
+
+async def authenticate_request(request):
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        result = await sync_to_async(authentication_class().authenticate)(request)
+        if result is not None:
+            return result[0]
+    return None
+
+async def live_stream(request, survey_id):
+    # Server-Sent Events с дельтами живых счётчиков; нужен ASGI-сервер (pollsproject.asgi)
+    try:
+        user = await authenticate_request(request) or await request.auser()
+    except AuthenticationFailed as exc:
+        return JsonResponse({"detail": exc.detail}, status=401)
+    if not user.is_authenticated:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+    author_id = await Survey.objects.filter(pk=survey_id).values_list('author_id', flat=True).afirst()
+    if author_id is None:
+        raise Http404
+    if author_id != user.pk:
+        return JsonResponse({"detail": "Not authorized"}, status=403)
+    response = StreamingHttpResponse(event_stream(survey_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Отключает буферизацию ответа в nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@csrf_exempt
+async def submit_answers_async(request, survey_id):
+    # Ответы проверяются по закэшированному определению опроса и ставятся в очередь;
+    # в таблицу ответов их пакетами переносит manage.py drain_outbox
+    if request.method != 'POST':
+        return JsonResponse({"detail": "Method not allowed"}, status=405)
+    try:
+        user = await authenticate_request(request)
+    except AuthenticationFailed as exc:
+        return JsonResponse({"detail": exc.detail}, status=401)
+    if user is None:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+    # Те же ограничения, что у SubmitAnswers: throttle до любой работы с ORM, затем проверка повтора
+    request.user = user
+    wait = throttle_wait(request, survey_id)
+    if wait is not None:
+        exc = Throttled(wait)
+        response = JsonResponse({"detail": exc.detail}, status=exc.status_code)
+        response['Retry-After'] = str(exc.wait)
+        return response
+    try:
+        await sync_to_async(check_not_submitted)(user, survey_id)
+    except AlreadySubmitted as exc:
+        return JsonResponse({"detail": exc.detail}, status=exc.status_code)
+    key = request.headers.get('Idempotency-Key', '').strip()
+    if not key or len(key) > 100:
+        return JsonResponse({"detail": "Требуется заголовок Idempotency-Key (до 100 символов)"}, status=400)
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({"detail": "Некорректный JSON"}, status=400)
+    try:
+        survey = await Survey.objects.aget(pk=survey_id)
+    except Survey.DoesNotExist:
+        return JsonResponse({"detail": "Not found."}, status=404)
+    if not survey.is_active:
+        return JsonResponse({"detail": "Survey is not active"}, status=400)
+    if survey.is_archived:
+        return JsonResponse({"detail": ARCHIVED}, status=400)
+
+    definition = await sync_to_async(get_survey_cache().get_or_build)(
+        survey, 'definition', lambda: survey_definition(survey)
+    )
+    try:
+        build_answers(survey, user, payload, questions_from_definition(definition))
+    except ValidationError as exc:
+        return JsonResponse(exc.detail, status=400, safe=False)
+    entry = await sync_to_async(enqueue_submission)(survey, user, key, payload)
+    return JsonResponse({"id": entry.id, "status": entry.status}, status=202)
+
+@condition(etag_func=index_etag)
 def index(request):
     surveys = Survey.objects.all()  
     return render(request, 'polls/index.html', {'surveys': surveys})
 
+def ranked_choice_texts(ranking, choice_texts):
+    # Удалённые или некорректные варианты в ranking_answer пропускаются
+    texts = []
+    for choice_id in ranking:
+        try:
+            texts.append(choice_texts[int(choice_id)])
+        except (KeyError, TypeError, ValueError):
+            continue
+    return texts
+
+@condition(etag_func=detail_etag)
 def detail(request, survey_id):
     survey = get_object_or_404(Survey, pk=survey_id)
-    user_answers = Answer.objects.filter(question__survey=survey, user=request.user) if request.user.is_authenticated else None
+    definition = get_survey_cache().get_or_build(survey, 'definition', lambda: survey_definition(survey))
+    choice_texts = {choice['id']: choice['text'] for question in definition['questions'] for choice in question['choices']}
+    user_answers = []
+    if request.user.is_authenticated and survey.is_archived:
+        user_answers = archive.answer_objects(
+            survey, archive.user_rows(survey, request.user), questions_from_definition(definition)
+        )
+    elif request.user.is_authenticated:
+        user_answers = Answer.objects.for_survey(survey).filter(user=request.user).select_related('question', 'choice')
     answers_with_ranking = []
-    if user_answers:
-        for answer in user_answers:
-            answer_data = {'answer': answer}
-            if answer.question.question_type == 'ranking' and answer.ranking_answer:
-                ranked_choices = [answer.question.choices.get(id=choice_id).text for choice_id in answer.ranking_answer]
-                answer_data['ranked_choices'] = ranked_choices
-            answers_with_ranking.append(answer_data)
+    for answer in user_answers:
+        answer_data = {'answer': answer}
+        if answer.question.question_type == 'ranking' and isinstance(answer.ranking_answer, list):
+            answer_data['ranked_choices'] = ranked_choice_texts(answer.ranking_answer, choice_texts)
+        answers_with_ranking.append(answer_data)
     context = {
         'survey': survey,
+        'definition': definition,
         'user_answers': answers_with_ranking,
     }
-    if request.method == 'POST' and not user_answers and survey.is_active:
-        if not request.POST:
-            context['error_message'] = 'Форма пуста'
+    if request.method == 'POST' and not answers_with_ranking and survey.is_active:
+        if not request.user.is_authenticated:
+            context['error_message'] = 'Войдите, чтобы ответить на опрос'
             return render(request, 'polls/detail.html', context)
-        questions = survey.questions.all()
-        for question in questions:
-            error = save_answer(question, request, request.user)
-            if error:
-                context['error_message'] = error
-                return render(request, 'polls/detail.html', context)
-
+        # Та же пакетная запись, что и в API: проверка всех ответов, один bulk_create, затем сводные таблицы
+        try:
+            payload = form_payload(definition['questions'], request.POST)
+            if not payload:
+                raise ValidationError('Форма пуста')
+            check_not_submitted(request.user, survey.pk)
+            save_submission(survey, request.user, payload)
+        except APIException as exc:
+            context['error_message'] = authoring.first_error(exc.detail)
+            return render(request, 'polls/detail.html', context)
+        mark_submitted(request.user, survey.pk)
         context['show_thanks'] = True
     return render(request, 'polls/detail.html', context)
 
+def formset_questions(request, question_formset):
+    # Дерево вопросов из формсетов шаблона для authoring
+    questions = []
+    for question_form in question_formset:
+        data = question_form.cleaned_data
+        if not data or data.get('DELETE', False):
+            continue
+        choices = []
+        if data['question_type'] in authoring.CHOICE_TYPES:
+            choice_formset = ChoiceFormSet(request.POST, prefix=f'choices-{question_form.prefix}')
+            if choice_formset.is_valid():
+                choices = [{'id': choice_form.cleaned_data.get('id'), 'text': choice_form.cleaned_data['text']}
+                           for choice_form in choice_formset
+                           if choice_form.cleaned_data and not choice_form.cleaned_data.get('DELETE', False)]
+        questions.append({'id': data.get('id'), 'text': data['text'], 'question_type': data['question_type'],
+                          'choices': choices})
+    return questions
+
 def create_survey(request):
     if request.method == 'POST':
         title = request.POST.get('title')
         if not title:
             return render(request, 'polls/create_survey.html', {'error': 'Введите название опроса'})
-        survey = Survey.objects.create(title=title, author=request.user if request.user.is_authenticated else None)
         question_formset = QuestionFormSet(request.POST, prefix='questions')
         if question_formset.is_valid():
-            for question_form in question_formset:
-                if question_form.cleaned_data and not question_form.cleaned_data.get('DELETE', False):
-                    question = question_form.save(commit=False)
-                    question.survey = survey
-                    question.save()
-                    if question.question_type in ['radio', 'checkbox', 'ranking']:
-                        choice_formset = ChoiceFormSet(request.POST, prefix=f'choices-{question_form.prefix}')
-                        if choice_formset.is_valid():
-                            for choice_form in choice_formset:
-                                if choice_form.cleaned_data and not choice_form.cleaned_data.get('DELETE', False):
-                                    choice = choice_form.save(commit=False)
-                                    choice.question = question
-                                    choice.save()
+            try:
+                authoring.create_survey(request.user if request.user.is_authenticated else None, title,
+                                        formset_questions(request, question_formset))
+            except ValidationError as exc:
+                return render(request, 'polls/create_survey.html', {
+                    'question_formset': question_formset, 'title': title, 'error': authoring.first_error(exc.detail)
+                })
             return redirect('polls:index')
         else:
             return render(request, 'polls/create_survey.html', {'question_formset': question_formset, 'title': title})
@@ -213,26 +478,18 @@ def add_questions(request, survey_id):
     if request.method == 'POST':
         question_formset = QuestionFormSet(request.POST, prefix='questions')
         if question_formset.is_valid():
-            has_valid_forms = False
-            for question_form in question_formset:
-                if question_form.cleaned_data and not question_form.cleaned_data.get('DELETE', False):
-                    has_valid_forms = True
-                    question = question_form.save(commit=False)
-                    question.survey = survey
-                    question.save()
-                    if question.question_type in ['radio', 'checkbox', 'ranking']:
-                        choice_formset = ChoiceFormSet(request.POST, prefix=f'choices-{question_form.prefix}')
-                        if choice_formset.is_valid():
-                            for choice_form in choice_formset:
-                                if choice_form.cleaned_data and not choice_form.cleaned_data.get('DELETE', False):
-                                    choice = choice_form.save(commit=False)
-                                    choice.question = question
-                                    choice.save()
-            if not has_valid_forms:
+            questions = formset_questions(request, question_formset)
+            error = None if questions else 'Добавьте хотя бы один вопрос'
+            if questions:
+                try:
+                    authoring.add_questions(survey, questions)
+                except ValidationError as exc:
+                    error = authoring.first_error(exc.detail)
+            if error:
                 return render(request, 'polls/add_questions.html', {
                     'survey': survey,
                     'question_formset': question_formset,
-                    'error': 'Добавьте хотя бы один вопрос'
+                    'error': error
                 })
             return redirect('polls:index')
     else:
@@ -258,8 +515,7 @@ def register(request):
 
 def profile(request, username):
     profile = get_object_or_404(User, username=username)
-    user_answers = Answer.objects.filter(user=profile).select_related('question__survey')
-    surveys = Survey.objects.filter(questions__answers__user=profile).distinct()
+    surveys = Survey.objects.filter(participations__user=profile).order_by('-participations__submitted_at')
     context = {
         'profile': profile,
         'surveys': surveys,
@@ -267,39 +523,43 @@ def profile(request, username):
     return render(request, 'polls/profile.html', context)
 
 def edit(request, survey_id):
-    survey = get_object_or_404(Survey, pk=survey_id)
+    survey = get_object_or_404(Survey.objects.with_questions(), pk=survey_id)
     if request.user != survey.author and request.user.is_authenticated:  
         return redirect('polls:index')
+    error = None
     if request.method == 'POST':
         if 'delete_survey' in request.POST:
             survey.delete()
             return redirect('polls:index')
         survey_form = SurveyForm(request.POST, instance=survey)
-        question_formset = QuestionFormSet(request.POST, prefix='questions', queryset=survey.questions.all())
+        question_formset = QuestionFormSet(request.POST, prefix='questions')
         if survey_form.is_valid() and question_formset.is_valid():
-            survey_form.save()
-            for question_form in question_formset:
-                if question_form.cleaned_data and not question_form.cleaned_data.get('DELETE', False):
-                    question = question_form.save(commit=False)
-                    question.survey = survey
-                    question.save()
-                    if question.question_type in ['radio', 'checkbox', 'ranking']:
-                        choice_formset = ChoiceFormSet(request.POST, prefix=f'choices-{question_form.prefix}', queryset=question.choices.all())
-                        if choice_formset.is_valid():
-                            for choice_form in choice_formset:
-                                if choice_form.cleaned_data and not choice_form.cleaned_data.get('DELETE', False):
-                                    choice = choice_form.save(commit=False)
-                                    choice.question = question
-                                    choice.save()
-            return redirect('polls:index')
+            try:
+                with transaction.atomic():
+                    survey_form.save()
+                    authoring.update_questions(survey, formset_questions(request, question_formset))
+            except ValidationError as exc:
+                error = authoring.first_error(exc.detail)
+            else:
+                return redirect('polls:index')
     else:
         survey_form = SurveyForm(instance=survey)
-        question_formset = QuestionFormSet(prefix='questions', queryset=survey.questions.all())
+        question_formset = QuestionFormSet(prefix='questions', initial=[
+            {'id': question.id, 'text': question.text, 'question_type': question.question_type}
+            for question in survey.questions.all()
+        ])
 
-    choice_formsets = [ChoiceFormSet(prefix=f'choices-questions-{i}', queryset=Question.objects.get(id=form.instance.id).choices.all() if form.instance.id else ChoiceFormSet().queryset) for i, form in enumerate(question_formset)]
+    questions = list(survey.questions.all())
+    choice_formsets = [
+        ChoiceFormSet(prefix=f'choices-questions-{i}', initial=[
+            {'id': choice.id, 'text': choice.text} for choice in questions[i].choices.all()
+        ] if i < len(questions) else None)
+        for i in range(question_formset.total_form_count())
+    ]
     return render(request, 'polls/edit.html', {
         'survey': survey,
         'survey_form': survey_form,
         'question_formset': question_formset,
-        'choice_formsets': choice_formsets,
-    })
\ No newline at end of file
+        'question_forms': list(zip(question_formset, choice_formsets)),
+        'error': error,
+    })
@@ -55,17 +55,76 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'polls.middleware.QueryMetricsMiddleware',
 ]
 
+# Метрики запросов (/metrics). SERVER_TIMING добавляет заголовок Server-Timing,
+# DUPLICATE_THRESHOLD — сколько одинаковых запросов за обработку считать признаком N+1
+QUERY_METRICS = {
+    'SERVER_TIMING': DEBUG,
+    'DUPLICATE_THRESHOLD': 3,
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'polls.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',  
     ],
 }
 
+# Число hash-секций polls_answer по survey_id в PostgreSQL (читается миграцией polls 0013)
+POLLS_ANSWER_PARTITIONS = 16
+
+# Живые счётчики результатов в памяти процесса (/api/surveys/<id>/live/):
+# раз в SYNC_INTERVAL секунд опрос перечитывается из сводных таблиц
+LIVE_COUNTERS = {
+    'SHARDS': 16,
+    'SYNC_INTERVAL': 5,
+    'MAX_SURVEYS': 1000,
+}
+
+# SSE-поток живых итогов: дельты рассылаются раз в TICK секунд, отставший клиент
+# (очередь больше QUEUE_SIZE сообщений) получает полный снимок
+LIVE_STREAM = {
+    'TICK': 0.5,
+    'QUEUE_SIZE': 32,
+    'HEARTBEAT': 15,
+}
+
+# Сколько последних id ответов перечитывают матрица среза и поиск без PostgreSQL:
+# ответ с меньшим id может зафиксироваться позже (AnswerQuerySet.since)
+POLLS_ANSWER_ID_OVERLAP = 1000
+
+# Конфигурация полнотекстового поиска PostgreSQL (читается миграцией polls 0015);
+# после смены колонки search_vector нужно пересоздать, иначе manage.py check --database default сообщит polls.E001
+POLLS_SEARCH_CONFIG = 'russian'
+
+# Каталог колоночных архивов ответов закрытых опросов (manage.py archive_answers)
+POLLS_ARCHIVE_ROOT = BASE_DIR / 'archive'
+
+# Кэш проверенных токенов API в памяти процесса
+TOKEN_CACHE = {
+    'MAX_ENTRIES': 10000,
+    'TIMEOUT': 60,
+}
+
+# Ограничение частоты отправок ответов (token bucket в памяти процесса), None — без ограничения
+SUBMISSION_THROTTLE = {
+    'USER_RATE': '10/min',
+    'SURVEY_RATE': '50/s',
+    'MAX_KEYS': 100000,
+}
+
+# Кэш определений опросов. Вместо памяти процесса можно использовать кэш Django
+# (например FileBasedCache или DatabaseCache из CACHES):
+# {'BACKEND': 'polls.cache.DjangoCacheBackend', 'OPTIONS': {'alias': 'default'}}
+SURVEY_CACHE = {
+    'BACKEND': 'polls.cache.LRUCacheBackend',
+    'OPTIONS': {'max_entries': 1000},
+}
+
 ROOT_URLCONF = 'pollsproject.urls'
 CORS_ALLOW_ALL_ORIGINS = True
 
@@ -97,6 +156,15 @@ DATABASES = {
     }
 }
 
+# POLLS_DB=sqlite — локальная база SQLite, например для бенчмарков без PostgreSQL
+if os.environ.get('POLLS_DB') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',